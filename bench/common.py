@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import warnings
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines")
+
+BOT_MODULES = ("exbot", "ex_admin", "ex_owner", "utils", "bot_config")
+
+
+def prepare_environment(db_path=None, verbose=False):
+    """Готовит окружение до импорта модулей бота: токен-заглушка, отдельная БД, тихие логи."""
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+    os.environ.setdefault("TELEGRAM_TOKEN", "123456:BENCH")
+    if db_path is None:
+        db_path = os.path.join(tempfile.mkdtemp(prefix="exbot-bench-"), "database.db")
+    os.environ["DB_PATH"] = db_path
+    import utils
+    utils.DB_PATH = db_path
+    if not verbose:
+        warnings.filterwarnings("ignore", message=".*per_message.*")
+        # Боевые модули пишут DEBUG в bot.log на каждый апдейт — это мерить не нужно
+        import exbot  # noqa: F401  (настраивает свои хендлеры при импорте)
+        for name in BOT_MODULES:
+            logging.getLogger(name).setLevel(logging.ERROR)
+        logging.getLogger().setLevel(logging.ERROR)
+    return db_path
+
+
+def percentiles(samples, points=(50, 90, 99)):
+    if not samples:
+        return {f"p{p}": 0.0 for p in points}
+    ordered = sorted(samples)
+    result = {}
+    for p in points:
+        idx = min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))
+        result[f"p{p}"] = ordered[idx]
+    result["max"] = ordered[-1]
+    result["mean"] = sum(ordered) / len(ordered)
+    return result
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except Exception:
+        return "unknown"
+
+
+def save_baseline(name, results, path=None):
+    path = path or os.path.join(BASELINES_DIR, f"{name}.json")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    document = {
+        "benchmark": name,
+        "revision": git_revision(),
+        "created": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        "python": platform.python_version(),
+        "results": results,
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(document, f, ensure_ascii=False, indent=2, sort_keys=True)
+    return path
+
+
+def load_baseline(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _flatten(prefix, value, out):
+    if isinstance(value, dict):
+        for key, item in value.items():
+            _flatten(f"{prefix}.{key}" if prefix else str(key), item, out)
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        out[prefix] = value
+    return out
+
+
+def compare_results(baseline, current):
+    """Возвращает [(метрика, было, стало, изменение в %)] по всем числовым полям."""
+    old = _flatten("", baseline.get("results", baseline), {})
+    new = _flatten("", current, {})
+    rows = []
+    for key in sorted(set(old) & set(new)):
+        before, after = old[key], new[key]
+        delta = (after - before) / before * 100 if before else 0.0
+        rows.append((key, before, after, delta))
+    return rows
+
+
+def print_comparison(rows, threshold=10.0):
+    for key, before, after, delta in rows:
+        mark = " !" if abs(delta) >= threshold else ""
+        print(f"{key:<48} {before:>14.4f} {after:>14.4f} {delta:>+8.1f}%{mark}")
@@ -0,0 +1,410 @@
+# -*- coding: utf-8 -*-
+"""Локальная замена Bot API для нагрузочных и soak-тестов.
+
+Сервер отвечает на ``getUpdates``, ``sendMessage``, ``editMessageText``,
+``answerCallbackQuery``, ``setWebhook``/``deleteWebhook`` и пр. и ведёт
+скриптованную популяцию пользователей: следующий шаг пользователя
+отправляется боту только после того, как бот ответил на предыдущий, поэтому
+измеряется настоящая задержка, видимая пользователю.
+
+Пример::
+
+    python -m bench.fake_api --port 8081 --clients 10000 --admins 50 \\
+        --active 500 --latency-ms 30 --rate-429 0.01 --db /tmp/soak.db
+
+    DB_PATH=/tmp/soak.db TELEGRAM_TOKEN=123:FAKE \\
+        TELEGRAM_BASE_URL=http://127.0.0.1:8081/bot python exbot.py
+"""
+import argparse
+import email.parser
+import json
+import os
+import random
+import threading
+import time
+import urllib.parse
+import urllib.request
+from collections import Counter, defaultdict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from bench.common import percentiles, save_baseline
+from bench.fake_bot import BOT_ID, BOT_USERNAME
+from bench.synthetic import generate_population
+
+REPLY_METHODS = {"sendMessage", "editMessageText", "sendDocument"}
+LIMITED_METHODS = REPLY_METHODS | {"answerCallbackQuery"}
+
+
+class FakeTelegram:
+    """Состояние сервера: очередь апдейтов, сценарии пользователей, статистика."""
+
+    def __init__(self, scripts=(), active=500, latency_ms=0.0, jitter_ms=0.0,
+                 rate_429=0.0, retry_after=1, global_limit=0, think_ms=0.0, step_timeout=30.0, seed=1):
+        self.cond = threading.Condition()
+        self.pending = deque()
+        self.next_update_id = 1
+        self.next_message_id = 1
+        self.webhook_url = None
+        self.latency = latency_ms / 1000
+        self.jitter = jitter_ms / 1000
+        self.rate_429 = rate_429
+        self.retry_after = retry_after
+        self.global_limit = global_limit
+        self.think = think_ms / 1000
+        self.step_timeout = step_timeout
+        self.rnd = random.Random(seed)
+        self._window_start = time.monotonic()
+        self._window_count = 0
+
+        self.waiting = deque(scripts)
+        self.active = active
+        self.sessions = {}
+        self.started = False
+        self.started_at = None
+        self.finished_at = None
+
+        self.calls = Counter()
+        self.throttled = Counter()
+        self.step_latency = defaultdict(list)
+        self.completed_users = Counter()
+        self.lost_steps = Counter()
+        self.unsolicited = 0
+
+    # --- сценарии -------------------------------------------------------
+
+    def _start_users(self):
+        while self.waiting and len(self.sessions) < self.active:
+            script = self.waiting.popleft()
+            self.sessions[script["user_id"]] = {
+                "kind": script["kind"], "steps": deque(script["steps"]),
+                "step": None, "expect": 0, "released": 0.0, "last_message_id": 1,
+            }
+            self._release_next(script["user_id"])
+
+    def _release_next(self, user_id):
+        session = self.sessions[user_id]
+        if not session["steps"]:
+            del self.sessions[user_id]
+            self.completed_users[session["kind"]] += 1
+            self._start_users()
+            if not self.sessions and not self.waiting and self.finished_at is None:
+                self.finished_at = time.monotonic()
+            return
+        name, payload, expect = session["steps"].popleft()
+        payload = json.loads(json.dumps(payload))
+        payload["update_id"] = self.next_update_id
+        self.next_update_id += 1
+        if "callback_query" in payload:
+            payload["callback_query"]["message"]["message_id"] = session["last_message_id"]
+        session.update(step=name, expect=expect, released=time.monotonic())
+        self.pending.append(payload)
+        self.cond.notify_all()
+
+    def _on_reply(self, chat_id, message_id):
+        session = self.sessions.get(chat_id)
+        if session is None or session["expect"] <= 0:
+            self.unsolicited += 1
+            return
+        session["last_message_id"] = message_id
+        session["expect"] -= 1
+        if session["expect"] == 0:
+            self.step_latency[session["step"]].append((time.monotonic() - session["released"]) * 1000)
+            if self.think:
+                timer = threading.Timer(self.think, self._release_later, (chat_id,))
+                timer.daemon = True
+                timer.start()
+            else:
+                self._release_next(chat_id)
+
+    def expire_stalled(self):
+        """Шаги без ответа дольше step_timeout считаются потерянными, пользователь уходит."""
+        with self.cond:
+            now = time.monotonic()
+            stalled = [
+                user_id for user_id, session in self.sessions.items()
+                if session["expect"] > 0 and now - session["released"] > self.step_timeout
+            ]
+            for user_id in stalled:
+                session = self.sessions[user_id]
+                self.lost_steps[session["step"]] += 1
+                session["steps"].clear()
+                session["kind"] = "lost"
+                self._release_next(user_id)
+
+    def _release_later(self, chat_id):
+        with self.cond:
+            if chat_id in self.sessions:
+                self._release_next(chat_id)
+
+    # --- методы Bot API -------------------------------------------------
+
+    def _throttle(self, method):
+        if method not in LIMITED_METHODS:
+            return None
+        if self.rate_429 and self.rnd.random() < self.rate_429:
+            return self.retry_after
+        if self.global_limit:
+            now = time.monotonic()
+            if now - self._window_start >= 1:
+                self._window_start, self._window_count = now, 0
+            self._window_count += 1
+            if self._window_count > self.global_limit:
+                return max(1, int(self._window_start + 1 - now + 0.999))
+        return None
+
+    def _message(self, params):
+        chat_id = params.get("chat_id", 0)
+        message_id = params.get("message_id") or self.next_message_id
+        self.next_message_id += 1
+        return {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": BOT_ID, "is_bot": True, "first_name": "Bot", "username": BOT_USERNAME},
+            "text": str(params.get("text", "")),
+        }
+
+    def get_updates(self, params):
+        offset = int(params.get("offset") or 0)
+        timeout = float(params.get("timeout") or 0)
+        limit = int(params.get("limit") or 100)
+        deadline = time.monotonic() + timeout
+        with self.cond:
+            if not self.started:
+                self.started = True
+                self.started_at = time.monotonic()
+                self._start_users()
+            while self.pending and self.pending[0]["update_id"] < offset:
+                self.pending.popleft()
+            while not self.pending:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return []
+                self.cond.wait(remaining)
+            return list(self.pending)[:limit]
+
+    def call(self, method, params):
+        """Возвращает (http_status, тело ответа)."""
+        if method == "getUpdates":
+            with self.cond:
+                self.calls[method] += 1
+            return 200, {"ok": True, "result": self.get_updates(params)}
+        if self.latency or self.jitter:
+            time.sleep(self.latency + self.rnd.random() * self.jitter)
+        with self.cond:
+            self.calls[method] += 1
+            retry_after = self._throttle(method)
+            if retry_after:
+                self.throttled[method] += 1
+                return 429, {
+                    "ok": False, "error_code": 429,
+                    "description": f"Too Many Requests: retry after {retry_after}",
+                    "parameters": {"retry_after": retry_after},
+                }
+            if method == "getMe":
+                result = {"id": BOT_ID, "is_bot": True, "first_name": "Bot", "username": BOT_USERNAME,
+                          "can_join_groups": False, "can_read_all_group_messages": False,
+                          "supports_inline_queries": False}
+            elif method == "setWebhook":
+                self.webhook_url = params.get("url") or None
+                self.cond.notify_all()
+                result = True
+            elif method == "deleteWebhook":
+                self.webhook_url = None
+                if str(params.get("drop_pending_updates")).lower() == "true":
+                    self.pending.clear()
+                result = True
+            elif method == "getWebhookInfo":
+                result = {"url": self.webhook_url or "", "has_custom_certificate": False,
+                          "pending_update_count": len(self.pending)}
+            elif method in REPLY_METHODS:
+                result = self._message(params)
+                self._on_reply(params.get("chat_id"), result["message_id"])
+            else:
+                result = True
+        return 200, {"ok": True, "result": result}
+
+    # --- вебхук ---------------------------------------------------------
+
+    def webhook_pusher(self, stop):
+        while not stop.is_set():
+            with self.cond:
+                while not stop.is_set() and not (self.webhook_url and self.pending):
+                    self.cond.wait(0.5)
+                if stop.is_set():
+                    return
+                if not self.started:
+                    self.started = True
+                    self.started_at = time.monotonic()
+                    self._start_users()
+                    continue
+                url, update = self.webhook_url, self.pending.popleft()
+            request = urllib.request.Request(
+                url, data=json.dumps(update).encode("utf-8"),
+                headers={"Content-Type": "application/json"}, method="POST",
+            )
+            try:
+                urllib.request.urlopen(request, timeout=10).read()
+            except Exception:
+                with self.cond:
+                    self.pending.appendleft(update)
+                time.sleep(0.5)
+
+    # --- отчёт ----------------------------------------------------------
+
+    def report(self):
+        with self.cond:
+            now = self.finished_at or time.monotonic()
+            elapsed = now - self.started_at if self.started_at else 0.0
+            steps = sum(len(v) for v in self.step_latency.values())
+            return {
+                "elapsed_s": elapsed,
+                "completed_users": dict(self.completed_users),
+                "active_users": len(self.sessions),
+                "waiting_users": len(self.waiting),
+                "steps_completed": steps,
+                "steps_per_s": steps / elapsed if elapsed else 0.0,
+                "api_calls": dict(self.calls),
+                "throttled_429": dict(self.throttled),
+                "lost_steps": dict(self.lost_steps),
+                "unsolicited_replies": self.unsolicited,
+                "step_latency_ms": {name: percentiles(values) for name, values in self.step_latency.items()},
+            }
+
+    @property
+    def done(self):
+        return self.finished_at is not None
+
+
+def _parse_params(handler):
+    length = int(handler.headers.get("Content-Length") or 0)
+    body = handler.rfile.read(length) if length else b""
+    content_type = handler.headers.get("Content-Type", "")
+    raw = {}
+    if "application/json" in content_type:
+        return json.loads(body or b"{}")
+    if "multipart/form-data" in content_type:
+        message = email.parser.BytesParser().parsebytes(
+            f"Content-Type: {content_type}\r\n\r\n".encode() + body
+        )
+        for part in message.get_payload():
+            name = part.get_param("name", header="content-disposition")
+            if name and part.get_filename() is None:
+                raw[name] = part.get_payload(decode=True).decode("utf-8")
+    else:
+        raw = {k: v[-1] for k, v in urllib.parse.parse_qs(body.decode("utf-8")).items()}
+        raw.update({k: v[-1] for k, v in urllib.parse.parse_qs(urllib.parse.urlsplit(handler.path).query).items()})
+    params = {}
+    for key, value in raw.items():
+        try:
+            params[key] = json.loads(value) if key != "text" else value
+        except ValueError:
+            params[key] = value
+    return params
+
+
+def make_handler(state):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def _handle(self):
+            path = urllib.parse.urlsplit(self.path).path
+            method = path.rsplit("/", 1)[-1]
+            status, payload = state.call(method, _parse_params(self))
+            body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        do_GET = _handle
+        do_POST = _handle
+
+    return Handler
+
+
+def seed_otps(count, days=30):
+    """Кладёт в БД OTP-коды для скриптованных админов (DB_PATH должен совпадать с ботом)."""
+    from ex_owner import issue_otps
+    from utils import init_db
+    init_db()
+    return issue_otps(count, days)[0]
+
+
+def serve(state, host="127.0.0.1", port=8081):
+    server = ThreadingHTTPServer((host, port), make_handler(state))
+    server.daemon_threads = True
+    stop = threading.Event()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    threading.Thread(target=state.webhook_pusher, args=(stop,), daemon=True).start()
+
+    def reaper():
+        while not stop.wait(1):
+            state.expire_stalled()
+
+    threading.Thread(target=reaper, daemon=True).start()
+    return server, stop
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Локальный фейковый Bot API для нагрузочных тестов")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--clients", type=int, default=10000)
+    parser.add_argument("--admins", type=int, default=0, help="админов с OTP (нужен --db)")
+    parser.add_argument("--ref-ratio", type=float, default=0.3, help="доля клиентов по реф. ссылкам админов")
+    parser.add_argument("--active", type=int, default=500, help="одновременно активных пользователей")
+    parser.add_argument("--think-ms", type=float, default=0.0, help="пауза пользователя между шагами")
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--rate-429", type=float, default=0.0, help="доля запросов, получающих 429")
+    parser.add_argument("--retry-after", type=int, default=1)
+    parser.add_argument("--global-limit", type=int, default=0, help="лимит сообщений в секунду (0 — без лимита)")
+    parser.add_argument("--step-timeout", type=float, default=30.0, help="через сколько секунд шаг без ответа потерян")
+    parser.add_argument("--duration", type=float, default=0.0, help="остановиться через N секунд")
+    parser.add_argument("--report-every", type=float, default=10.0)
+    parser.add_argument("--db", help="БД бота, в которую кладутся OTP для админов")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--save", nargs="?", const="", help="сохранить итог как JSON-бейзлайн")
+    args = parser.parse_args(argv)
+
+    otp_codes = []
+    if args.admins:
+        if not args.db:
+            parser.error("--admins требует --db")
+        os.environ["DB_PATH"] = args.db
+        otp_codes = seed_otps(args.admins)
+    scripts = generate_population(args.clients, args.admins, otp_codes, args.ref_ratio, seed=args.seed)
+    state = FakeTelegram(
+        scripts, active=args.active, latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+        rate_429=args.rate_429, retry_after=args.retry_after, global_limit=args.global_limit,
+        think_ms=args.think_ms, step_timeout=args.step_timeout, seed=args.seed,
+    )
+    server, stop = serve(state, args.host, args.port)
+    print(f"Фейковый Bot API слушает http://{args.host}:{args.port}/bot — "
+          f"{len(scripts)} сценариев, ждём первый getUpdates/setWebhook")
+    deadline = time.monotonic() + args.duration if args.duration else None
+    try:
+        while not state.done and (deadline is None or time.monotonic() < deadline):
+            time.sleep(args.report_every)
+            snapshot = state.report()
+            print(f"[{snapshot['elapsed_s']:.0f} с] готово {snapshot['completed_users']}, "
+                  f"активно {snapshot['active_users']}, шагов/с {snapshot['steps_per_s']:.1f}, "
+                  f"429: {sum(snapshot['throttled_429'].values())}, потеряно шагов {sum(snapshot['lost_steps'].values())}")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop.set()
+        server.shutdown()
+    results = state.report()
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+    if args.save is not None:
+        print(f"Бейзлайн сохранён: {save_baseline('fake_api', results, args.save or None)}")
+
+
+if __name__ == "__main__":
+    main()
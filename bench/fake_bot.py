@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""Фейковый транспорт Bot API: ничего не отправляет в сеть, а записывает вызовы.
+
+Подключается через ``Application.builder().request(...)``, поэтому весь путь
+сериализации ``telegram.Bot`` остаётся настоящим — подменяется только HTTP.
+"""
+import json
+import time
+from collections import Counter
+
+from telegram.request import BaseRequest
+
+BOT_ID = 100000001
+BOT_USERNAME = "goa_exchangeBot"
+
+
+class FakeRequest(BaseRequest):
+    def __init__(self, record=True):
+        self.record = record
+        self.calls = []
+        self.counts = Counter()
+        self._message_id = 0
+
+    @property
+    def read_timeout(self):
+        return 10
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def reset(self):
+        self.calls.clear()
+        self.counts.clear()
+
+    def sent_messages(self, chat_id=None):
+        return [
+            params for method, params in self.calls
+            if method in ("sendMessage", "editMessageText")
+            and (chat_id is None or str(params.get("chat_id")) == str(chat_id))
+        ]
+
+    def _message(self, params):
+        self._message_id += 1
+        chat_id = params.get("chat_id", 0)
+        return {
+            "message_id": params.get("message_id", self._message_id),
+            "date": int(time.time()),
+            "chat": {"id": int(chat_id) if str(chat_id).lstrip("-").isdigit() else 0, "type": "private"},
+            "from": {"id": BOT_ID, "is_bot": True, "first_name": "Bot", "username": BOT_USERNAME},
+            "text": params.get("text", ""),
+        }
+
+    def build_result(self, method, params):
+        if method == "getMe":
+            return {
+                "id": BOT_ID, "is_bot": True, "first_name": "Bot", "username": BOT_USERNAME,
+                "can_join_groups": False, "can_read_all_group_messages": False,
+                "supports_inline_queries": False,
+            }
+        if method in ("sendMessage", "editMessageText", "sendDocument"):
+            return self._message(params)
+        if method == "getUpdates":
+            return []
+        return True
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None,
+                         write_timeout=None, connect_timeout=None, pool_timeout=None):
+        api_method = url.rsplit("/", 1)[-1]
+        params = request_data.parameters if request_data is not None else {}
+        self.counts[api_method] += 1
+        if self.record:
+            self.calls.append((api_method, params))
+        payload = {"ok": True, "result": self.build_result(api_method, params)}
+        return 200, json.dumps(payload).encode("utf-8")
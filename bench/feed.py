@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""Прогон фида курсов (ex_feed) на тысячах подписанных админов.
+
+Курсы отдаёт локальная HTTP-заглушка, как это делал бы внешний источник::
+
+    python -m bench.feed --admins 5000 --runs 5
+    python -m bench.feed --serve --port 8090    # только заглушка, для ручной проверки бота
+"""
+import argparse
+import json
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from bench.common import compare_results, load_baseline, percentiles, prepare_environment, print_comparison, save_baseline
+
+ADMIN_ID_BASE = 400000000
+
+
+class FeedStub:
+    """Опорные курсы со случайным дрейфом: каждый запрос — новые значения."""
+
+    def __init__(self, base_rates, drift=0.01, seed=1):
+        self.base_rates = dict(base_rates)
+        self.drift = drift
+        self.rnd = random.Random(seed)
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def snapshot(self):
+        with self._lock:
+            self.requests += 1
+            return {label: round(rate * (1 + self.rnd.uniform(-self.drift, self.drift)), 6)
+                    for label, rate in self.base_rates.items()}
+
+
+def serve(stub, port=0):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = json.dumps({"rates": stub.snapshot()}, ensure_ascii=False).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def seed_admins(admins, subscribed_ratio, seed_value=1):
+    import utils
+    from bot_config import bot_config
+    utils.init_db()
+    rnd = random.Random(seed_value)
+    rates = json.dumps(bot_config["default_rates"])
+    pairs = json.dumps(bot_config["default_pairs"])
+    locations = json.dumps(bot_config["default_locations"])
+
+    def rows():
+        for n in range(admins):
+            margins = None
+            if rnd.random() < subscribed_ratio:
+                margins = {"*": {"percent": str(rnd.choice((0.5, 1, 1.5, 2)))}}
+                if rnd.random() < 0.3:
+                    margins["USDT → Рупии (нал)"] = {"fixed": "0.5"}
+                margins = json.dumps(margins, ensure_ascii=False)
+            yield (ADMIN_ID_BASE + n, rates, locations, locations, pairs, pairs, margins)
+
+    conn = utils.get_connection()
+    conn.executemany('INSERT INTO admins (admin_id, rates, locations, active_locations, pairs, active_pairs, '
+                     'feed_margins) VALUES (?, ?, ?, ?, ?, ?, ?)', rows())
+    conn.commit()
+    conn.close()
+
+
+def run(admins, subscribed_ratio, runs):
+    import utils
+    from bot_config import bot_config
+    import ex_feed
+
+    seed_admins(admins, subscribed_ratio)
+    stub = FeedStub(bot_config["default_rates"])
+    server = serve(stub)
+    spec = f"http://127.0.0.1:{server.server_address[1]}/rates"
+    statements = []
+    utils.set_trace_callback(lambda sql: statements.append(sql))
+    timings, last = [], None
+    for _ in range(runs):
+        statements.clear()
+        started = time.perf_counter()
+        last = ex_feed.run_once(spec)
+        timings.append((time.perf_counter() - started) * 1000)
+    utils.set_trace_callback(None)
+    server.shutdown()
+    return {
+        "admins": admins,
+        "subscribed": last["admins"],
+        "updated_per_run": last["updated"],
+        "run_ms": percentiles(timings),
+        "admins_per_s": last["admins"] / (percentiles(timings)["p50"] / 1000) if timings[0] else 0.0,
+        "sql_statements_per_run": len(statements),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Бенчмарк фида курсов")
+    parser.add_argument("--admins", type=int, default=5000)
+    parser.add_argument("--subscribed", type=float, default=0.8, help="доля админов, подписанных на фид")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--serve", action="store_true", help="только поднять заглушку фида")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--save", nargs="?", const="", help="сохранить результат как JSON-бейзлайн")
+    parser.add_argument("--compare", help="сравнить с сохранённым бейзлайном")
+    args = parser.parse_args(argv)
+
+    db_path = prepare_environment()
+    if args.serve:
+        from bot_config import bot_config
+        serve(FeedStub(bot_config["default_rates"]), args.port)
+        print(f"Заглушка фида: http://127.0.0.1:{args.port}/rates (Ctrl+C — выход)")
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            return
+    results = run(args.admins, args.subscribed, args.runs)
+    print(f"Админов {results['admins']}, подписано {results['subscribed']}, обновлено за прогон {results['updated_per_run']}")
+    print(f"Прогон: p50 {results['run_ms']['p50']:.1f} мс, max {results['run_ms']['max']:.1f} мс "
+          f"({results['admins_per_s']:.0f} админов/с), SQL-запросов за прогон: {results['sql_statements_per_run']}")
+    if args.save is not None:
+        print(f"Бейзлайн сохранён: {save_baseline('feed', results, args.save or None)}")
+    if args.compare:
+        print_comparison(compare_results(load_baseline(args.compare), results))
+    os.remove(db_path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""Сквозной бенчмарк клиентского сценария.
+
+Поднимает настоящий ``Application`` с хендлерами из ``exbot.register_handlers``
+(клиентский ``ConversationHandler`` и ``get_admin_handler(cancel)``), подменяет
+только HTTP-транспорт бота и прогоняет через ``process_update`` полный путь
+start → choose_operation → get_amount → get_location → get_fine_location.
+
+Запуск из корня репозитория::
+
+    python -m bench.flow --users 2000 --concurrency 50 --save
+    python -m bench.flow --users 2000 --compare bench/baselines/flow.json
+"""
+import argparse
+import asyncio
+import contextvars
+import json
+import random
+import time
+from collections import Counter, defaultdict
+
+from bench.common import (
+    compare_results, load_baseline, percentiles, prepare_environment, print_comparison, save_baseline,
+)
+from bench.fake_bot import FakeRequest
+from bench.synthetic import USER_ID_BASE, client_flow
+
+STEPS = ("start", "choose_operation", "get_amount", "get_location", "get_fine_location")
+
+_current_step = contextvars.ContextVar("current_step", default="other")
+
+
+def build_application(request=None):
+    """Application с настоящими хендлерами и фейковым транспортом вместо api.telegram.org."""
+    import os
+    from telegram.ext import Application
+    from exbot import register_handlers
+
+    request = request or FakeRequest(record=False)
+    app = (
+        Application.builder()
+        .token(os.environ["TELEGRAM_TOKEN"])
+        .request(request)
+        .get_updates_request(FakeRequest(record=False))
+        .updater(None)
+        .build()
+    )
+    register_handlers(app)
+    return app, request
+
+
+async def run(users=1000, concurrency=20, seed=1, geo_ratio=0.5):
+    from telegram import Update
+    import utils
+    from bot_config import bot_config
+
+    utils.init_db()
+    owner_data = utils.get_admin_data(bot_config["owner_id"])
+    pairs = owner_data["active_pairs"]
+    locations = owner_data["active_locations"]
+    rnd = random.Random(seed)
+
+    statements = Counter()
+    utils.set_trace_callback(lambda sql: statements.update((_current_step.get(),)))
+
+    app, request = build_application()
+    await app.initialize()
+    latencies = defaultdict(list)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def drive(user_id, flow):
+        async with semaphore:
+            for step, payload in flow:
+                update = Update.de_json(payload, app.bot)
+                token = _current_step.set(step)
+                started = time.perf_counter()
+                await app.process_update(update)
+                latencies[step].append((time.perf_counter() - started) * 1000)
+                _current_step.reset(token)
+
+    flows = []
+    for n in range(users):
+        user_id = USER_ID_BASE + n
+        fine = (15.6 + rnd.random() / 10, 73.7 + rnd.random() / 10) if rnd.random() < geo_ratio else None
+        flows.append((user_id, client_flow(
+            user_id, rnd.choice(pairs), rnd.randint(100, 500000), rnd.choice(locations), fine,
+        )))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(drive(user_id, flow) for user_id, flow in flows))
+    elapsed = time.perf_counter() - started
+
+    await app.shutdown()
+    utils.set_trace_callback(None)
+
+    conn = utils.get_connection()
+    orders = conn.execute("SELECT COALESCE(SUM(request_count), 0) FROM users").fetchone()[0]
+    conn.close()
+
+    per_order = orders or 1
+    return {
+        "users": users,
+        "concurrency": concurrency,
+        "orders": orders,
+        "elapsed_s": elapsed,
+        "orders_per_s": orders / elapsed if elapsed else 0.0,
+        "latency_ms": {step: percentiles(latencies[step]) for step in STEPS},
+        "db_statements_per_order": sum(statements.values()) / per_order,
+        "db_statements_per_step": {step: statements[step] / per_order for step in STEPS},
+        "api_calls_per_order": {method: count / per_order for method, count in sorted(request.counts.items())},
+    }
+
+
+def print_report(results):
+    print(f"Пользователей: {results['users']}, параллельно: {results['concurrency']}")
+    print(f"Заявок: {results['orders']} за {results['elapsed_s']:.2f} с — {results['orders_per_s']:.1f} заявок/с")
+    print(f"SQL-запросов на заявку: {results['db_statements_per_order']:.1f}")
+    print(f"{'шаг':<20} {'p50':>8} {'p90':>8} {'p99':>8} {'max':>8} {'sql':>6}")
+    for step in STEPS:
+        lat = results["latency_ms"][step]
+        print(f"{step:<20} {lat['p50']:>8.2f} {lat['p90']:>8.2f} {lat['p99']:>8.2f} {lat['max']:>8.2f} "
+              f"{results['db_statements_per_step'][step]:>6.1f}")
+    print("Вызовы Bot API на заявку: " + json.dumps(results["api_calls_per_order"], ensure_ascii=False))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Сквозной бенчмарк клиентского сценария")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--db", help="путь к БД (по умолчанию — временный файл)")
+    parser.add_argument("--save", nargs="?", const="", help="сохранить результат как JSON-бейзлайн")
+    parser.add_argument("--compare", help="сравнить с сохранённым бейзлайном")
+    parser.add_argument("--verbose", action="store_true", help="не глушить логи бота")
+    args = parser.parse_args(argv)
+
+    prepare_environment(args.db, verbose=args.verbose)
+    results = asyncio.run(run(args.users, args.concurrency, args.seed))
+    print_report(results)
+    if args.save is not None:
+        print(f"Бейзлайн сохранён: {save_baseline('flow', results, args.save or None)}")
+    if args.compare:
+        print_comparison(compare_results(load_baseline(args.compare), results))
+
+
+if __name__ == "__main__":
+    main()
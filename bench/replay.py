@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+"""Детерминированный офлайн-реплей записанных апдейтов (см. ex_recorder / UPDATE_RECORD_FILE).
+
+Запись прогоняется через свежий ``Application`` с настоящими хендлерами и
+фейковым транспортом. Исходящие вызовы Bot API сохраняются в транскрипт,
+который можно сравнить с транскриптом предыдущей сборки::
+
+    UPDATE_RECORD_FILE=peak.jsonl.gz python exbot.py          # запись на проде
+    git checkout main && python -m bench.replay peak.jsonl.gz --transcript main.jsonl
+    git checkout feature && python -m bench.replay peak.jsonl.gz --expect main.jsonl --save
+
+``--speed 1`` воспроизводит исходные интервалы между апдейтами, ``--speed 0``
+(по умолчанию) — максимально быстро.
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import time
+from collections import Counter, defaultdict
+
+from bench.common import compare_results, load_baseline, percentiles, prepare_environment, print_comparison, save_baseline
+from bench.fake_bot import FakeRequest
+
+OTP_EXPIRY = '2099-12-31 00:00:00'
+
+
+def update_kind(data):
+    if "callback_query" in data:
+        return "callback_query"
+    message = data.get("message") or {}
+    if "location" in message:
+        return "location"
+    text = message.get("text") or ""
+    if text.startswith("/"):
+        return "command:" + text.split()[0][1:]
+    return "message" if message else "other"
+
+
+def seed_recorded_otps(entries):
+    """OTP из команд /otp в записи кладутся в свежую базу, иначе активации админов не воспроизвести."""
+    from utils import save_otp_data
+    seen = set()
+    for _, data in entries:
+        text = (data.get("message") or {}).get("text") or ""
+        parts = text.split()
+        if len(parts) == 2 and parts[0] == "/otp" and parts[1] not in seen:
+            seen.add(parts[1])
+            save_otp_data(parts[1], None, OTP_EXPIRY, 30)
+    return len(seen)
+
+
+def transcript_entry(index, method, params):
+    markup = params.get("reply_markup")
+    if isinstance(markup, str):
+        markup = json.loads(markup)
+    return {
+        "update": index,
+        "method": method,
+        "chat_id": params.get("chat_id"),
+        "text": params.get("text"),
+        "reply_markup": markup,
+    }
+
+
+async def replay(entries, speed=0.0):
+    from telegram import Update
+    import utils
+    from bench.flow import build_application
+
+    statements = Counter()
+    utils.set_trace_callback(lambda sql: statements.update(("total",)))
+    request = FakeRequest(record=True)
+    app, _ = build_application(request)
+    await app.initialize()
+    request.reset()
+
+    transcript = []
+    latencies = defaultdict(list)
+    lag = []
+    first_arrival = entries[0][0] if entries else 0.0
+    started = time.perf_counter()
+    for index, (arrived, data) in enumerate(entries):
+        if speed:
+            target = (arrived - first_arrival) / speed
+            delay = target - (time.perf_counter() - started)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            else:
+                lag.append(-delay * 1000)
+        update = Update.de_json(data, app.bot)
+        before = len(request.calls)
+        t0 = time.perf_counter()
+        await app.process_update(update)
+        latencies[update_kind(data)].append((time.perf_counter() - t0) * 1000)
+        for method, params in request.calls[before:]:
+            if method not in ("getMe", "answerCallbackQuery"):
+                transcript.append(transcript_entry(index, method, params))
+    elapsed = time.perf_counter() - started
+    await app.shutdown()
+    utils.set_trace_callback(None)
+
+    all_latencies = [value for values in latencies.values() for value in values]
+    count = len(entries) or 1
+    results = {
+        "updates": len(entries),
+        "elapsed_s": elapsed,
+        "updates_per_s": len(entries) / elapsed if elapsed else 0.0,
+        "latency_ms": percentiles(all_latencies),
+        "latency_by_kind_ms": {kind: percentiles(values) for kind, values in sorted(latencies.items())},
+        "db_statements_per_update": statements["total"] / count,
+        "api_calls_per_update": {m: c / count for m, c in sorted(request.counts.items()) if m != "getMe"},
+    }
+    if speed:
+        results["lag_ms"] = percentiles(lag)
+    return results, transcript
+
+
+def diff_transcripts(expected, actual, limit=20):
+    mismatches = []
+    for position in range(max(len(expected), len(actual))):
+        left = expected[position] if position < len(expected) else None
+        right = actual[position] if position < len(actual) else None
+        if left != right:
+            mismatches.append((position, left, right))
+    for position, left, right in mismatches[:limit]:
+        print(f"  #{position}: ожидалось {json.dumps(left, ensure_ascii=False)}")
+        print(f"  {' ' * len(str(position))}   получено {json.dumps(right, ensure_ascii=False)}")
+    return len(mismatches)
+
+
+def write_transcript(path, transcript):
+    with open(path, "w", encoding="utf-8") as f:
+        for entry in transcript:
+            f.write(json.dumps(entry, ensure_ascii=False, sort_keys=True) + "\n")
+
+
+def read_transcript(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Офлайн-реплей записанных апдейтов")
+    parser.add_argument("recording", help="файл записи (UPDATE_RECORD_FILE)")
+    parser.add_argument("--speed", type=float, default=0.0, help="1 — исходная скорость, 0 — максимально быстро")
+    parser.add_argument("--db", help="снимок базы на момент начала записи (копируется, оригинал не трогается)")
+    parser.add_argument("--transcript", help="сохранить исходящие сообщения в файл")
+    parser.add_argument("--expect", help="транскрипт предыдущей сборки для сравнения")
+    parser.add_argument("--save", nargs="?", const="", help="сохранить метрики как JSON-бейзлайн")
+    parser.add_argument("--compare", help="сравнить метрики с сохранённым бейзлайном")
+    args = parser.parse_args(argv)
+
+    db_path = prepare_environment()
+    if args.db:
+        shutil.copyfile(args.db, db_path)
+    import utils
+    from ex_recorder import read_recording
+
+    utils.init_db()
+    entries = list(read_recording(args.recording))
+    seeded = seed_recorded_otps(entries)
+    results, transcript = asyncio.run(replay(entries, args.speed))
+
+    print(f"Апдейтов: {results['updates']} за {results['elapsed_s']:.2f} с — {results['updates_per_s']:.1f}/с "
+          f"(OTP из записи: {seeded})")
+    print(f"Задержка обработки: p50 {results['latency_ms']['p50']:.2f} мс, p99 {results['latency_ms']['p99']:.2f} мс")
+    print(f"SQL-запросов на апдейт: {results['db_statements_per_update']:.1f}, исходящих сообщений: {len(transcript)}")
+    if args.transcript:
+        write_transcript(args.transcript, transcript)
+    exit_code = 0
+    if args.expect:
+        expected = read_transcript(args.expect)
+        mismatches = diff_transcripts(expected, json.loads(json.dumps(transcript)))
+        print(f"Расхождений с {args.expect}: {mismatches}")
+        exit_code = 1 if mismatches else 0
+    if args.save is not None:
+        print(f"Бейзлайн сохранён: {save_baseline('replay', results, args.save or None)}")
+    if args.compare:
+        print_comparison(compare_results(load_baseline(args.compare), results))
+    os.remove(db_path)
+    raise SystemExit(exit_code)
+
+
+if __name__ == "__main__":
+    main()
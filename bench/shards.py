@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""Масштабирование по процессам: ``ex_shards`` с 1, 2, … N обработчиками.
+
+Приёмная сторона — как в боевом режиме ``WORKERS=N``: апдейты клиентских сценариев
+(start → … → get_fine_location) раскладываются по очередям обработчиков по user_id,
+каждый обработчик — отдельный процесс с настоящими хендлерами и фейковым транспортом
+(как в ``bench.flow``). Меряется время от первого апдейта до момента, когда все
+обработчики разобрали свои очереди.
+
+Запуск из корня репозитория::
+
+    python -m bench.shards --users 2000 --workers 1,2,4
+    python -m bench.shards --users 2000 --workers 1,2,4 --save
+"""
+import argparse
+import os
+import random
+import time
+
+from bench.common import compare_results, load_baseline, prepare_environment, print_comparison, save_baseline
+from bench.synthetic import USER_ID_BASE, client_flow
+
+
+def build_worker():
+    """Фабрика Application для процесса-обработчика: окружение (БД, токен) досталось от родителя."""
+    prepare_environment(os.environ["DB_PATH"])
+    from bench.flow import build_application
+    app, _ = build_application()
+    return app
+
+
+def make_updates(users, seed, geo_ratio=0.5):
+    """Апдейты всех сценариев вперемешку по шагам, как приходят от многих клиентов сразу."""
+    import utils
+    from bot_config import bot_config
+
+    owner_data = utils.get_admin_data(bot_config["owner_id"])
+    rnd = random.Random(seed)
+    flows = []
+    for n in range(users):
+        fine = (15.6 + rnd.random() / 10, 73.7 + rnd.random() / 10) if rnd.random() < geo_ratio else None
+        flows.append([payload for _, payload in client_flow(
+            USER_ID_BASE + n, rnd.choice(owner_data["active_pairs"]), rnd.randint(100, 500000),
+            rnd.choice(owner_data["active_locations"]), fine,
+        )])
+    updates = []
+    for step in range(max(len(flow) for flow in flows)):
+        for flow in flows:
+            if step < len(flow):
+                updates.append(dict(flow[step], update_id=len(updates) + 1))
+    return updates
+
+
+def run_once(workers, updates, timeout=600):
+    from ex_shards import Shards
+
+    shards = Shards(workers, build=build_worker)
+    shards.start()
+    deadline = time.monotonic() + timeout
+    while len(shards.ready) < workers:
+        shards.relay(0.1)
+        if time.monotonic() > deadline:
+            raise RuntimeError("обработчики не запустились")
+    started = time.perf_counter()
+    for data in updates:
+        shards.route(data)
+    shards.finish()
+    while len(shards.drained) < workers:
+        shards.relay(0.05)
+        if time.monotonic() > deadline:
+            raise RuntimeError("обработчики не разобрали очереди")
+    elapsed = time.perf_counter() - started
+    shards.stop()
+    return {
+        "elapsed_s": elapsed,
+        "updates": sum(shards.drained.values()),
+        "updates_per_s": sum(shards.drained.values()) / elapsed if elapsed else 0.0,
+        "per_worker": [shards.drained[shard] for shard in range(workers)],
+    }
+
+
+def run(users=1000, workers=(1, 2, 4), seed=1):
+    import utils
+
+    utils.init_db()
+    utils.enable_wal()
+    updates = make_updates(users, seed)
+    results = {"users": users, "cpus": os.cpu_count(), "workers": {}}
+    for count in workers:
+        conn = utils.get_connection()
+        # Каждый прогон с чистыми клиентами: иначе второй прогон упрётся в лимит заявок
+        conn.execute("DELETE FROM users WHERE user_id >= ?", (USER_ID_BASE,))
+        conn.execute("DELETE FROM orders WHERE user_id >= ?", (USER_ID_BASE,))
+        conn.commit()
+        conn.close()
+        results["workers"][str(count)] = run_once(count, updates)
+        conn = utils.get_connection()
+        results["workers"][str(count)]["orders"] = conn.execute(
+            "SELECT COALESCE(SUM(request_count), 0) FROM users WHERE user_id >= ?", (USER_ID_BASE,)).fetchone()[0]
+        conn.close()
+    base = results["workers"][str(workers[0])]["updates_per_s"]
+    for result in results["workers"].values():
+        result["speedup"] = result["updates_per_s"] / base if base else 0.0
+    return results
+
+
+def print_report(results):
+    print(f"Пользователей: {results['users']}, ядер: {results['cpus']}")
+    print(f"{'процессов':>10} {'апдейтов/с':>12} {'ускорение':>10} {'заявок':>8}  по процессам")
+    for count, result in results["workers"].items():
+        print(f"{count:>10} {result['updates_per_s']:>12.1f} {result['speedup']:>10.2f} {result['orders']:>8}  "
+              f"{result['per_worker']}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Масштабирование обработки апдейтов по процессам")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--workers", default="1,2,4", help="числа процессов через запятую")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--db", help="путь к БД (по умолчанию — временный файл)")
+    parser.add_argument("--save", nargs="?", const="", help="сохранить результат как JSON-бейзлайн")
+    parser.add_argument("--compare", help="сравнить с сохранённым бейзлайном")
+    parser.add_argument("--verbose", action="store_true", help="не глушить логи бота")
+    args = parser.parse_args(argv)
+
+    prepare_environment(args.db, verbose=args.verbose)
+    results = run(args.users, tuple(int(n) for n in args.workers.split(",")), args.seed)
+    print_report(results)
+    if args.save is not None:
+        print(f"Бейзлайн сохранён: {save_baseline('shards', results, args.save or None)}")
+    if args.compare:
+        print_comparison(compare_results(load_baseline(args.compare), results))
+
+
+if __name__ == "__main__":
+    main()
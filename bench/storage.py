@@ -0,0 +1,270 @@
+# -*- coding: utf-8 -*-
+"""Микробенчмарки и стресс-тест слоя хранения (utils.py).
+
+Для каждого размера базы (по умолчанию 10k, 100k и 1M пользователей) и каждого
+сочетания journal_mode/synchronous меряет задержку одиночных вызовов всех
+функций utils, пропускную способность при N параллельных писателях,
+частоту ``database is locked`` и рост файла базы.
+
+    python -m bench.storage --sizes 10000,100000 --modes delete:full,wal:normal --writers 8
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+
+from bench.common import compare_results, load_baseline, percentiles, prepare_environment, print_comparison, save_baseline
+
+ADMIN_SHARE = 0.01
+OTP_SHARE = 0.01
+USER_ID_BASE = 500000000
+
+
+class LockCounter(logging.Handler):
+    """utils глотает часть ошибок SQLite и только логирует их — считаем по логам."""
+
+    def __init__(self):
+        super().__init__(logging.ERROR)
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def emit(self, record):
+        if "database is locked" in record.getMessage():
+            with self._lock:
+                self.count += 1
+
+
+def file_size(path):
+    return sum(os.path.getsize(p) for p in (path, path + "-wal", path + "-journal") if os.path.exists(p))
+
+
+def seed(path, users, owner_id):
+    """Заливает базу напрямую через executemany: через utils это заняло бы часы на 1M."""
+    import utils
+    utils.DB_PATH = path
+    utils.init_db()
+    conn = utils.get_connection()
+    admins = max(1, int(users * ADMIN_SHARE))
+    admin_ids = [USER_ID_BASE + n for n in range(admins)]
+    expiry = (datetime.now() + timedelta(days=30)).strftime('%Y-%m-%d %H:%M:%S')
+    today = datetime.now().strftime('%Y-%m-%d')
+    order = json.dumps({"operation": "USDT → Рупии (нал)", "amount": 100.0, "result": 9000.0,
+                        "location": "Морджим", "fine_location": "Не указано"})
+    rnd = random.Random(users)
+
+    def rows():
+        for n in range(users):
+            user_id = USER_ID_BASE + n
+            if n < admins:
+                yield (user_id, json.dumps({"admin_expiry": expiry}), 0, today, user_id, 0)
+            else:
+                yield (user_id, order if rnd.random() < 0.5 else None, rnd.randint(0, 4), today,
+                       rnd.choice(admin_ids) if rnd.random() < 0.7 else int(owner_id), 0)
+
+    conn.executemany('INSERT INTO users (user_id, active_order, request_count, last_request_date, referrer_id, '
+                     'in_admin_mode) VALUES (?, ?, ?, ?, ?, ?)', rows())
+    from bot_config import bot_config
+    admin_blob = (
+        json.dumps(bot_config["default_rates"]), json.dumps(bot_config["default_locations"]),
+        json.dumps(bot_config["default_active_locations"]), json.dumps(bot_config["default_pairs"]),
+        json.dumps(bot_config["default_active_pairs"]),
+    )
+    conn.executemany('INSERT INTO admins (admin_id, rates, locations, active_locations, pairs, active_pairs) '
+                     'VALUES (?, ?, ?, ?, ?, ?)', ((admin_id,) + admin_blob for admin_id in admin_ids))
+    conn.executemany('INSERT INTO otps (otp, user_id, expiry, duration) VALUES (?, NULL, ?, 30)',
+                     ((f"S{n:07X}", expiry) for n in range(int(users * OTP_SHARE))))
+    conn.commit()
+    conn.close()
+    return admin_ids
+
+
+def time_calls(fn, args_iter):
+    samples = []
+    for args in args_iter:
+        started = time.perf_counter()
+        fn(*args)
+        samples.append((time.perf_counter() - started) * 1000)
+    return percentiles(samples)
+
+
+def single_call_suite(users, admin_ids, calls, rnd):
+    import utils
+    user_ids = [USER_ID_BASE + rnd.randrange(users) for _ in range(calls)]
+    admins = [rnd.choice(admin_ids) for _ in range(calls)]
+    order = {"operation": "USDT → Рупии (нал)", "amount": 250.0, "result": 22500.0,
+             "location": "Арамболь", "fine_location": "Не указано"}
+    expiry = (datetime.now() + timedelta(days=7)).strftime('%Y-%m-%d %H:%M:%S')
+    otps = [f"B{rnd.getrandbits(40):010X}" for _ in range(calls)]
+    admin_data = utils.get_admin_data(admin_ids[0])
+    new_ids = [USER_ID_BASE + users + n for n in range(calls)]
+    return {
+        "get_user_data": time_calls(utils.get_user_data, ((u,) for u in user_ids)),
+        "save_user_data_update": time_calls(utils.save_user_data, ((u, order) for u in user_ids)),
+        "save_user_data_insert": time_calls(
+            lambda u: utils.save_user_data(u, None, referrer_id=admin_ids[0], in_admin_mode=0),
+            ((u,) for u in new_ids)),
+        "check_request_limit": time_calls(utils.check_request_limit, ((u,) for u in user_ids)),
+        "log_request": time_calls(utils.log_request, ((u,) for u in user_ids)),
+        "get_admin_data": time_calls(utils.get_admin_data, ((a,) for a in admins)),
+        "save_admin_data": time_calls(utils.save_admin_data, ((a, admin_data) for a in admins)),
+        "save_otp_data": time_calls(utils.save_otp_data, ((o, None, expiry, 7) for o in otps)),
+        "get_otp_data": time_calls(utils.get_otp_data, ((o,) for o in otps)),
+        "delete_otp": time_calls(utils.delete_otp, ((o,) for o in otps)),
+    }
+
+
+def concurrent_suite(users, admin_ids, writers, readers, duration, lock_counter):
+    import utils
+    ops = Counter()
+    errors = Counter()
+    latencies = defaultdict(list)
+    stop = threading.Event()
+    guard = threading.Lock()
+    order = {"operation": "Рупии (нал) → USDT", "amount": 10000.0, "result": 105.0,
+             "location": "Морджим", "fine_location": "Не указано"}
+
+    def writer(seed_value):
+        rnd = random.Random(seed_value)
+        while not stop.is_set():
+            user_id = USER_ID_BASE + rnd.randrange(users)
+            started = time.perf_counter()
+            try:
+                utils.save_user_data(user_id, order)
+                utils.log_request(user_id)
+                kind = "write"
+            except Exception as e:
+                with guard:
+                    errors[type(e).__name__] += 1
+                continue
+            with guard:
+                ops[kind] += 1
+                latencies[kind].append((time.perf_counter() - started) * 1000)
+
+    def reader(seed_value):
+        rnd = random.Random(seed_value)
+        while not stop.is_set():
+            started = time.perf_counter()
+            try:
+                utils.get_user_data(USER_ID_BASE + rnd.randrange(users))
+                utils.get_admin_data(rnd.choice(admin_ids))
+            except Exception as e:
+                with guard:
+                    errors[type(e).__name__] += 1
+                continue
+            with guard:
+                ops["read"] += 1
+                latencies["read"].append((time.perf_counter() - started) * 1000)
+
+    lock_counter.count = 0
+    threads = [threading.Thread(target=writer, args=(n,)) for n in range(writers)]
+    threads += [threading.Thread(target=reader, args=(1000 + n,)) for n in range(readers)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    time.sleep(duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    attempts = sum(ops.values()) + sum(errors.values())
+    return {
+        "writers": writers,
+        "readers": readers,
+        "writes_per_s": ops["write"] / elapsed,
+        "reads_per_s": ops["read"] / elapsed,
+        "write_latency_ms": percentiles(latencies["write"]),
+        "read_latency_ms": percentiles(latencies["read"]),
+        "errors": dict(errors),
+        "locked_events": lock_counter.count,
+        "locked_rate": lock_counter.count / attempts if attempts else 0.0,
+    }
+
+
+def run(sizes, modes, calls, writers, readers, duration, workdir, seed_value=1):
+    import utils
+    from bot_config import bot_config
+
+    lock_counter = LockCounter()
+    utils_logger = logging.getLogger("utils")
+    utils_logger.addHandler(lock_counter)
+    utils_logger.propagate = False
+
+    results = {}
+    for users in sizes:
+        template = os.path.join(workdir, f"template-{users}.db")
+        utils.DB_JOURNAL_MODE = utils.DB_SYNCHRONOUS = None
+        started = time.perf_counter()
+        admin_ids = seed(template, users, bot_config["owner_id"])
+        print(f"[{users}] база заполнена за {time.perf_counter() - started:.1f} с, {file_size(template) / 2**20:.1f} МБ")
+        for mode in modes:
+            journal_mode, synchronous = mode.split(":")
+            path = os.path.join(workdir, f"run-{users}-{journal_mode}-{synchronous}.db")
+            shutil.copyfile(template, path)
+            utils.DB_PATH = path
+            utils.DB_JOURNAL_MODE, utils.DB_SYNCHRONOUS = journal_mode, synchronous
+            size_before = file_size(path)
+            rnd = random.Random(seed_value)
+            single = single_call_suite(users, admin_ids, calls, rnd)
+            size_single = file_size(path)
+            concurrent = concurrent_suite(users, admin_ids, writers, readers, duration, lock_counter)
+            size_after = file_size(path)
+            results.setdefault(str(users), {})[mode] = {
+                "single_call_ms": single,
+                "concurrent": concurrent,
+                "file_bytes": {"before": size_before, "after_single": size_single, "after_concurrent": size_after,
+                               "growth": size_after - size_before},
+            }
+            print_mode(users, mode, results[str(users)][mode])
+            os.remove(path)
+            for suffix in ("-wal", "-shm", "-journal"):
+                if os.path.exists(path + suffix):
+                    os.remove(path + suffix)
+        os.remove(template)
+    utils_logger.removeHandler(lock_counter)
+    return results
+
+
+def print_mode(users, mode, result):
+    print(f"  {mode}:")
+    for name, lat in result["single_call_ms"].items():
+        print(f"    {name:<24} p50 {lat['p50']:>7.3f} мс  p99 {lat['p99']:>7.3f} мс")
+    c = result["concurrent"]
+    print(f"    {c['writers']} писателей/{c['readers']} читателей: {c['writes_per_s']:.0f} записей/с, "
+          f"{c['reads_per_s']:.0f} чтений/с, locked {c['locked_events']} ({c['locked_rate']:.2%}), ошибки {c['errors']}")
+    print(f"    рост файла: {result['file_bytes']['growth'] / 1024:.0f} КБ")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Бенчмарк слоя хранения utils.py")
+    parser.add_argument("--sizes", default="10000,100000,1000000")
+    parser.add_argument("--modes", default="delete:full,wal:full,wal:normal",
+                        help="сочетания journal_mode:synchronous через запятую")
+    parser.add_argument("--calls", type=int, default=2000, help="вызовов каждой функции в одиночном режиме")
+    parser.add_argument("--writers", type=int, default=8)
+    parser.add_argument("--readers", type=int, default=4)
+    parser.add_argument("--duration", type=float, default=5.0, help="секунд на параллельную фазу")
+    parser.add_argument("--workdir", help="каталог для файлов базы (по умолчанию временный)")
+    parser.add_argument("--save", nargs="?", const="", help="сохранить результат как JSON-бейзлайн")
+    parser.add_argument("--compare", help="сравнить с сохранённым бейзлайном")
+    args = parser.parse_args(argv)
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="exbot-storage-")
+    prepare_environment(os.path.join(workdir, "database.db"))
+    sizes = [int(s) for s in args.sizes.split(",") if s]
+    modes = [m.strip().lower() for m in args.modes.split(",") if m.strip()]
+    results = run(sizes, modes, args.calls, args.writers, args.readers, args.duration, workdir)
+    if args.save is not None:
+        print(f"Бейзлайн сохранён: {save_baseline('storage', results, args.save or None)}")
+    if args.compare:
+        print_comparison(compare_results(load_baseline(args.compare), results))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""Генерация синтетических апдейтов Telegram в виде словарей Bot API."""
+import itertools
+import json
+import random
+import time
+
+_update_ids = itertools.count(1)
+_message_ids = itertools.count(1)
+
+USER_ID_BASE = 500000000
+
+
+def _user(user_id, username=None):
+    user = {"id": user_id, "is_bot": False, "first_name": f"User{user_id}"}
+    if username:
+        user["username"] = username
+    return user
+
+
+def _message(user_id, **fields):
+    message = {
+        "message_id": next(_message_ids),
+        "date": int(time.time()),
+        "chat": {"id": user_id, "type": "private"},
+        "from": _user(user_id),
+    }
+    message.update(fields)
+    return {"update_id": next(_update_ids), "message": message}
+
+
+def text_update(user_id, text):
+    return _message(user_id, text=text)
+
+
+def command_update(user_id, command, *args):
+    text = " ".join((f"/{command}",) + args)
+    return _message(
+        user_id,
+        text=text,
+        entities=[{"type": "bot_command", "offset": 0, "length": len(command) + 1}],
+    )
+
+
+def location_update(user_id, latitude, longitude):
+    return _message(user_id, location={"latitude": latitude, "longitude": longitude})
+
+
+def callback_update(user_id, data, message_id=1):
+    return {
+        "update_id": next(_update_ids),
+        "callback_query": {
+            "id": str(next(_update_ids)),
+            "from": _user(user_id),
+            "chat_instance": str(user_id),
+            "data": data,
+            "message": {
+                "message_id": message_id,
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "text": "menu",
+            },
+        },
+    }
+
+
+def client_flow(user_id, pair, amount, location, fine_location=None):
+    """Полный клиентский сценарий: start → пара → сумма → локация → точное место."""
+    if fine_location is None:
+        last = ("get_fine_location", text_update(user_id, "Пропустить"))
+    else:
+        last = ("get_fine_location", location_update(user_id, *fine_location))
+    return [
+        ("start", command_update(user_id, "start")),
+        ("choose_operation", text_update(user_id, pair)),
+        ("get_amount", text_update(user_id, str(amount))),
+        ("get_location", text_update(user_id, location)),
+        last,
+    ]
+
+
+ADMIN_ID_BASE = 400000000
+
+
+def load_catalog(path="config.json"):
+    """Пары и локации по умолчанию — те же, что получит новый админ в get_admin_data."""
+    with open(path, "r", encoding="utf-8") as f:
+        config = json.load(f)
+    return config["default_active_pairs"], config["default_active_locations"]
+
+
+def load_admin_locations(path="config.json"):
+    """Все локации нового админа в порядке меню: кнопка локации несёт её индекс."""
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)["default_locations"]
+
+
+def admin_flow(user_id, otp, location):
+    """Активация OTP и короткая сессия в админке. Каждый шаг — (имя, апдейт, ожидаемых ответов)."""
+    from ex_callbacks import encode, list_version
+    locations = load_admin_locations()
+    index = locations.index(location)
+    return [
+        ("otp", command_update(user_id, "otp", otp), 1),
+        ("start", command_update(user_id, "start"), 1),
+        ("admin_menu", text_update(user_id, "Админка"), 1),
+        ("edit_locations", callback_update(user_id, encode("edit_locations")), 1),
+        ("toggle_location", callback_update(user_id, encode("toggle_loc", index, list_version(locations))), 1),
+        ("back_to_main", callback_update(user_id, encode("back_to_main")), 1),
+    ]
+
+
+def generate_population(clients, admins=0, otp_codes=(), ref_ratio=0.3, geo_ratio=0.5,
+                        pairs=None, locations=None, seed=1):
+    """Сценарии для популяции пользователей: клиенты (часть — по реф. ссылкам) и админы по OTP."""
+    rnd = random.Random(seed)
+    if pairs is None or locations is None:
+        pairs, locations = load_catalog()
+    scripts = []
+    admin_ids = [ADMIN_ID_BASE + n for n in range(admins)]
+    for admin_id, otp in zip(admin_ids, otp_codes):
+        scripts.append({"user_id": admin_id, "kind": "admin",
+                        "steps": admin_flow(admin_id, otp, rnd.choice(locations))})
+    for n in range(clients):
+        user_id = USER_ID_BASE + n
+        fine = (15.6 + rnd.random() / 10, 73.7 + rnd.random() / 10) if rnd.random() < geo_ratio else None
+        steps = [(name, payload, 1) for name, payload in client_flow(
+            user_id, rnd.choice(pairs), rnd.randint(100, 500000), rnd.choice(locations), fine,
+        )]
+        if admin_ids and rnd.random() < ref_ratio:
+            ref = f"ref_{rnd.choice(admin_ids)}"
+            steps[0] = ("start", command_update(user_id, "start", ref), 1)
+        scripts.append({"user_id": user_id, "kind": "client", "steps": steps})
+    rnd.shuffle(scripts)
+    return scripts
@@ -1,6 +1,7 @@
 import os
 import logging
 from telegram.ext import Application
+from ex_persistence import SqlitePersistence, persistence_settings
 from dotenv import load_dotenv
 import json
 import asyncio  # Добавляем импорт asyncio
@@ -96,8 +97,20 @@ def load_config():
 # Загружаем конфиг при импорте модуля
 load_config()
 
+# Локальный стенд вместо api.telegram.org (например, bench.fake_api): http://127.0.0.1:8081/bot
+BASE_URL = os.getenv("TELEGRAM_BASE_URL")
+
 # Создаём application с увеличенными тайм-аутами
-application = Application.builder().token(TOKEN).read_timeout(10).write_timeout(10).connect_timeout(10).build()
+builder = Application.builder().token(TOKEN).read_timeout(10).write_timeout(10).connect_timeout(10)
+if BASE_URL:
+    file_url = BASE_URL[:-3] + "file/bot" if BASE_URL.endswith("/bot") else BASE_URL
+    builder = builder.base_url(BASE_URL).base_file_url(file_url)
+    logger.info(f"Используется base_url {BASE_URL}")
+# Состояния диалогов и user_data переживают перезапуск (секция "persistence" в config.json)
+persistence = persistence_settings(bot_config)
+if persistence['enabled']:
+    builder = builder.persistence(SqlitePersistence(update_interval=float(persistence['update_interval'])))
+application = builder.build()
 
 # Добавляем stop_event к application
 application.stop_event = asyncio.Event()
@@ -11,9 +11,14 @@ from telegram.ext import (
     filters,
     CommandHandler
 )
-from ex_owner import generate_otp, check_subscription
-from utils import get_user_data, save_otp_data, save_user_data, get_admin_data, save_admin_data
-from telegram.error import BadRequest
+from ex_owner import issue_otps, check_subscription
+from ex_callbacks import decode, encode, item, list_version, pattern
+from ex_bulk import BULK_HELP, apply_operations, parse_document, parse_text
+from ex_quotes import parse_tiers
+from ex_shards import notify
+from utils import get_user_data, save_user_data, get_admin_data, save_admin_data, get_connection
+from ex_pages import MAX_PREFIX, cached, nav_row, page, search, search_hint, selection_text
+from ex_render import edit_message, reply_message
 
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
@@ -22,76 +27,144 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 # Состояния для ConversationHandler
-ADMIN_STATE, ADD_PAIR, ADD_LOCATION, EDIT_RATES, SET_RATE, EDIT_PAIRS, EDIT_LOCATIONS, GENERATE_OTP, BROADCAST = range(9)
+ADMIN_STATE, ADD_PAIR, ADD_LOCATION, EDIT_RATES, SET_RATE, EDIT_PAIRS, EDIT_LOCATIONS, GENERATE_OTP, BROADCAST, BULK_EDIT = range(10)
 
 def build_admin_entry_menu():
-    keyboard = [[InlineKeyboardButton("Войти в админку 🔐", callback_data='enter_admin')]]
+    keyboard = [[InlineKeyboardButton("Войти в админку 🔐", callback_data=encode('enter_admin'))]]
     return InlineKeyboardMarkup(keyboard)
 
 def build_main_menu(user_id):
     from exbot import bot_config  # Локальный импорт
     keyboard = [
-        [InlineKeyboardButton("Курсы ⚙️", callback_data='edit_rates'),
-         InlineKeyboardButton("Локации 🌍", callback_data='edit_locations')],
-        [InlineKeyboardButton("Пары 💱", callback_data='edit_pairs'),
-         InlineKeyboardButton("Установить курс", callback_data='set_rate')],
-        [InlineKeyboardButton("Добавить/удалить локацию", callback_data='manage_location')],
-        [InlineKeyboardButton("Добавить/удалить пару", callback_data='manage_pair')],
-        [InlineKeyboardButton("Рассылка 📩", callback_data='broadcast')],
-        [InlineKeyboardButton("Выход 🚪", callback_data='exit')]
+        [InlineKeyboardButton("Курсы ⚙️", callback_data=encode('edit_rates')),
+         InlineKeyboardButton("Локации 🌍", callback_data=encode('edit_locations'))],
+        [InlineKeyboardButton("Пары 💱", callback_data=encode('edit_pairs')),
+         InlineKeyboardButton("Установить курс", callback_data=encode('set_rate'))],
+        [InlineKeyboardButton("Добавить/удалить локацию", callback_data=encode('manage_location'))],
+        [InlineKeyboardButton("Добавить/удалить пару", callback_data=encode('manage_pair'))],
+        [InlineKeyboardButton("Массовое редактирование 📋", callback_data=encode('bulk_edit'))],
+        [InlineKeyboardButton("Рассылка 📩", callback_data=encode('broadcast'))],
+        [InlineKeyboardButton("Выход 🚪", callback_data=encode('exit'))]
     ]
     active_order, request_count, referrer_id, in_admin_mode = get_user_data(user_id)  # Исправлено: распаковываем 4 значения
     if str(user_id) == bot_config["owner_id"]:
-        keyboard.insert(0, [InlineKeyboardButton("Сгенерировать OTP", callback_data='generate_otp')])
-        keyboard.insert(1, [InlineKeyboardButton("Проверить подписку 🔍", callback_data='check_subscription')])
-        keyboard.insert(2, [InlineKeyboardButton("Моя реф. ссылка 🔗", callback_data='generate_ref_link')])
-        keyboard.insert(3, [InlineKeyboardButton("Перезагрузить конфиг 🔄", callback_data='reload_config')])
+        keyboard.insert(0, [InlineKeyboardButton("Сгенерировать OTP", callback_data=encode('generate_otp'))])
+        keyboard.insert(1, [InlineKeyboardButton("Проверить подписку 🔍", callback_data=encode('check_subscription'))])
+        keyboard.insert(2, [InlineKeyboardButton("Моя реф. ссылка 🔗", callback_data=encode('generate_ref_link'))])
+        keyboard.insert(3, [InlineKeyboardButton("Перезагрузить конфиг 🔄", callback_data=encode('reload_config'))])
     elif active_order and 'admin_expiry' in json.loads(active_order):
-        keyboard.insert(0, [InlineKeyboardButton("Проверить подписку 🔍", callback_data='check_subscription')])
-        keyboard.insert(1, [InlineKeyboardButton("Моя реф. ссылка 🔗", callback_data='generate_ref_link')])
+        keyboard.insert(0, [InlineKeyboardButton("Проверить подписку 🔍", callback_data=encode('check_subscription'))])
+        keyboard.insert(1, [InlineKeyboardButton("Моя реф. ссылка 🔗", callback_data=encode('generate_ref_link'))])
     return InlineKeyboardMarkup(keyboard)
 
-def build_locations_menu(admin_id):
-    admin_data = get_admin_data(admin_id)
-    keyboard = [
-        [InlineKeyboardButton(f"{loc} ✅" if loc in admin_data['active_locations'] else f"{loc} ❌", callback_data=f"toggle_loc_{loc}")
-         for loc in admin_data['locations'][i:i+2]]
-        for i in range(0, len(admin_data['locations']), 2)
+def build_locations_menu(admin_data, found):
+    rows = [
+        [InlineKeyboardButton(f"{loc} ✅" if loc in admin_data['active_locations'] else f"{loc} ❌",
+                              callback_data=encode('toggle_loc', index, list_version(admin_data['locations'])))
+         for index, loc in found[i:i+2]]
+        for i in range(0, len(found), 2)
+    ]
+    return rows, [
+        InlineKeyboardButton("Сбросить 🔄", callback_data=encode('reset_locations')),
+        InlineKeyboardButton("Сохранить ✅", callback_data=encode('save_locations')),
+        InlineKeyboardButton("Назад ⬅️", callback_data=encode('back_to_main'))
     ]
-    keyboard.append([
-        InlineKeyboardButton("Сбросить 🔄", callback_data='reset_locations'),
-        InlineKeyboardButton("Сохранить ✅", callback_data='save_locations'),
-        InlineKeyboardButton("Назад ⬅️", callback_data='back_to_main')
-    ])
-    return InlineKeyboardMarkup(keyboard)
 
-def build_pairs_menu(admin_id):
-    admin_data = get_admin_data(admin_id)
+def build_pairs_menu(admin_data, found):
     active_count = len(admin_data['active_pairs'])
     total_count = len(admin_data['pairs'])
-    keyboard = [
-        [InlineKeyboardButton(f"{pair} ✅" if pair in admin_data['active_pairs'] else f"{pair} ❌", callback_data=f"toggle_pair_{pair}")]
-        for pair in admin_data['pairs']
+    rows = [
+        [InlineKeyboardButton(f"{pair} ✅" if pair in admin_data['active_pairs'] else f"{pair} ❌",
+                              callback_data=encode('toggle_pair', index, list_version(admin_data['pairs'])))]
+        for index, pair in found
     ]
-    keyboard.append([
-        InlineKeyboardButton("Сбросить 🔄", callback_data='reset_pairs'),
-        InlineKeyboardButton(f"Сохранить ({active_count}/{total_count}) ✅", callback_data='save_pairs'),
-        InlineKeyboardButton("Назад ⬅️", callback_data='back_to_main')
-    ])
-    return InlineKeyboardMarkup(keyboard)
+    return rows, [
+        InlineKeyboardButton("Сбросить 🔄", callback_data=encode('reset_pairs')),
+        InlineKeyboardButton(f"Сохранить ({active_count}/{total_count}) ✅", callback_data=encode('save_pairs')),
+        InlineKeyboardButton("Назад ⬅️", callback_data=encode('back_to_main'))
+    ]
+
+def build_delete_pairs_menu(admin_data, found):
+    rows = [
+        [InlineKeyboardButton(pair, callback_data=encode('delete_pair', index, list_version(admin_data['pairs'])))
+         for index, pair in found[i:i+2]]
+        for i in range(0, len(found), 2)
+    ]
+    return rows, [InlineKeyboardButton("Назад ⬅️", callback_data=encode('back_to_main'))]
+
+def build_delete_locations_menu(admin_data, found):
+    rows = [
+        [InlineKeyboardButton(loc, callback_data=encode('delete_location', index, list_version(admin_data['locations'])))
+         for index, loc in found[i:i+2]]
+        for i in range(0, len(found), 2)
+    ]
+    return rows, [InlineKeyboardButton("Назад ⬅️", callback_data=encode('back_to_main'))]
+
+# Меню со списком: поле профиля, заголовок, кнопки страницы, действие листания, состояние диалога
+MENUS = {
+    'pairs': ('pairs', lambda data: f"💱 Активные пары: {selection_text(data['active_pairs'])}\nВыбери или обнови:",
+              build_pairs_menu, 'page_pairs', EDIT_PAIRS),
+    'locations': ('locations', lambda data: f"🌍 Активные локации: {selection_text(data['active_locations'])}\nВыбери или обнови:",
+                  build_locations_menu, 'page_locations', EDIT_LOCATIONS),
+    'delete_pairs': ('pairs', lambda data: "Выбери пару для удаления:",
+                     build_delete_pairs_menu, 'page_delete_pairs', EDIT_PAIRS),
+    'delete_locations': ('locations', lambda data: "Выбери локацию для удаления:",
+                         build_delete_locations_menu, 'page_delete_locations', EDIT_LOCATIONS),
+}
+PAGE_ACTIONS = {menu[3]: kind for kind, menu in MENUS.items()}
+
+def menu_state(context, kind, reset=False):
+    """Какое меню со списком открыто, его страница и фильтр; хранится в user_data."""
+    state = context.user_data.get('admin_menu')
+    if reset or not state or state['kind'] != kind:
+        state = {'kind': kind, 'offset': 0, 'prefix': ''}
+        context.user_data['admin_menu'] = state
+    return state
+
+def render_menu(admin_id, state, note=""):
+    """(текст, клавиатура) текущей страницы меню; страница строится один раз на версию профиля."""
+    field, title, build, page_action, _ = MENUS[state['kind']]
+    admin_data = get_admin_data(admin_id)
+    found = search(admin_data[field], state['prefix'])
+    offset, items = page(found, state['offset'])
+    state['offset'] = offset
+
+    def build_page():
+        rows, footer = build(admin_data, items)
+        nav = nav_row(page_action, offset, len(found))
+        if nav:
+            rows.append(nav)
+        if state['prefix']:
+            rows.append([InlineKeyboardButton("Сбросить фильтр ✖️", callback_data=encode('clear_filter'))])
+        rows.append(footer)
+        text = title(admin_data) + search_hint(len(admin_data[field]), state['prefix'], len(found))
+        return text, InlineKeyboardMarkup(rows)
+
+    text, markup = cached((admin_id, state['kind'], admin_data['version'], state['prefix'], offset), build_page)
+    return text + note, markup
 
 def build_rates_menu(admin_id):
     admin_data = get_admin_data(admin_id)
     keyboard = [
-        [InlineKeyboardButton(f"{rate_key}: {rate_value:.2f}", callback_data=f"set_rate_{rate_key}")]
-        for rate_key, rate_value in admin_data['rates'].items()
+        [InlineKeyboardButton(f"{rate_key}: {rate_value:.2f}", callback_data=encode('pick_rate', i, list_version(admin_data['rates'])))]
+        for i, (rate_key, rate_value) in enumerate(admin_data['rates'].items())
     ]
     keyboard.append([
-        InlineKeyboardButton("Сохранить ✅", callback_data='save_rates'),
-        InlineKeyboardButton("Назад ⬅️", callback_data='back_to_main')
+        InlineKeyboardButton("Сохранить ✅", callback_data=encode('save_rates')),
+        InlineKeyboardButton("Назад ⬅️", callback_data=encode('back_to_main'))
     ])
     return InlineKeyboardMarkup(keyboard)
 
+def format_rates_text(admin_data):
+    tiers = admin_data.get('tiers') or {}
+    lines = []
+    for rate_key, rate_value in admin_data['rates'].items():
+        line = f"*{rate_key}*: {rate_value:.2f}"
+        if rate_key in tiers:
+            line += f" (уровней: {len(tiers[rate_key]['t'])})"
+        lines.append(line)
+    return "\n".join(lines)
+
 async def add_location(update, context):
     user_id = update.message.from_user.id
     admin_id = user_id  # Админ редактирует свои данные
@@ -116,7 +189,7 @@ async def add_location(update, context):
     admin_data['active_locations'].append(new_location)
     save_admin_data(admin_id, admin_data)
     logger.info(f"Локация '{new_location}' добавлена")
-    await update.message.reply_text(f"Локация '{new_location}' добавлена!", reply_markup=build_main_menu(user_id))
+    await reply_message(update.message, f"Локация '{new_location}' добавлена!", reply_markup=build_main_menu(user_id))
     return ADMIN_STATE
 
 async def add_pair(update, context):
@@ -141,438 +214,379 @@ async def add_pair(update, context):
         admin_data['rates'][new_pair] = 1.0
         save_admin_data(admin_id, admin_data)
         logger.info(f"Пара '{new_pair}' добавлена для admin_id={admin_id}")
-        await update.message.reply_text(
+        await reply_message(
+            update.message,
             f"Пара '{new_pair}' добавлена!",
             reply_markup=build_main_menu(user_id)
         )
     except Exception as e:
         logger.error(f"Ошибка при добавлении пары '{new_pair}' для admin_id={admin_id}: {str(e)}")
-        await update.message.reply_text(
+        await reply_message(
+            update.message,
             "Произошла ошибка при добавлении пары. Попробуй снова или обратись в поддержку.",
             reply_markup=build_main_menu(user_id)
         )
     
     return ADMIN_STATE
 
-async def admin_callback(update, context):
+async def admin_enter_admin(update, context, callback):
     query = update.callback_query
-    if not query:
-        logger.error("Нет callback_query в update!")
-        await update.message.reply_text("Ошибка обработки команды. Попробуй снова.")
-        return ConversationHandler.END
-
-    try:
-        await query.answer()
-        logger.info(f"Callback обработан: user_id={query.from_user.id}, choice={query.data}")
-    except Exception as e:
-        logger.error(f"Ошибка при ответе на callback для user_id={query.from_user.id}: {str(e)}")
-        return ConversationHandler.END
-
-    choice = query.data
     user_id = query.from_user.id
-    admin_id = user_id
-    active_order, request_count, referrer_id, in_admin_mode = get_user_data(user_id)
-    logger.info(f"Состояние: user_id={user_id}, in_admin_mode={in_admin_mode}, choice={choice}")
-
+    active_order, _, referrer_id, _ = get_user_data(user_id)
     from exbot import bot_config
-    owner_id = bot_config["owner_id"]
-
-    # Проверка: если не в админке и не пытаемся войти, блокируем действия админки
-    if choice != 'enter_admin' and not in_admin_mode:
-        await query.message.reply_text("Сначала войди в админку через 'Войти в админку'!")
-        return ConversationHandler.END
-
-    if choice == 'enter_admin':
-        if str(user_id) != owner_id:
-            if not active_order:
+    if str(user_id) != bot_config["owner_id"]:
+        if not active_order:
+            await query.message.reply_text("Эта функция доступна только администраторам!")
+            return ConversationHandler.END
+        try:
+            active_order_dict = json.loads(active_order) if isinstance(active_order, str) else {}
+            if not isinstance(active_order_dict, dict) or 'admin_expiry' not in active_order_dict:
                 await query.message.reply_text("Эта функция доступна только администраторам!")
                 return ConversationHandler.END
-            try:
-                active_order_dict = json.loads(active_order) if isinstance(active_order, str) else {}
-                if not isinstance(active_order_dict, dict) or 'admin_expiry' not in active_order_dict:
-                    await query.message.reply_text("Эта функция доступна только администраторам!")
-                    return ConversationHandler.END
-                expiry = datetime.strptime(active_order_dict['admin_expiry'], '%Y-%m-%d %H:%M:%S').replace(tzinfo=pytz.UTC)
-                if datetime.now(pytz.UTC) > expiry:
-                    active_order_dict.pop('admin_expiry', None)
-                    save_user_data(user_id, active_order_dict, referrer_id, in_admin_mode=0)
-                    await query.message.reply_text("Ваша административная подписка истекла!")
-                    return ConversationHandler.END
-            except (json.JSONDecodeError, TypeError) as e:
-                logger.error(f"Ошибка парсинга active_order для user_id={user_id}: {str(e)}, active_order={active_order}")
-                await query.message.reply_text("Ошибка данных. Попробуй снова или пиши в поддержку.")
+            expiry = datetime.strptime(active_order_dict['admin_expiry'], '%Y-%m-%d %H:%M:%S').replace(tzinfo=pytz.UTC)
+            if datetime.now(pytz.UTC) > expiry:
+                active_order_dict.pop('admin_expiry', None)
+                save_user_data(user_id, active_order_dict, referrer_id, in_admin_mode=0)
+                await query.message.reply_text("Ваша административная подписка истекла!")
                 return ConversationHandler.END
-        # Устанавливаем in_admin_mode=1 при входе
-        active_order_dict = json.loads(active_order) if active_order and isinstance(active_order, str) else {}
-        save_user_data(user_id, active_order_dict, referrer_id, in_admin_mode=1)
-        # Проверяем, что данные обновились
-        _, _, _, in_admin_mode_check = get_user_data(user_id)
-        logger.debug(f"После сохранения: in_admin_mode={in_admin_mode_check}")
-        if not in_admin_mode_check:
-            logger.error(f"Не удалось установить in_admin_mode=1 для user_id={user_id}")
-            await query.message.reply_text("Ошибка входа в админку. Попробуй снова или пиши в поддержку.")
+        except (json.JSONDecodeError, TypeError) as e:
+            logger.error(f"Ошибка парсинга active_order для user_id={user_id}: {str(e)}, active_order={active_order}")
+            await query.message.reply_text("Ошибка данных. Попробуй снова или пиши в поддержку.")
             return ConversationHandler.END
-        await query.message.reply_text(
-            "Переключаемся в админку...",
-            reply_markup=ReplyKeyboardRemove()
-        )
-        reply_markup = build_main_menu(user_id)
-        await query.message.reply_text(
-            "Админ-панель: выбери раздел",
-            reply_markup=reply_markup,
-            parse_mode='Markdown'
-        )
-        return ADMIN_STATE
-
-    elif choice == 'exit':
-        active_order_dict = json.loads(active_order) if active_order and isinstance(active_order, str) else {}
-        save_user_data(user_id, active_order_dict, referrer_id, in_admin_mode=0)
-        from exbot import build_client_menu
-        reply_markup = build_client_menu(user_id)
-        await query.message.reply_text(
-            bot_config["messages"]["welcome"].format(name=query.from_user.first_name),
-            reply_markup=reply_markup
-        )
-        await query.message.delete()
+    # Устанавливаем in_admin_mode=1 при входе
+    active_order_dict = json.loads(active_order) if active_order and isinstance(active_order, str) else {}
+    save_user_data(user_id, active_order_dict, referrer_id, in_admin_mode=1)
+    # Проверяем, что данные обновились
+    _, _, _, in_admin_mode_check = get_user_data(user_id)
+    logger.debug(f"После сохранения: in_admin_mode={in_admin_mode_check}")
+    if not in_admin_mode_check:
+        logger.error(f"Не удалось установить in_admin_mode=1 для user_id={user_id}")
+        await query.message.reply_text("Ошибка входа в админку. Попробуй снова или пиши в поддержку.")
         return ConversationHandler.END
+    await query.message.reply_text(
+        "Переключаемся в админку...",
+        reply_markup=ReplyKeyboardRemove()
+    )
+    reply_markup = build_main_menu(user_id)
+    await reply_message(
+        query.message,
+        "Админ-панель: выбери раздел",
+        reply_markup=reply_markup,
+        parse_mode='Markdown'
+    )
+    return ADMIN_STATE
 
-    elif choice == 'manage_location':
-        keyboard = [
-            [InlineKeyboardButton("Добавить", callback_data='add_location')],
-            [InlineKeyboardButton("Удалить", callback_data='remove_location')]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        try:
-            await query.edit_message_text("Что ты хочешь сделать с локациями?", reply_markup=reply_markup, parse_mode='Markdown')
-        except BadRequest as e:
-            if "Message is not modified" in str(e):
-                logger.info(f"Сообщение не изменилось для user_id={query.from_user.id}, choice={choice}")
-            else:
-                logger.error(f"Ошибка при редактировании сообщения для user_id={query.from_user.id}: {str(e)}")
-                await query.message.reply_text("Что ты хочешь сделать с локациями?", reply_markup=reply_markup, parse_mode='Markdown')
-        return ADMIN_STATE
+async def admin_exit(update, context, callback):
+    query = update.callback_query
+    user_id = query.from_user.id
+    active_order, _, referrer_id, _ = get_user_data(user_id)
+    from exbot import bot_config
+    active_order_dict = json.loads(active_order) if active_order and isinstance(active_order, str) else {}
+    save_user_data(user_id, active_order_dict, referrer_id, in_admin_mode=0)
+    from exbot import build_client_menu
+    reply_markup = build_client_menu(user_id)
+    await query.message.reply_text(
+        bot_config["messages"]["welcome"].format(name=query.from_user.first_name),
+        reply_markup=reply_markup
+    )
+    await query.message.delete()
+    return ConversationHandler.END
 
-    elif choice == 'manage_pair':
-        keyboard = [
-            [InlineKeyboardButton("Добавить", callback_data='add_pair')],
-            [InlineKeyboardButton("Удалить", callback_data='remove_pair')]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        try:
-            await query.edit_message_text("Что ты хочешь сделать с парами?", reply_markup=reply_markup, parse_mode='Markdown')
-        except BadRequest as e:
-            if "Message is not modified" in str(e):
-                logger.info(f"Сообщение не изменилось для user_id={query.from_user.id}, choice={choice}")
-            else:
-                logger.error(f"Ошибка при редактировании сообщения для user_id={query.from_user.id}: {str(e)}")
-                await query.message.reply_text("Что ты хочешь сделать с парами?", reply_markup=reply_markup, parse_mode='Markdown')
-        return ADMIN_STATE
+async def admin_manage_location(update, context, callback):
+    query = update.callback_query
+    user_id = query.from_user.id
+    keyboard = [
+        [InlineKeyboardButton("Добавить", callback_data=encode('add_location'))],
+        [InlineKeyboardButton("Удалить", callback_data=encode('remove_location'))]
+    ]
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    await edit_message(query, "Что ты хочешь сделать с локациями?", reply_markup=reply_markup, parse_mode='Markdown')
+    return ADMIN_STATE
 
-    elif choice == 'add_location':
-        try:
-            await query.edit_message_text("Введите новую локацию (например, 'Гоа'):")
-        except BadRequest as e:
-            if "Message is not modified" in str(e):
-                logger.info(f"Сообщение не изменилось для user_id={query.from_user.id}, choice={choice}")
-            else:
-                logger.error(f"Ошибка при редактировании сообщения для user_id={query.from_user.id}: {str(e)}")
-                await query.message.reply_text("Введите новую локацию (например, 'Гоа'):")
-        return ADD_LOCATION
+async def admin_manage_pair(update, context, callback):
+    query = update.callback_query
+    user_id = query.from_user.id
+    keyboard = [
+        [InlineKeyboardButton("Добавить", callback_data=encode('add_pair'))],
+        [InlineKeyboardButton("Удалить", callback_data=encode('remove_pair'))]
+    ]
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    await edit_message(query, "Что ты хочешь сделать с парами?", reply_markup=reply_markup, parse_mode='Markdown')
+    return ADMIN_STATE
 
-    elif choice == 'add_pair':
-        try:
-            await query.edit_message_text("Введите новую валютную пару (например, 'Рубли → Доллары'):")
-        except BadRequest as e:
-            if "Message is not modified" in str(e):
-                logger.info(f"Сообщение не изменилось для user_id={query.from_user.id}, choice={choice}")
-            else:
-                logger.error(f"Ошибка при редактировании сообщения для user_id={query.from_user.id}: {str(e)}")
-                await query.message.reply_text("Введите новую валютную пару (например, 'Рубли → Доллары'):")
-        return ADD_PAIR
+async def admin_add_location(update, context, callback):
+    query = update.callback_query
+    user_id = query.from_user.id
+    await edit_message(query, "Введите новую локацию (например, 'Гоа'):")
+    return ADD_LOCATION
 
-    elif choice == 'edit_rates':
-        return await edit_rates_handler(update, context, admin_id)
+async def admin_add_pair(update, context, callback):
+    query = update.callback_query
+    user_id = query.from_user.id
+    await edit_message(query, "Введите новую валютную пару (например, 'Рубли → Доллары'):")
+    return ADD_PAIR
 
-    elif choice == 'edit_pairs':
-        return await edit_pairs_handler(update, context, admin_id)
+async def admin_edit_rates(update, context, callback):
+    query = update.callback_query
+    user_id = query.from_user.id
+    return await edit_rates_handler(update, context, user_id)
 
-    elif choice == 'edit_locations':
-        return await edit_locations_handler(update, context, admin_id)
+async def admin_edit_pairs(update, context, callback):
+    query = update.callback_query
+    user_id = query.from_user.id
+    return await edit_pairs_handler(update, context, user_id)
 
-    elif choice == 'set_rate':
-        admin_data = get_admin_data(admin_id)
-        rates_text = "\n".join([f"*{k}*: {v:.2f}" for k, v in admin_data['rates'].items()])
-        reply_markup = build_rates_menu(admin_id)
-        try:
-            await query.edit_message_text(
-                f"📊 *Текущие курсы:*\n{rates_text}\nВыбери пару для редактирования:",
-                reply_markup=reply_markup,
-                parse_mode='Markdown'
-            )
-        except BadRequest as e:
-            if "Message is not modified" in str(e):
-                logger.info(f"Сообщение не изменилось для user_id={query.from_user.id}, choice={choice}")
-            else:
-                logger.error(f"Ошибка при редактировании сообщения для user_id={query.from_user.id}: {str(e)}")
-                await query.message.reply_text(
-                    f"📊 *Текущие курсы:*\n{rates_text}\nВыбери пару для редактирования:",
-                    reply_markup=reply_markup,
-                    parse_mode='Markdown'
-                )
-        return SET_RATE
+async def admin_edit_locations(update, context, callback):
+    query = update.callback_query
+    user_id = query.from_user.id
+    return await edit_locations_handler(update, context, user_id)
 
-    elif choice == 'generate_otp':
-        if str(user_id) != owner_id:
-            try:
-                await query.edit_message_text("Только владелец может генерировать OTP!")
-            except BadRequest as e:
-                if "Message is not modified" in str(e):
-                    logger.info(f"Сообщение не изменилось для user_id={query.from_user.id}, choice={choice}")
-                else:
-                    logger.error(f"Ошибка при редактировании сообщения для user_id={query.from_user.id}: {str(e)}")
-                    await query.message.reply_text("Только владелец может генерировать OTP!")
-            return ADMIN_STATE
-        keyboard = [
-            [InlineKeyboardButton("7 дней", callback_data='generate_otp_7')],
-            [InlineKeyboardButton("30 дней", callback_data='generate_otp_30')]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        try:
-            await query.edit_message_text("Выбери срок действия OTP:", reply_markup=reply_markup, parse_mode='Markdown')
-        except BadRequest as e:
-            if "Message is not modified" in str(e):
-                logger.info(f"Сообщение не изменилось для user_id={query.from_user.id}, choice={choice}")
-            else:
-                logger.error(f"Ошибка при редактировании сообщения для user_id={query.from_user.id}: {str(e)}")
-                await query.message.reply_text("Выбери срок действия OTP:", reply_markup=reply_markup, parse_mode='Markdown')
-        return GENERATE_OTP
-
-    elif choice == 'generate_otp_7':
-        if str(user_id) == owner_id:
-            otp, expiry = generate_otp(7)
-            save_otp_data(otp, None, expiry.strftime('%Y-%m-%d %H:%M:%S'), 7)
-            try:
-                await query.edit_message_text(
-                    f"Сгенерирован OTP\nСрок действия: 7 дней\nКод: `/otp {otp}`\nСкопируй и отправь новому админу.",
-                    reply_markup=build_main_menu(user_id),
-                    parse_mode='Markdown'
-                )
-            except BadRequest as e:
-                if "Message is not modified" in str(e):
-                    logger.info(f"Сообщение не изменилось для user_id={query.from_user.id}, choice={choice}")
-                else:
-                    logger.error(f"Ошибка при редактировании сообщения для user_id={query.from_user.id}: {str(e)}")
-                    await query.message.reply_text(
-                        f"Сгенерирован OTP\nСрок действия: 7 дней\nКод: `/otp {otp}`\nСкопируй и отправь новому админу.",
-                        reply_markup=build_main_menu(user_id),
-                        parse_mode='Markdown'
-                    )
-        return ADMIN_STATE
+async def admin_set_rate(update, context, callback):
+    query = update.callback_query
+    user_id = query.from_user.id
+    admin_data = get_admin_data(user_id)
+    rates_text = format_rates_text(admin_data)
+    reply_markup = build_rates_menu(user_id)
+    await edit_message(
+        query,
+        f"📊 *Текущие курсы:*\n{rates_text}\nВыбери пару для редактирования:",
+        reply_markup=reply_markup,
+        parse_mode='Markdown'
+    )
+    return SET_RATE
 
-    elif choice == 'generate_otp_30':
-        if str(user_id) == owner_id:
-            otp, expiry = generate_otp(30)
-            save_otp_data(otp, None, expiry.strftime('%Y-%m-%d %H:%M:%S'), 30)
-            try:
-                await query.edit_message_text(
-                    f"Сгенерирован OTP\nСрок действия: 30 дней\nКод: `/otp {otp}`\nСкопируй и отправь новому админу.",
-                    reply_markup=build_main_menu(user_id),
-                    parse_mode='Markdown'
-                )
-            except BadRequest as e:
-                if "Message is not modified" in str(e):
-                    logger.info(f"Сообщение не изменилось для user_id={query.from_user.id}, choice={choice}")
-                else:
-                    logger.error(f"Ошибка при редактировании сообщения для user_id={query.from_user.id}: {str(e)}")
-                    await query.message.reply_text(
-                        f"Сгенерирован OTP\nСрок действия: 30 дней\nКод: `/otp {otp}`\nСкопируй и отправь новому админу.",
-                        reply_markup=build_main_menu(user_id),
-                        parse_mode='Markdown'
-                    )
+async def admin_generate_otp(update, context, callback):
+    query = update.callback_query
+    user_id = query.from_user.id
+    from exbot import bot_config
+    if str(user_id) != bot_config["owner_id"]:
+        await edit_message(query, "Только владелец может генерировать OTP!")
         return ADMIN_STATE
+    keyboard = [
+        [InlineKeyboardButton("7 дней", callback_data=encode('generate_otp_7'))],
+        [InlineKeyboardButton("30 дней", callback_data=encode('generate_otp_30'))]
+    ]
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    await edit_message(query, "Выбери срок действия OTP:", reply_markup=reply_markup, parse_mode='Markdown')
+    return GENERATE_OTP
 
-    elif choice == 'check_subscription':
-        await check_subscription(update, context)
-        await query.message.reply_text("Вернулся в админку!", reply_markup=build_main_menu(user_id))
-        return ADMIN_STATE
+OTP_DAYS = {'generate_otp_7': 7, 'generate_otp_30': 30}
 
-    elif choice == 'generate_ref_link':
-        ref_link = f"https://t.me/goa_exchangeBot?start=ref_{user_id}"
-        try:
-            await query.edit_message_text(
-                f'<a href="{ref_link}">Мой бот обменник</a>\nСкопируй и отправь друзьям!',
-                reply_markup=build_main_menu(user_id),
-                parse_mode='HTML',
-                disable_web_page_preview=True
-            )
-        except BadRequest as e:
-            if "Message is not modified" in str(e):
-                logger.info(f"Сообщение не изменилось для user_id={query.from_user.id}, choice={choice}")
-            else:
-                logger.error(f"Ошибка при редактировании сообщения для user_id={query.from_user.id}: {str(e)}")
-                await query.message.reply_text(
-                    f'<a href="{ref_link}">Мой бот обменник</a>\nСкопируй и отправь друзьям!',
-                    reply_markup=build_main_menu(user_id),
-                    parse_mode='HTML',
-                    disable_web_page_preview=True
-                )
-        return ADMIN_STATE
+async def admin_issue_otp(update, context, callback):
+    query = update.callback_query
+    user_id = query.from_user.id
+    from exbot import bot_config
+    days = OTP_DAYS[callback.action]
+    if str(user_id) == bot_config["owner_id"]:
+        otp = issue_otps(1, days)[0][0]
+        await edit_message(
+            query,
+            f"Сгенерирован OTP\nСрок действия: {days} дней\nКод: `/otp {otp}`\nСкопируй и отправь новому админу.",
+            reply_markup=build_main_menu(user_id),
+            parse_mode='Markdown'
+        )
+    return ADMIN_STATE
 
-    elif choice == 'broadcast':
-        await query.edit_message_text("Введи текст для рассылки своим клиентам:")
-        return BROADCAST
+async def admin_check_subscription(update, context, callback):
+    query = update.callback_query
+    user_id = query.from_user.id
+    await check_subscription(update, context)
+    await reply_message(query.message, "Вернулся в админку!", reply_markup=build_main_menu(user_id))
+    return ADMIN_STATE
 
-    elif choice == 'reload_config':
-        from bot_config import load_config
-        try:
-            load_config()
-            try:
-                await query.edit_message_text("Конфигурация успешно перезагружена!", reply_markup=build_main_menu(user_id))
-            except BadRequest as e:
-                if "Message is not modified" in str(e):
-                    logger.info(f"Сообщение не изменилось для user_id={query.from_user.id}, choice={choice}")
-                else:
-                    logger.error(f"Ошибка при редактировании сообщения для user_id={query.from_user.id}: {str(e)}")
-                    await query.message.reply_text("Конфигурация успешно перезагружена!", reply_markup=build_main_menu(user_id))
-            logger.info(f"Конфигурация перезагружена пользователем {user_id}")
-        except Exception as e:
-            logger.error(f"Ошибка при перезагрузке конфигурации: {str(e)}")
-            try:
-                await query.edit_message_text(f"Ошибка при перезагрузке: {str(e)}", reply_markup=build_main_menu(user_id))
-            except BadRequest as err:
-                if "Message is not modified" in str(err):
-                    logger.info(f"Сообщение не изменилось для user_id={query.from_user.id}, choice={choice}")
-                else:
-                    logger.error(f"Ошибка при редактировании сообщения для user_id={query.from_user.id}: {str(err)}")
-                    await query.message.reply_text(f"Ошибка при перезагрузке: {str(e)}", reply_markup=build_main_menu(user_id))
-        return ADMIN_STATE
+async def admin_generate_ref_link(update, context, callback):
+    query = update.callback_query
+    user_id = query.from_user.id
+    ref_link = f"https://t.me/goa_exchangeBot?start=ref_{user_id}"
+    await edit_message(
+        query,
+        f'<a href="{ref_link}">Мой бот обменник</a>\nСкопируй и отправь друзьям!',
+        reply_markup=build_main_menu(user_id),
+        parse_mode='HTML',
+        disable_web_page_preview=True
+    )
+    return ADMIN_STATE
 
-    elif choice == 'back_to_main':
-        reply_markup = build_main_menu(user_id)
-        try:
-            await query.edit_message_text("Админ-панель: выбери раздел", reply_markup=reply_markup, parse_mode='Markdown')
-        except BadRequest as e:
-            if "Message is not modified" in str(e):
-                logger.info(f"Сообщение не изменилось для user_id={query.from_user.id}, choice={choice}")
-            else:
-                logger.error(f"Ошибка при редактировании сообщения для user_id={query.from_user.id}: {str(e)}")
-                await query.message.reply_text("Админ-панель: выбери раздел", reply_markup=reply_markup, parse_mode='Markdown')
-        return ADMIN_STATE
+async def admin_broadcast(update, context, callback):
+    query = update.callback_query
+    user_id = query.from_user.id
+    await edit_message(query, "Введи текст для рассылки своим клиентам:")
+    return BROADCAST
 
-    elif choice.startswith('delete_pair_'):
-        admin_data = get_admin_data(admin_id)
-        pair_to_delete = choice.replace('delete_pair_', '')
-        if pair_to_delete in admin_data['pairs']:
-            admin_data['pairs'].remove(pair_to_delete)
-            if pair_to_delete in admin_data['active_pairs']:
-                admin_data['active_pairs'].remove(pair_to_delete)
-            if pair_to_delete in admin_data['rates']:
-                del admin_data['rates'][pair_to_delete]
-            save_admin_data(admin_id, admin_data)
-            try:
-                await query.edit_message_text(f"Пара '{pair_to_delete}' удалена!", reply_markup=build_main_menu(user_id))
-            except BadRequest as e:
-                if "Message is not modified" in str(e):
-                    logger.info(f"Сообщение не изменилось для user_id={query.from_user.id}, choice={choice}")
-                else:
-                    logger.error(f"Ошибка при редактировании сообщения для user_id={query.from_user.id}: {str(e)}")
-                    await query.message.reply_text(f"Пара '{pair_to_delete}' удалена!", reply_markup=build_main_menu(user_id))
-        else:
-            try:
-                await query.edit_message_text("Пара не найдена!", reply_markup=build_main_menu(user_id))
-            except BadRequest as e:
-                if "Message is not modified" in str(e):
-                    logger.info(f"Сообщение не изменилось для user_id={query.from_user.id}, choice={choice}")
-                else:
-                    logger.error(f"Ошибка при редактировании сообщения для user_id={query.from_user.id}: {str(e)}")
-                    await query.message.reply_text("Пара не найдена!", reply_markup=build_main_menu(user_id))
+async def admin_bulk_edit(update, context, callback):
+    query = update.callback_query
+    user_id = query.from_user.id
+    context.user_data.pop('bulk_edit', None)
+    await edit_message(query, BULK_HELP, parse_mode='Markdown')
+    return BULK_EDIT
+
+async def admin_reload_config(update, context, callback):
+    query = update.callback_query
+    user_id = query.from_user.id
+    from bot_config import load_config
+    from ex_quotes import invalidate as invalidate_quotes
+    try:
+        load_config()
+        invalidate_quotes()
+        notify('config')
+        await edit_message(query, "Конфигурация успешно перезагружена!", reply_markup=build_main_menu(user_id))
+        logger.info(f"Конфигурация перезагружена пользователем {user_id}")
+    except Exception as e:
+        logger.error(f"Ошибка при перезагрузке конфигурации: {str(e)}")
+        await edit_message(query, f"Ошибка при перезагрузке: {str(e)}", reply_markup=build_main_menu(user_id))
+    return ADMIN_STATE
+
+async def admin_back_to_main(update, context, callback):
+    query = update.callback_query
+    user_id = query.from_user.id
+    reply_markup = build_main_menu(user_id)
+    await edit_message(query, "Админ-панель: выбери раздел", reply_markup=reply_markup, parse_mode='Markdown')
+    return ADMIN_STATE
+
+async def admin_delete_pair(update, context, callback):
+    query = update.callback_query
+    user_id = query.from_user.id
+    admin_data = get_admin_data(user_id)
+    # None, если меню построено до изменения списка пар: индекс мог сдвинуться
+    pair_to_delete = item(callback, admin_data['pairs'])
+    if pair_to_delete is not None:
+        admin_data['pairs'].remove(pair_to_delete)
+        if pair_to_delete in admin_data['active_pairs']:
+            admin_data['active_pairs'].remove(pair_to_delete)
+        if pair_to_delete in admin_data['rates']:
+            del admin_data['rates'][pair_to_delete]
+        admin_data.get('tiers', {}).pop(pair_to_delete, None)
+        save_admin_data(user_id, admin_data)
+        await edit_message(query, f"Пара '{pair_to_delete}' удалена!", reply_markup=build_main_menu(user_id))
+    else:
+        await edit_message(query, "Список пар изменился, пока меню было открыто. Выбери пару заново.", reply_markup=build_main_menu(user_id))
+    return ADMIN_STATE
+
+async def admin_delete_location(update, context, callback):
+    query = update.callback_query
+    user_id = query.from_user.id
+    admin_data = get_admin_data(user_id)
+    location_to_delete = item(callback, admin_data['locations'])
+    if location_to_delete is not None:
+        admin_data['locations'].remove(location_to_delete)
+        if location_to_delete in admin_data['active_locations']:
+            admin_data['active_locations'].remove(location_to_delete)
+        admin_data.get('zones', {}).pop(location_to_delete, None)
+        save_admin_data(user_id, admin_data)
+        await edit_message(query, f"Локация '{location_to_delete}' удалена!", reply_markup=build_main_menu(user_id))
+    else:
+        await edit_message(query, "Список локаций изменился, пока меню было открыто. Выбери локацию заново.", reply_markup=build_main_menu(user_id))
+    return ADMIN_STATE
+
+async def admin_remove_pair(update, context, callback):
+    query = update.callback_query
+    user_id = query.from_user.id
+    admin_data = get_admin_data(user_id)
+    if not admin_data['pairs']:
+        await edit_message(query, "Нет пар для удаления!", reply_markup=build_main_menu(user_id))
         return ADMIN_STATE
+    text, reply_markup = render_menu(user_id, menu_state(context, 'delete_pairs', reset=True))
+    await edit_message(query, text, reply_markup=reply_markup, parse_mode='Markdown')
+    return EDIT_PAIRS
 
-    elif choice.startswith('delete_location_'):
-        admin_data = get_admin_data(admin_id)
-        location_to_delete = choice.replace('delete_location_', '')
-        if location_to_delete in admin_data['locations']:
-            admin_data['locations'].remove(location_to_delete)
-            if location_to_delete in admin_data['active_locations']:
-                admin_data['active_locations'].remove(location_to_delete)
-            save_admin_data(admin_id, admin_data)
-            try:
-                await query.edit_message_text(f"Локация '{location_to_delete}' удалена!", reply_markup=build_main_menu(user_id))
-            except BadRequest as e:
-                if "Message is not modified" in str(e):
-                    logger.info(f"Сообщение не изменилось для user_id={query.from_user.id}, choice={choice}")
-                else:
-                    logger.error(f"Ошибка при редактировании сообщения для user_id={query.from_user.id}: {str(e)}")
-                    await query.message.reply_text(f"Локация '{location_to_delete}' удалена!", reply_markup=build_main_menu(user_id))
-        else:
-            try:
-                await query.edit_message_text("Локация не найдена!", reply_markup=build_main_menu(user_id))
-            except BadRequest as e:
-                if "Message is not modified" in str(e):
-                    logger.info(f"Сообщение не изменилось для user_id={query.from_user.id}, choice={choice}")
-                else:
-                    logger.error(f"Ошибка при редактировании сообщения для user_id={query.from_user.id}: {str(e)}")
-                    await query.message.reply_text("Локация не найдена!", reply_markup=build_main_menu(user_id))
+async def admin_remove_location(update, context, callback):
+    query = update.callback_query
+    user_id = query.from_user.id
+    admin_data = get_admin_data(user_id)
+    if not admin_data['locations']:
+        await edit_message(query, "Нет локаций для удаления!", reply_markup=build_main_menu(user_id))
         return ADMIN_STATE
+    text, reply_markup = render_menu(user_id, menu_state(context, 'delete_locations', reset=True))
+    await edit_message(query, text, reply_markup=reply_markup, parse_mode='Markdown')
+    return EDIT_LOCATIONS
 
-    elif choice == 'remove_pair':
-        admin_data = get_admin_data(admin_id)
-        if not admin_data['pairs']:
-            try:
-                await query.edit_message_text("Нет пар для удаления!", reply_markup=build_main_menu(user_id))
-            except BadRequest as e:
-                if "Message is not modified" in str(e):
-                    logger.info(f"Сообщение не изменилось для user_id={query.from_user.id}, choice={choice}")
-                else:
-                    logger.error(f"Ошибка при редактировании сообщения для user_id={query.from_user.id}: {str(e)}")
-                    await query.message.reply_text("Нет пар для удаления!", reply_markup=build_main_menu(user_id))
-            return ADMIN_STATE
-        keyboard = [
-            [InlineKeyboardButton(pair, callback_data=f'delete_pair_{pair}') for pair in admin_data['pairs'][i:i+2]]
-            for i in range(0, len(admin_data['pairs']), 2)
-        ]
-        keyboard.append([InlineKeyboardButton("Назад ⬅️", callback_data='back_to_main')])
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        try:
-            await query.edit_message_text("Выбери пару для удаления:", reply_markup=reply_markup, parse_mode='Markdown')
-        except BadRequest as e:
-            if "Message is not modified" in str(e):
-                logger.info(f"Сообщение не изменилось для user_id={query.from_user.id}, choice={choice}")
-            else:
-                logger.error(f"Ошибка при редактировании сообщения для user_id={query.from_user.id}: {str(e)}")
-                await query.message.reply_text("Выбери пару для удаления:", reply_markup=reply_markup, parse_mode='Markdown')
-        return EDIT_PAIRS
+async def admin_page(update, context, callback):
+    query = update.callback_query
+    kind = PAGE_ACTIONS[callback.action]
+    state = menu_state(context, kind)
+    state['offset'] = callback.index
+    text, reply_markup = render_menu(query.from_user.id, state)
+    await edit_message(query, text, reply_markup=reply_markup, parse_mode='Markdown')
+    return MENUS[kind][4]
+
+async def admin_clear_filter(update, context, callback):
+    query = update.callback_query
+    state = context.user_data.get('admin_menu')
+    if not state:
+        return await admin_back_to_main(update, context, callback)
+    state['prefix'] = ''
+    state['offset'] = 0
+    text, reply_markup = render_menu(query.from_user.id, state)
+    await edit_message(query, text, reply_markup=reply_markup, parse_mode='Markdown')
+    return MENUS[state['kind']][4]
+
+async def admin_noop(update, context, callback):
+    # Кнопка с номером страницы: callback уже отвечен, состояние диалога не меняется
+    return None
 
-    elif choice == 'remove_location':
-        admin_data = get_admin_data(admin_id)
-        if not admin_data['locations']:
-            try:
-                await query.edit_message_text("Нет локаций для удаления!", reply_markup=build_main_menu(user_id))
-            except BadRequest as e:
-                if "Message is not modified" in str(e):
-                    logger.info(f"Сообщение не изменилось для user_id={query.from_user.id}, choice={choice}")
-                else:
-                    logger.error(f"Ошибка при редактировании сообщения для user_id={query.from_user.id}: {str(e)}")
-                    await query.message.reply_text("Нет локаций для удаления!", reply_markup=build_main_menu(user_id))
-            return ADMIN_STATE
-        keyboard = [
-            [InlineKeyboardButton(loc, callback_data=f'delete_location_{loc}') for loc in admin_data['locations'][i:i+2]]
-            for i in range(0, len(admin_data['locations']), 2)
-        ]
-        keyboard.append([InlineKeyboardButton("Назад ⬅️", callback_data='back_to_main')])
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        try:
-            await query.edit_message_text("Выбери локацию для удаления:", reply_markup=reply_markup, parse_mode='Markdown')
-        except BadRequest as e:
-            if "Message is not modified" in str(e):
-                logger.info(f"Сообщение не изменилось для user_id={query.from_user.id}, choice={choice}")
-            else:
-                logger.error(f"Ошибка при редактировании сообщения для user_id={query.from_user.id}: {str(e)}")
-                await query.message.reply_text("Выбери локацию для удаления:", reply_markup=reply_markup, parse_mode='Markdown')
-        return EDIT_LOCATIONS
+async def admin_callback(update, context):
+    query = update.callback_query
+    if not query:
+        logger.error("Нет callback_query в update!")
+        await update.message.reply_text("Ошибка обработки команды. Попробуй снова.")
+        return ConversationHandler.END
 
-    logger.warning(f"Неизвестный choice: {choice}")
-    return ADMIN_STATE
+    try:
+        await query.answer()
+        logger.info(f"Callback обработан: user_id={query.from_user.id}, choice={query.data}")
+    except Exception as e:
+        logger.error(f"Ошибка при ответе на callback для user_id={query.from_user.id}: {str(e)}")
+        return ConversationHandler.END
+
+    callback = decode(query.data)
+    choice = callback.action if callback else query.data
+    user_id = query.from_user.id
+    active_order, request_count, referrer_id, in_admin_mode = get_user_data(user_id)
+    logger.info(f"Состояние: user_id={user_id}, in_admin_mode={in_admin_mode}, choice={choice}")
+
+    # Проверка: если не в админке и не пытаемся войти, блокируем действия админки
+    if choice != 'enter_admin' and not in_admin_mode:
+        await query.message.reply_text("Сначала войди в админку через 'Войти в админку'!")
+        return ConversationHandler.END
+
+    handler = ADMIN_ACTIONS.get(choice)
+    if handler is None:
+        logger.warning(f"Неизвестный choice: {choice}")
+        return ADMIN_STATE
+    return await handler(update, context, callback)
+
+# Действие кнопки → обработчик; номера действий и формат callback_data — в ex_callbacks
+ADMIN_ACTIONS = {
+    'enter_admin': admin_enter_admin,
+    'exit': admin_exit,
+    'manage_location': admin_manage_location,
+    'manage_pair': admin_manage_pair,
+    'add_location': admin_add_location,
+    'add_pair': admin_add_pair,
+    'edit_rates': admin_edit_rates,
+    'edit_pairs': admin_edit_pairs,
+    'edit_locations': admin_edit_locations,
+    'set_rate': admin_set_rate,
+    'generate_otp': admin_generate_otp,
+    'generate_otp_7': admin_issue_otp,
+    'generate_otp_30': admin_issue_otp,
+    'check_subscription': admin_check_subscription,
+    'generate_ref_link': admin_generate_ref_link,
+    'broadcast': admin_broadcast,
+    'bulk_edit': admin_bulk_edit,
+    'reload_config': admin_reload_config,
+    'back_to_main': admin_back_to_main,
+    'delete_pair': admin_delete_pair,
+    'delete_location': admin_delete_location,
+    'remove_pair': admin_remove_pair,
+    'remove_location': admin_remove_location,
+    'page_pairs': admin_page,
+    'page_locations': admin_page,
+    'page_delete_pairs': admin_page,
+    'page_delete_locations': admin_page,
+    'clear_filter': admin_clear_filter,
+    'noop': admin_noop,
+}
 
 async def edit_rates_handler(update, context, admin_id):
     query = update.callback_query
@@ -586,9 +600,10 @@ async def edit_rates_handler(update, context, admin_id):
     try:
         admin_data = get_admin_data(admin_id)
         logger.info(f"admin_data['rates'] для user_id={admin_id}: {admin_data['rates']}")
-        rates_text = "\n".join([f"*{k}*: {v:.2f}" for k, v in admin_data['rates'].items()])
+        rates_text = format_rates_text(admin_data)
         reply_markup = build_rates_menu(admin_id)
-        await query.message.reply_text(
+        await reply_message(
+            query.message,
             f"📊 *Текущие курсы:*\n{rates_text}\nВыбери пару для редактирования:",
             reply_markup=reply_markup,
             parse_mode='Markdown'
@@ -598,7 +613,8 @@ async def edit_rates_handler(update, context, admin_id):
     except Exception as e:
         logger.error(f"Ошибка в edit_rates_handler для user_id={admin_id}: {str(e)}")
         try:
-            await query.message.reply_text(
+            await reply_message(
+                query.message,
                 "Произошла ошибка при загрузке курсов. Попробуй снова.",
                 reply_markup=build_main_menu(admin_id)
             )
@@ -609,20 +625,21 @@ async def edit_rates_handler(update, context, admin_id):
 async def rates_callback(update, context):
     query = update.callback_query
     await query.answer()
-    choice = query.data
+    callback = decode(query.data)
+    choice = callback.action if callback else query.data
     admin_id = query.from_user.id
     logger.info(f"rates_callback: choice={choice}, user_id={admin_id}")
 
-    if choice.startswith('set_rate_'):
-        rate_key = choice.replace('set_rate_', '')
-        logger.info(f"Выбрана пара для редактирования: {rate_key}")
+    if choice == 'pick_rate':
         admin_data = get_admin_data(admin_id)
-        logger.info(f"Доступные пары в rates: {list(admin_data['rates'].keys())}")
-        if rate_key not in admin_data['rates']:
-            logger.error(f"Пара {rate_key} не найдена в rates!")
+        rate_key = item(callback, admin_data['rates'])
+        logger.info(f"Выбрана пара для редактирования: {rate_key}")
+        if rate_key is None:
+            logger.info(f"Меню курсов устарело для user_id={admin_id}: отпечаток {callback.version}, текущий {list_version(admin_data['rates'])}")
             try:
-                await query.message.reply_text(
-                    f"Ошибка: пара *{rate_key}* не найдена. Попробуй снова.",
+                await reply_message(
+                    query.message,
+                    "Список курсов изменился, пока меню было открыто. Выбери пару заново.",
                     reply_markup=build_rates_menu(admin_id),
                     parse_mode='Markdown'
                 )
@@ -634,7 +651,9 @@ async def rates_callback(update, context):
             logger.info(f"Сохранён editing_rate: {context.user_data['editing_rate']}")
             try:
                 await query.message.reply_text(
-                    f"Введи новый курс для пары *{rate_key}* (например, 0.85):",
+                    f"Введи новый курс для пары *{rate_key}* (например, 0.85).\n"
+                    "Для объёмных скидок — все уровни одним сообщением, по строке «порог курс [комиссия]»:\n"
+                    "`0 0.85`\n`100000 0.87`\n`1000000 0.88 500`",
                     parse_mode='Markdown'
                 )
                 logger.info(f"Сообщение о вводе курса отправлено для {rate_key}")
@@ -644,7 +663,8 @@ async def rates_callback(update, context):
         except Exception as e:
             logger.error(f"Ошибка при выборе пары {rate_key}: {str(e)}")
             try:
-                await query.message.reply_text(
+                await reply_message(
+                    query.message,
                     "Произошла ошибка при выборе пары. Попробуй снова.",
                     reply_markup=build_main_menu(admin_id)
                 )
@@ -656,7 +676,7 @@ async def rates_callback(update, context):
         try:
             await query.message.reply_text("✅ Курсы сохранены!")
             reply_markup = build_main_menu(admin_id)
-            await query.message.reply_text("Админ-панель: выбери раздел", reply_markup=reply_markup, parse_mode='Markdown')
+            await reply_message(query.message, "Админ-панель: выбери раздел", reply_markup=reply_markup, parse_mode='Markdown')
         except Exception as e:
             logger.error(f"Ошибка при сохранении курсов: {str(e)}")
         return ADMIN_STATE
@@ -664,7 +684,7 @@ async def rates_callback(update, context):
         logger.info("Возврат в главное меню")
         try:
             reply_markup = build_main_menu(admin_id)
-            await query.message.reply_text("Админ-панель: выбери раздел", reply_markup=reply_markup, parse_mode='Markdown')
+            await reply_message(query.message, "Админ-панель: выбери раздел", reply_markup=reply_markup, parse_mode='Markdown')
         except Exception as e:
             logger.error(f"Ошибка при возврате в главное меню: {str(e)}")
         return ADMIN_STATE
@@ -681,7 +701,17 @@ async def set_rate(update, context):
     try:
         new_rate_input = update.message.text.strip()
         logger.info(f"Получен ввод: '{new_rate_input}'")
-        new_rate = float(new_rate_input)
+        tiers = None
+        if len(new_rate_input.split()) > 1:
+            # Несколько уровней одним сообщением
+            try:
+                tiers = parse_tiers(new_rate_input)
+            except ValueError as e:
+                await update.message.reply_text(f"Ошибка в уровнях: {str(e)}. Попробуйте ещё раз.")
+                return SET_RATE
+            new_rate = float(tiers['r'][0])
+        else:
+            new_rate = float(new_rate_input)
         if new_rate <= 0:
             logger.info("Введён некорректный курс (<= 0)")
             await update.message.reply_text("Курс должен быть больше 0! Попробуйте ещё раз.")
@@ -690,11 +720,17 @@ async def set_rate(update, context):
         rate_key = context.user_data.get('editing_rate')
         if rate_key:
             admin_data['rates'][rate_key] = new_rate
+            admin_data.setdefault('tiers', {})
+            if tiers:
+                admin_data['tiers'][rate_key] = tiers
+            else:
+                admin_data['tiers'].pop(rate_key, None)
             save_admin_data(admin_id, admin_data)
             logger.info(f"Курс для '{rate_key}' обновлён: {new_rate}")
-            rates_text = "\n".join([f"*{k}*: {v:.2f}" for k, v in admin_data['rates'].items()])
+            rates_text = format_rates_text(admin_data)
             reply_markup = build_rates_menu(admin_id)
-            await update.message.reply_text(
+            await reply_message(
+                update.message,
                 f"✅ Курс для *{rate_key}* обновлён!\n📊 *Текущие курсы:*\n{rates_text}\nВыбери пару для редактирования:",
                 reply_markup=reply_markup,
                 parse_mode='Markdown'
@@ -703,21 +739,24 @@ async def set_rate(update, context):
             return EDIT_RATES
         else:
             logger.error("Не выбрана пара для редактирования")
-            await update.message.reply_text(
+            await reply_message(
+                update.message,
                 "Ошибка: не выбрана пара для редактирования. Попробуйте снова.",
                 reply_markup=build_rates_menu(admin_id)
             )
             return EDIT_RATES
     except ValueError:
         logger.info("Введено некорректное значение курса")
-        await update.message.reply_text(
+        await reply_message(
+            update.message,
             "Пожалуйста, введите число (например, 0.85)! Попробуйте ещё раз.",
             reply_markup=build_rates_menu(admin_id)
         )
         return SET_RATE
     except Exception as e:
         logger.error(f"Ошибка в set_rate: {str(e)}")
-        await update.message.reply_text(
+        await reply_message(
+            update.message,
             "Произошла ошибка при установке курса. Попробуйте снова.",
             reply_markup=build_main_menu(user_id)
         )
@@ -726,169 +765,105 @@ async def set_rate(update, context):
 async def edit_pairs_handler(update, context, admin_id):
     query = update.callback_query
     await query.answer()
-    admin_data = get_admin_data(admin_id)
-    active_pairs = [str(pair) for pair in admin_data['active_pairs']]
-    pairs_text = ", ".join(active_pairs) if active_pairs else "Пока не выбрано"
-    reply_markup = build_pairs_menu(admin_id)
-    await query.message.reply_text(
-        f"💱 Активные пары: {pairs_text}\nВыбери или обнови:",
-        reply_markup=reply_markup,
-        parse_mode='Markdown'
-    )
+    text, reply_markup = render_menu(admin_id, menu_state(context, 'pairs', reset=True))
+    await reply_message(query.message, text, reply_markup=reply_markup, parse_mode='Markdown')
     return EDIT_PAIRS
 
 async def pairs_callback(update, context):
     query = update.callback_query
     await query.answer()
-    choice = query.data
+    callback = decode(query.data)
+    choice = callback.action if callback else query.data
     admin_id = query.from_user.id
     admin_data = get_admin_data(admin_id)
 
     if choice == 'reset_pairs':
         admin_data['active_pairs'] = []
         save_admin_data(admin_id, admin_data)
-        active_pairs = [str(pair) for pair in admin_data['active_pairs']]
-        pairs_text = "Пока не выбрано"
-        reply_markup = build_pairs_menu(admin_id)
-        try:
-            await query.message.edit_text(
-                f"💱 Активные пары: {pairs_text}\nВыбери или обнови:",
-                reply_markup=reply_markup,
-                parse_mode='Markdown'
-            )
-        except BadRequest as e:
-            if "Message is not modified" in str(e):
-                logger.info(f"Сообщение не изменилось для user_id={query.from_user.id}, choice={choice}")
-            else:
-                logger.error(f"Ошибка при редактировании сообщения для user_id={query.from_user.id}: {str(e)}")
-                await query.message.reply_text(
-                    f"💱 Активные пары: {pairs_text}\nВыбери или обнови:",
-                    reply_markup=reply_markup,
-                    parse_mode='Markdown'
-                )
+        text, reply_markup = render_menu(admin_id, menu_state(context, 'pairs'))
+        await edit_message(query, text, reply_markup=reply_markup, parse_mode='Markdown')
         return EDIT_PAIRS
-    elif choice.startswith('toggle_pair_'):
-        pair = choice.replace('toggle_pair_', '')
-        if pair in admin_data['active_pairs']:
-            admin_data['active_pairs'].remove(pair)
-        else:
-            admin_data['active_pairs'].append(pair)
-        save_admin_data(admin_id, admin_data)
-        active_pairs = [str(pair) for pair in admin_data['active_pairs']]
-        pairs_text = ", ".join(active_pairs) if active_pairs else "Пока не выбрано"
-        reply_markup = build_pairs_menu(admin_id)
-        try:
-            await query.message.edit_text(
-                f"💱 Активные пары: {pairs_text}\nВыбери или обнови:",
-                reply_markup=reply_markup,
-                parse_mode='Markdown'
-            )
-        except BadRequest as e:
-            if "Message is not modified" in str(e):
-                logger.info(f"Сообщение не изменилось для user_id={query.from_user.id}, choice={choice}")
+    elif choice == 'toggle_pair':
+        pair = item(callback, admin_data['pairs'])
+        # Устаревшее меню ничего не переключает, а просто перерисовывается по текущему профилю
+        if pair is not None:
+            if pair in admin_data['active_pairs']:
+                admin_data['active_pairs'].remove(pair)
             else:
-                logger.error(f"Ошибка при редактировании сообщения для user_id={query.from_user.id}: {str(e)}")
-                await query.message.reply_text(
-                    f"💱 Активные пары: {pairs_text}\nВыбери или обнови:",
-                    reply_markup=reply_markup,
-                    parse_mode='Markdown'
-                )
+                admin_data['active_pairs'].append(pair)
+            save_admin_data(admin_id, admin_data)
+        note = "\n(список пар изменился — меню обновлено)" if pair is None else ""
+        # Перерисовывается только открытая страница с тем же фильтром
+        text, reply_markup = render_menu(admin_id, menu_state(context, 'pairs'), note)
+        await edit_message(query, text, reply_markup=reply_markup, parse_mode='Markdown')
         return EDIT_PAIRS
     elif choice == 'save_pairs':
-        active_pairs = [str(pair) for pair in admin_data['active_pairs']]
-        await query.message.reply_text(f"✅ Пары сохранены: {', '.join(active_pairs) if active_pairs else 'Пока не выбрано'}")
+        await query.message.reply_text(f"✅ Пары сохранены: {selection_text(admin_data['active_pairs'])}")
         reply_markup = build_main_menu(query.from_user.id)
-        await query.message.reply_text("Админ-панель: выбери раздел", reply_markup=reply_markup, parse_mode='Markdown')
+        await reply_message(query.message, "Админ-панель: выбери раздел", reply_markup=reply_markup, parse_mode='Markdown')
         return ADMIN_STATE
     elif choice == 'back_to_main':
         reply_markup = build_main_menu(query.from_user.id)
-        await query.message.reply_text("Админ-панель: выбери раздел", reply_markup=reply_markup, parse_mode='Markdown')
+        await reply_message(query.message, "Админ-панель: выбери раздел", reply_markup=reply_markup, parse_mode='Markdown')
         return ADMIN_STATE
     return EDIT_PAIRS
 
 async def edit_locations_handler(update, context, admin_id):
     query = update.callback_query
     await query.answer()
-    admin_data = get_admin_data(admin_id)
-    active_locations = [str(loc) for loc in admin_data['active_locations']]
-    locations_text = ", ".join(active_locations) if active_locations else "Пока не выбрано"
-    reply_markup = build_locations_menu(admin_id)
-    await query.message.reply_text(
-        f"🌍 Активные локации: {locations_text}\nВыбери или обнови:",
-        reply_markup=reply_markup,
-        parse_mode='Markdown'
-    )
+    text, reply_markup = render_menu(admin_id, menu_state(context, 'locations', reset=True))
+    await reply_message(query.message, text, reply_markup=reply_markup, parse_mode='Markdown')
     return EDIT_LOCATIONS
 
 async def locations_callback(update, context):
     query = update.callback_query
     await query.answer()
-    choice = query.data
+    callback = decode(query.data)
+    choice = callback.action if callback else query.data
     admin_id = query.from_user.id
     admin_data = get_admin_data(admin_id)
 
     if choice == 'reset_locations':
         admin_data['active_locations'] = []
         save_admin_data(admin_id, admin_data)
-        active_locations = [str(loc) for loc in admin_data['active_locations']]
-        locations_text = "Пока не выбрано"
-        reply_markup = build_locations_menu(admin_id)
-        try:
-            await query.message.edit_text(
-                f"🌍 Активные локации: {locations_text}\nВыбери или обнови:",
-                reply_markup=reply_markup,
-                parse_mode='Markdown'
-            )
-        except BadRequest as e:
-            if "Message is not modified" in str(e):
-                logger.info(f"Сообщение не изменилось для user_id={query.from_user.id}, choice={choice}")
-            else:
-                logger.error(f"Ошибка при редактировании сообщения для user_id={query.from_user.id}: {str(e)}")
-                await query.message.reply_text(
-                    f"🌍 Активные локации: {locations_text}\nВыбери или обнови:",
-                    reply_markup=reply_markup,
-                    parse_mode='Markdown'
-                )
+        text, reply_markup = render_menu(admin_id, menu_state(context, 'locations'))
+        await edit_message(query, text, reply_markup=reply_markup, parse_mode='Markdown')
         return EDIT_LOCATIONS
-    elif choice.startswith('toggle_loc_'):
-        location = choice.replace('toggle_loc_', '')
-        if location in admin_data['active_locations']:
-            admin_data['active_locations'].remove(location)
-        else:
-            admin_data['active_locations'].append(location)
-        save_admin_data(admin_id, admin_data)
-        active_locations = [str(loc) for loc in admin_data['active_locations']]
-        locations_text = ", ".join(active_locations) if active_locations else "Пока не выбрано"
-        reply_markup = build_locations_menu(admin_id)
-        try:
-            await query.message.edit_text(
-                f"🌍 Активные локации: {locations_text}\nВыбери или обнови:",
-                reply_markup=reply_markup,
-                parse_mode='Markdown'
-            )
-        except BadRequest as e:
-            if "Message is not modified" in str(e):
-                logger.info(f"Сообщение не изменилось для user_id={query.from_user.id}, choice={choice}")
+    elif choice == 'toggle_loc':
+        location = item(callback, admin_data['locations'])
+        if location is not None:
+            if location in admin_data['active_locations']:
+                admin_data['active_locations'].remove(location)
             else:
-                logger.error(f"Ошибка при редактировании сообщения для user_id={query.from_user.id}: {str(e)}")
-                await query.message.reply_text(
-                    f"🌍 Активные локации: {locations_text}\nВыбери или обнови:",
-                    reply_markup=reply_markup,
-                    parse_mode='Markdown'
-                )
+                admin_data['active_locations'].append(location)
+            save_admin_data(admin_id, admin_data)
+        note = "\n(список локаций изменился — меню обновлено)" if location is None else ""
+        text, reply_markup = render_menu(admin_id, menu_state(context, 'locations'), note)
+        await edit_message(query, text, reply_markup=reply_markup, parse_mode='Markdown')
         return EDIT_LOCATIONS
     elif choice == 'save_locations':
-        active_locations = [str(loc) for loc in admin_data['active_locations']]
-        await query.message.reply_text(f"✅ Локации сохранены: {', '.join(active_locations)}")
+        await query.message.reply_text(f"✅ Локации сохранены: {selection_text(admin_data['active_locations'])}")
         reply_markup = build_main_menu(query.from_user.id)
-        await query.message.reply_text("Админ-панель: выбери раздел", reply_markup=reply_markup, parse_mode='Markdown')
+        await reply_message(query.message, "Админ-панель: выбери раздел", reply_markup=reply_markup, parse_mode='Markdown')
         return ADMIN_STATE
     elif choice == 'back_to_main':
         reply_markup = build_main_menu(query.from_user.id)
-        await query.message.reply_text("Админ-панель: выбери раздел", reply_markup=reply_markup, parse_mode='Markdown')
+        await reply_message(query.message, "Админ-панель: выбери раздел", reply_markup=reply_markup, parse_mode='Markdown')
         return ADMIN_STATE
     return EDIT_LOCATIONS
 
+async def menu_search(update, context):
+    """Текст в меню пар или локаций — фильтр по началу названия."""
+    state = context.user_data.get('admin_menu')
+    if not state:
+        await update.message.reply_text("Открой список заново из админ-панели.", reply_markup=build_main_menu(update.message.from_user.id))
+        return ADMIN_STATE
+    state['prefix'] = update.message.text.strip()[:MAX_PREFIX]
+    state['offset'] = 0
+    text, reply_markup = render_menu(update.message.from_user.id, state)
+    await reply_message(update.message, text, reply_markup=reply_markup, parse_mode='Markdown')
+    return MENUS[state['kind']][4]
+
 async def broadcast_message(update, context):
     user_id = update.message.from_user.id  # ID админа
     message_text = update.message.text.strip()
@@ -897,14 +872,14 @@ async def broadcast_message(update, context):
         await update.message.reply_text("Текст рассылки не может быть пустым! Введи сообщение ещё раз:")
         return BROADCAST
 
-    conn = sqlite3.connect('database.db')
+    conn = get_connection()
     c = conn.cursor()
     c.execute('SELECT user_id FROM users WHERE referrer_id = ?', (user_id,))
     clients = c.fetchall()
     conn.close()
 
     if not clients:
-        await update.message.reply_text("У тебя пока нет клиентов для рассылки.", reply_markup=build_main_menu(user_id))
+        await reply_message(update.message, "У тебя пока нет клиентов для рассылки.", reply_markup=build_main_menu(user_id))
         return ADMIN_STATE
 
     sent_count = 0
@@ -916,16 +891,87 @@ async def broadcast_message(update, context):
         except Exception as e:
             logger.error(f"Не удалось отправить сообщение клиенту {client_id}: {str(e)}")
 
-    await update.message.reply_text(
+    await reply_message(
+        update.message,
         f"Рассылка завершена! Сообщение отправлено {sent_count} клиентам.",
         reply_markup=build_main_menu(user_id)
     )
     return ADMIN_STATE
 
-def get_admin_handler(cancel_func):
+MAX_DIFF_LINES = 50
+
+async def bulk_edit_input(update, context):
+    user_id = update.message.from_user.id
+    admin_id = user_id  # Админ редактирует свои данные
+    document = update.message.document
+    if document:
+        try:
+            file = await document.get_file()
+            payload = await file.download_as_bytearray()
+        except Exception as e:
+            logger.error(f"Не удалось скачать файл массовой правки от admin_id={admin_id}: {str(e)}")
+            await update.message.reply_text("Не удалось получить файл. Попробуй ещё раз.")
+            return BULK_EDIT
+        operations, errors = parse_document(document.file_name, payload)
+    else:
+        operations, errors = parse_text(update.message.text)
+
+    admin_data = get_admin_data(admin_id)
+    new_data, diff, apply_errors = apply_operations(admin_data, operations)
+    errors += apply_errors
+    logger.info(f"Массовая правка admin_id={admin_id}: операций {len(operations)}, изменений {len(diff)}, ошибок {len(errors)}")
+    if errors:
+        shown = "\n".join(errors[:MAX_DIFF_LINES])
+        more = f"\n…и ещё {len(errors) - MAX_DIFF_LINES}" if len(errors) > MAX_DIFF_LINES else ""
+        await update.message.reply_text(f"Ничего не сохранено, исправь ошибки и пришли заново:\n{shown}{more}")
+        return BULK_EDIT
+    if not diff:
+        await reply_message(update.message, "Изменений нет — всё уже так.", reply_markup=build_main_menu(user_id))
+        return ADMIN_STATE
+
+    # Черновик и версия, от которой он построен: применится, только если профиль не поменялся
+    context.user_data['bulk_edit'] = {'version': admin_data.get('version'), 'data': new_data}
+    shown = "\n".join(diff[:MAX_DIFF_LINES])
+    more = f"\n…и ещё {len(diff) - MAX_DIFF_LINES}" if len(diff) > MAX_DIFF_LINES else ""
+    keyboard = [[
+        InlineKeyboardButton("Применить ✅", callback_data=encode('bulk_apply')),
+        InlineKeyboardButton("Отмена ❌", callback_data=encode('bulk_cancel'))
+    ]]
+    await reply_message(update.message, f"Изменения ({len(diff)}):\n{shown}{more}", reply_markup=InlineKeyboardMarkup(keyboard))
+    return BULK_EDIT
+
+async def bulk_callback(update, context):
+    query = update.callback_query
+    await query.answer()
+    user_id = query.from_user.id
+    admin_id = user_id
+    cancelled = decode(query.data).action == 'bulk_cancel'
+    draft = context.user_data.pop('bulk_edit', None)
+    if cancelled or not draft:
+        text = "Массовая правка отменена." if cancelled else "Черновик правки не найден, пришли изменения заново."
+        await edit_message(query, text, reply_markup=build_main_menu(user_id))
+        return ADMIN_STATE
+
+    # Одна запись профиля = одна транзакция: применяется всё или ничего
+    if draft['version'] is None:
+        version = save_admin_data(admin_id, draft['data'])
+    else:
+        version = save_admin_data(admin_id, draft['data'], expected_version=draft['version'])
+    if version is None:
+        await edit_message(
+            query,
+            "Профиль изменился, пока ты смотрел правку. Пришли изменения ещё раз.",
+            reply_markup=build_main_menu(user_id)
+        )
+        return ADMIN_STATE
+    logger.info(f"Массовая правка применена для admin_id={admin_id}, версия {version}")
+    await edit_message(query, "Изменения применены ✅", reply_markup=build_main_menu(user_id))
+    return ADMIN_STATE
+
+def get_admin_handler(cancel_func, persistent=False):
     return ConversationHandler(
         entry_points=[
-            CallbackQueryHandler(admin_callback, pattern='^enter_admin$'),
+            CallbackQueryHandler(admin_callback, pattern=pattern('enter_admin')),
             CallbackQueryHandler(admin_callback),  # Добавляем обработку всех callback'ов
         ],
         states={
@@ -939,27 +985,37 @@ def get_admin_handler(cancel_func):
                 MessageHandler(filters.TEXT & ~filters.COMMAND, add_pair)
             ],
             EDIT_RATES: [
-                CallbackQueryHandler(rates_callback, pattern='^(save_rates|back_to_main)')
+                CallbackQueryHandler(rates_callback, pattern=pattern('pick_rate', 'save_rates', 'back_to_main'))
             ],
             SET_RATE: [
                 MessageHandler(filters.TEXT & ~filters.COMMAND, set_rate),
-                CallbackQueryHandler(rates_callback, pattern='^(set_rate_|save_rates|back_to_main)')
+                CallbackQueryHandler(rates_callback, pattern=pattern('pick_rate', 'save_rates', 'back_to_main'))
             ],
             EDIT_PAIRS: [
-                CallbackQueryHandler(pairs_callback, pattern='^(reset_pairs|toggle_pair_|save_pairs|back_to_main)'),
-                CallbackQueryHandler(admin_callback, pattern='^(remove_pair|delete_pair_)')
+                MessageHandler(filters.TEXT & ~filters.COMMAND, menu_search),
+                CallbackQueryHandler(pairs_callback, pattern=pattern('reset_pairs', 'toggle_pair', 'save_pairs', 'back_to_main')),
+                CallbackQueryHandler(admin_callback, pattern=pattern('remove_pair', 'delete_pair', 'page_pairs', 'page_delete_pairs',
+                                                                     'clear_filter', 'noop'))
             ],
             EDIT_LOCATIONS: [
-                CallbackQueryHandler(locations_callback, pattern='^(reset_locations|toggle_loc_|save_locations|back_to_main)'),
-                CallbackQueryHandler(admin_callback, pattern='^(remove_location|delete_location_)')
+                MessageHandler(filters.TEXT & ~filters.COMMAND, menu_search),
+                CallbackQueryHandler(locations_callback, pattern=pattern('reset_locations', 'toggle_loc', 'save_locations', 'back_to_main')),
+                CallbackQueryHandler(admin_callback, pattern=pattern('remove_location', 'delete_location', 'page_locations',
+                                                                     'page_delete_locations', 'clear_filter', 'noop'))
             ],
             GENERATE_OTP: [
-                CallbackQueryHandler(admin_callback, pattern='^(generate_otp_7|generate_otp_30)')
+                CallbackQueryHandler(admin_callback, pattern=pattern('generate_otp_7', 'generate_otp_30'))
             ],
             BROADCAST: [
                 MessageHandler(filters.TEXT & ~filters.COMMAND, broadcast_message)
+            ],
+            BULK_EDIT: [
+                MessageHandler((filters.TEXT & ~filters.COMMAND) | filters.Document.ALL, bulk_edit_input),
+                CallbackQueryHandler(bulk_callback, pattern=pattern('bulk_apply', 'bulk_cancel'))
             ]
         },
         fallbacks=[CommandHandler('cancel', cancel_func)],
-        per_message=False  # Оставляем только этот параметр
+        per_message=False,  # Оставляем только этот параметр
+        name='admin',  # По имени диалог находят ex_sessions и ex_persistence
+        persistent=persistent
     )
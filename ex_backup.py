@@ -0,0 +1,214 @@
+import asyncio
+import gzip
+import logging
+import os
+import shutil
+import sqlite3
+import time
+from datetime import datetime
+
+import utils
+
+logger = logging.getLogger(__name__)
+
+# Настройки по умолчанию; переопределяются секцией "backup" в config.json
+DEFAULTS = {
+    'dir': 'backups',
+    'interval': 6 * 3600,  # 0 — только по команде
+    'keep': 14,
+    'compress': True,
+    'pages': 256,  # страниц за шаг: между шагами писатели не заблокированы
+    'sleep': 0.01,
+}
+SNAPSHOT_PREFIX = 'database-'
+# Если запись в базу всё время перезапускает пошаговое копирование, остаток копируется одним шагом
+MAX_RESTARTS = 3
+
+
+class _Restarted(Exception):
+    pass
+
+
+last_run = {}
+_lock = asyncio.Lock()
+
+
+def backup_settings():
+    from bot_config import bot_config
+    return dict(DEFAULTS, **(bot_config.get('backup') or {}))
+
+
+def backup_dir(settings):
+    directory = settings['dir']
+    if not os.path.isabs(directory):
+        directory = os.path.join(os.path.dirname(os.path.abspath(utils.DB_PATH)), directory)
+    os.makedirs(directory, exist_ok=True)
+    return directory
+
+
+def list_snapshots(directory):
+    names = [name for name in os.listdir(directory)
+             if name.startswith(SNAPSHOT_PREFIX) and (name.endswith('.db') or name.endswith('.db.gz'))]
+    return sorted(names)  # в имени метка времени, лексикографический порядок = хронологический
+
+
+def rotate(directory, keep):
+    removed = []
+    snapshots = list_snapshots(directory)
+    for name in snapshots[:max(0, len(snapshots) - keep)]:
+        os.remove(os.path.join(directory, name))
+        removed.append(name)
+    return removed
+
+
+def make_snapshot(settings=None):
+    """Снимок базы через online backup API SQLite, проверка целостности, сжатие и ротация.
+
+    Копирование идёт шагами по settings['pages'] страниц: между шагами бот пишет
+    в базу как обычно, но запись из другого соединения заставляет SQLite начать
+    копирование заново. После MAX_RESTARTS перезапусков снимок берётся одним шагом —
+    писатели ждут только время самого копирования.
+    """
+    settings = settings or backup_settings()
+    directory = backup_dir(settings)
+    started = time.perf_counter()
+    name = f"{SNAPSHOT_PREFIX}{datetime.now().strftime('%Y%m%d-%H%M%S')}.db"
+    partial = os.path.join(directory, name + '.part')
+    steps, restarts, last_remaining = 0, 0, None
+
+    def progress(status, remaining, total):
+        nonlocal steps, restarts, last_remaining
+        steps += 1
+        if last_remaining is not None and remaining > last_remaining:
+            restarts += 1
+            if restarts > MAX_RESTARTS:
+                raise _Restarted()
+        last_remaining = remaining
+
+    source = utils.get_connection()
+    target = sqlite3.connect(partial)
+    try:
+        try:
+            source.backup(target, pages=int(settings['pages']), progress=progress, sleep=float(settings['sleep']))
+        except _Restarted:
+            logger.info(f"Пошаговое копирование перезапускалось {restarts} раз, копируем остаток одним шагом")
+            source.backup(target, pages=-1)
+            steps += 1
+        integrity = target.execute('PRAGMA integrity_check').fetchone()[0]
+        page_count = target.execute('PRAGMA page_count').fetchone()[0]
+    except Exception:
+        target.close()
+        os.remove(partial)
+        raise
+    finally:
+        source.close()
+    target.close()
+    if integrity != 'ok':
+        os.remove(partial)
+        raise RuntimeError(f"снимок не прошёл проверку целостности: {integrity}")
+
+    size = os.path.getsize(partial)
+    path = os.path.join(directory, name)
+    if settings['compress']:
+        path += '.gz'
+        with open(partial, 'rb') as raw, gzip.open(path + '.part', 'wb') as packed:
+            shutil.copyfileobj(raw, packed, 1024 * 1024)
+        os.remove(partial)
+        os.replace(path + '.part', path)
+    else:
+        os.replace(partial, path)
+    removed = rotate(directory, int(settings['keep']))
+    report = {
+        'file': os.path.basename(path),
+        'size': size,
+        'stored': os.path.getsize(path),
+        'pages': page_count,
+        'steps': steps,
+        'restarts': restarts,
+        'rotated': len(removed),
+        'elapsed_ms': round((time.perf_counter() - started) * 1000, 1),
+        'at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+    }
+    logger.info(f"Резервная копия базы создана: {report}")
+    return report
+
+
+def format_size(size):
+    for unit in ('Б', 'КБ', 'МБ'):
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == 'Б' else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} ГБ"
+
+
+def format_report(report):
+    text = (f"Резервная копия {report['file']}: {format_size(report['size'])}"
+            f" (на диске {format_size(report['stored'])}), {report['pages']} страниц за {report['steps']} шагов, "
+            f"{report['elapsed_ms']} мс, целостность ok")
+    if report['restarts']:
+        text += f", перезапусков из-за записи: {report['restarts']}"
+    if report['rotated']:
+        text += f", удалено старых: {report['rotated']}"
+    return text
+
+
+async def run_backup():
+    # Одновременно идёт не больше одного снимка — по расписанию или по команде
+    async with _lock:
+        report = await asyncio.to_thread(make_snapshot)
+    last_run.clear()
+    last_run.update(report)
+    return report
+
+
+async def run_backups(application):
+    from bot_config import bot_config
+    interval = int(backup_settings()['interval'])
+    if interval <= 0:
+        return
+    logger.info(f"Фоновая задача резервного копирования запущена, интервал {interval} с")
+    while not application.stop_event.is_set():
+        for _ in range(interval):
+            if application.stop_event.is_set():
+                break
+            await asyncio.sleep(1)
+        if application.stop_event.is_set():
+            break
+        try:
+            await run_backup()
+        except Exception as e:
+            logger.error(f"Ошибка резервного копирования: {str(e)}")
+            try:
+                await application.bot.send_message(chat_id=bot_config["owner_id"], text=f"Резервная копия не создана: {str(e)}")
+            except Exception as send_error:
+                logger.error(f"Не удалось сообщить владельцу об ошибке копирования: {str(send_error)}")
+    logger.info("Фоновая задача резервного копирования завершена")
+
+
+async def backup_command(update, context):
+    from bot_config import bot_config
+    user_id = update.message.from_user.id
+    if str(user_id) != bot_config["owner_id"]:
+        await update.message.reply_text("Эта команда только для владельца!")
+        return
+    args = context.args or []
+    if args == ['list']:
+        directory = backup_dir(backup_settings())
+        snapshots = list_snapshots(directory)
+        lines = [f"{name} — {format_size(os.path.getsize(os.path.join(directory, name)))}" for name in snapshots]
+        await update.message.reply_text("\n".join(lines) if lines else "Резервных копий пока нет.")
+        return
+    if args:
+        await update.message.reply_text("Используйте: /backup — снять копию сейчас, /backup list — список копий")
+        return
+    if _lock.locked():
+        await update.message.reply_text("Копирование уже идёт, дождись результата.")
+        return
+    await update.message.reply_text("Снимаю резервную копию…")
+    try:
+        report = await run_backup()
+    except Exception as e:
+        logger.error(f"Ошибка резервного копирования по команде: {str(e)}")
+        await update.message.reply_text(f"Резервная копия не создана: {str(e)}")
+        return
+    await update.message.reply_text(format_report(report))
@@ -0,0 +1,227 @@
+import copy
+import csv
+import io
+import json
+import logging
+
+from ex_quotes import PAIR_SEPARATOR, parse_tiers, to_decimal
+
+logger = logging.getLogger(__name__)
+
+MAX_OPERATIONS = 2000
+MAX_DOCUMENT_SIZE = 1024 * 1024
+
+KINDS = {
+    'pair': 'pair', 'пара': 'pair',
+    'rate': 'rate', 'курс': 'rate',
+    'location': 'location', 'локация': 'location',
+}
+
+BULK_HELP = (
+    "Пришли изменения одним сообщением (по строке на изменение) или файлом CSV/JSON:\n"
+    "`курс USDT → Рупии (нал) = 91`\n"
+    "`курс Рубли (безнал) → Рупии (нал) = 0 0.85; 100000 0.9`\n"
+    "`пара Рубли → Доллары = 0.011`\n"
+    "`-пара Рупии (нал) → USDT`\n"
+    "`локация Гоа`\n"
+    "`-локация Керим`\n"
+    "Строка вида `A → B = курс` добавляет пару или меняет её курс.\n"
+    "CSV: столбцы `тип,название,значение`; JSON: `{\"rates\": {...}, \"pairs\": [...], "
+    "\"locations\": [...], \"remove_pairs\": [...], \"remove_locations\": [...]}`"
+)
+
+
+def normalize_pair(label):
+    return ' '.join(label.replace('->', PAIR_SEPARATOR).split())
+
+
+def parse_rate_value(value):
+    """Курс: одно число или уровни «порог курс [комиссия]» через «;»."""
+    value = str(value).strip()
+    if ' ' in value or ';' in value or '\n' in value:
+        tiers = parse_tiers(value.replace(';', '\n'))
+        return float(tiers['r'][0]), tiers
+    rate = to_decimal(value)
+    if rate <= 0:
+        raise ValueError("курс должен быть больше 0")
+    return float(rate), None
+
+
+def _operation(remove, kind, name, value, source):
+    kind = KINDS.get(kind.lower())
+    if kind is None:
+        raise ValueError("неизвестный тип, нужно пара/курс/локация")
+    name = normalize_pair(name) if kind in ('pair', 'rate') else name.strip()
+    if not name:
+        raise ValueError("пустое название")
+    if kind in ('pair', 'rate') and PAIR_SEPARATOR not in name:
+        raise ValueError(f"в паре нужен разделитель {PAIR_SEPARATOR} или ->")
+    if remove and kind == 'rate':
+        raise ValueError("курс нельзя удалить, удали пару")
+    rate = tiers = None
+    if not remove and kind in ('pair', 'rate'):
+        if value in (None, '') and kind == 'rate':
+            raise ValueError("не указан курс")
+        if value not in (None, ''):
+            rate, tiers = parse_rate_value(value)
+    return {'op': 'remove' if remove else 'set', 'kind': kind, 'name': name,
+            'rate': rate, 'tiers': tiers, 'source': source}
+
+
+def parse_text(text):
+    """Разбирает строки сообщения за один проход. Возвращает (операции, ошибки)."""
+    operations, errors = [], []
+    for number, raw in enumerate(text.splitlines(), 1):
+        line = raw.strip()
+        if not line or line.startswith('#'):
+            continue
+        source = f"строка {number}"
+        try:
+            remove = line.startswith('-')
+            body = line[1:].strip() if remove else line
+            head, _, rest = body.partition(' ')
+            if head.lower() in KINDS:
+                name, _, value = rest.partition('=')
+                operations.append(_operation(remove, head, name, value.strip() or None, source))
+            elif PAIR_SEPARATOR in body or '->' in body:
+                name, _, value = body.partition('=')
+                operations.append(_operation(remove, 'pair', name, value.strip() or None, source))
+            else:
+                raise ValueError("не понял строку")
+        except ValueError as e:
+            errors.append(f"{source}: {str(e)}")
+    return operations, errors
+
+
+def parse_csv(text):
+    operations, errors = [], []
+    reader = csv.reader(io.StringIO(text))
+    for number, row in enumerate(reader, 1):
+        if not row or not any(cell.strip() for cell in row):
+            continue
+        kind = row[0].strip()
+        if number == 1 and kind.lower() in ('type', 'тип', 'kind'):
+            continue
+        source = f"строка {number}"
+        try:
+            remove = kind.startswith('-')
+            name = row[1] if len(row) > 1 else ''
+            value = row[2].strip() if len(row) > 2 else ''
+            if value == '-':
+                remove, value = True, ''
+            operations.append(_operation(remove, kind.lstrip('-').strip(), name, value or None, source))
+        except ValueError as e:
+            errors.append(f"{source}: {str(e)}")
+    return operations, errors
+
+
+def parse_json(text):
+    operations, errors = [], []
+    try:
+        document = json.loads(text)
+    except json.JSONDecodeError as e:
+        return [], [f"JSON: {str(e)}"]
+    if not isinstance(document, dict):
+        return [], ["JSON: ожидался объект"]
+    sections = (
+        ('pairs', False, 'pair'), ('remove_pairs', True, 'pair'),
+        ('locations', False, 'location'), ('remove_locations', True, 'location'),
+    )
+    for key, remove, kind in sections:
+        for name in document.get(key) or []:
+            try:
+                operations.append(_operation(remove, kind, str(name), None, f"{key}: {name}"))
+            except ValueError as e:
+                errors.append(f"{key}: {name}: {str(e)}")
+    for name, value in (document.get('rates') or {}).items():
+        try:
+            if isinstance(value, list):
+                value = '; '.join(' '.join(str(part) for part in tier) for tier in value)
+            operations.append(_operation(False, 'pair', name, value, f"rates: {name}"))
+        except ValueError as e:
+            errors.append(f"rates: {name}: {str(e)}")
+    return operations, errors
+
+
+def parse_document(file_name, payload):
+    if len(payload) > MAX_DOCUMENT_SIZE:
+        return [], [f"Файл больше {MAX_DOCUMENT_SIZE // 1024} КБ"]
+    try:
+        text = bytes(payload).decode('utf-8-sig')
+    except UnicodeDecodeError:
+        return [], ["Файл должен быть в кодировке UTF-8"]
+    name = (file_name or '').lower()
+    if name.endswith('.json') or text.lstrip().startswith('{'):
+        return parse_json(text)
+    if name.endswith('.csv'):
+        return parse_csv(text)
+    return parse_text(text)
+
+
+def _fmt(value):
+    return f"{value:.4f}".rstrip('0').rstrip('.')
+
+
+def apply_operations(admin_data, operations):
+    """Применяет операции к копии профиля. Возвращает (новый профиль, строки диффа, ошибки)."""
+    if len(operations) > MAX_OPERATIONS:
+        return admin_data, [], [f"Слишком много изменений за раз: {len(operations)} (максимум {MAX_OPERATIONS})"]
+    data = copy.deepcopy(admin_data)
+    data.setdefault('tiers', {})
+    diff, errors = [], []
+    for operation in operations:
+        kind, name = operation['kind'], operation['name']
+        if kind == 'location':
+            if operation['op'] == 'remove':
+                if name not in data['locations']:
+                    errors.append(f"{operation['source']}: локации «{name}» нет")
+                    continue
+                data['locations'].remove(name)
+                if name in data['active_locations']:
+                    data['active_locations'].remove(name)
+                (data.get('zones') or {}).pop(name, None)
+                diff.append(f"− локация {name}")
+            elif name not in data['locations']:
+                data['locations'].append(name)
+                data['active_locations'].append(name)
+                diff.append(f"+ локация {name}")
+            continue
+
+        if operation['op'] == 'remove':
+            if name not in data['pairs']:
+                errors.append(f"{operation['source']}: пары «{name}» нет")
+                continue
+            data['pairs'].remove(name)
+            if name in data['active_pairs']:
+                data['active_pairs'].remove(name)
+            data['rates'].pop(name, None)
+            data['tiers'].pop(name, None)
+            diff.append(f"− пара {name}")
+            continue
+
+        is_new = name not in data['pairs']
+        if kind == 'rate' and is_new:
+            errors.append(f"{operation['source']}: пары «{name}» нет — добавь её строкой «пара»")
+            continue
+        if is_new:
+            data['pairs'].append(name)
+            data['active_pairs'].append(name)
+            data['rates'][name] = operation['rate'] if operation['rate'] is not None else 1.0
+            if operation['tiers']:
+                data['tiers'][name] = operation['tiers']
+            diff.append(f"+ пара {name} (курс {_fmt(data['rates'][name])})")
+            continue
+        if operation['rate'] is None:
+            continue
+        old_rate = data['rates'].get(name)
+        old_tiers = data['tiers'].get(name)
+        data['rates'][name] = operation['rate']
+        if operation['tiers']:
+            data['tiers'][name] = operation['tiers']
+        else:
+            data['tiers'].pop(name, None)
+        if old_rate != operation['rate'] or old_tiers != operation['tiers']:
+            before = _fmt(old_rate) if old_rate is not None else '—'
+            suffix = f" (уровней: {len(operation['tiers']['t'])})" if operation['tiers'] else ''
+            diff.append(f"~ курс {name}: {before} → {_fmt(operation['rate'])}{suffix}")
+    return data, diff, errors
@@ -0,0 +1,76 @@
+import base64
+import binascii
+import hashlib
+import struct
+from collections import namedtuple
+
+# Номер действия = позиция в списке, он уходит в callback_data уже отправленных кнопок.
+# Новые действия добавляются только в конец, старые не удаляются и не переставляются.
+ACTIONS = [
+    'enter_admin', 'exit', 'back_to_main',
+    'manage_location', 'manage_pair', 'add_location', 'add_pair', 'remove_location', 'remove_pair',
+    'delete_location', 'delete_pair',
+    'edit_rates', 'set_rate', 'pick_rate', 'save_rates',
+    'edit_pairs', 'toggle_pair', 'reset_pairs', 'save_pairs',
+    'edit_locations', 'toggle_loc', 'reset_locations', 'save_locations',
+    'generate_otp', 'generate_otp_7', 'generate_otp_30',
+    'check_subscription', 'generate_ref_link', 'broadcast', 'bulk_edit', 'reload_config',
+    'bulk_apply', 'bulk_cancel',
+    'page_pairs', 'page_locations', 'page_delete_pairs', 'page_delete_locations', 'clear_filter', 'noop',
+]
+ACTION_IDS = {name: number for number, name in enumerate(ACTIONS)}
+
+# Действие, индекс элемента в списке админа и 16-битный отпечаток этого списка: 5 байт,
+# в base64 — 7 символов при лимите Telegram в 64 байта, сколько бы ни были длинны названия
+_PACKED = struct.Struct('>BHH')
+_ENCODED_LENGTH = 7
+
+Callback = namedtuple('Callback', 'action index version')
+
+
+def encode(action, index=0, version=0):
+    raw = _PACKED.pack(ACTION_IDS[action], index, version & 0xFFFF)
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode(data):
+    """Callback или None, если это не наша кнопка (старая текстовая, чужая, битая)."""
+    if not isinstance(data, str):
+        return None
+    if data in ACTION_IDS:
+        # Кнопки без элемента, отправленные до перехода на компактный формат (например, «Войти в админку»)
+        return Callback(data, 0, 0)
+    if len(data) != _ENCODED_LENGTH:
+        return None
+    try:
+        number, index, version = _PACKED.unpack(base64.urlsafe_b64decode(data + '='))
+    except (binascii.Error, struct.error, ValueError):
+        return None
+    if number >= len(ACTIONS):
+        return None
+    return Callback(ACTIONS[number], index, version)
+
+
+def pattern(*actions):
+    """Фильтр для CallbackQueryHandler: пропускает только перечисленные действия."""
+    allowed = frozenset(actions)
+
+    def check(data):
+        callback = decode(data)
+        return callback is not None and callback.action in allowed
+    return check
+
+
+def list_version(items):
+    """Отпечаток самого списка (пар, локаций, ключей курсов), а не версии профиля: фид и раскатка
+    дефолтов меняют версию каждые несколько минут, а кнопки ломаются, только если сдвинулся список."""
+    payload = '\x00'.join(str(name) for name in items).encode('utf-8')
+    return int.from_bytes(hashlib.blake2b(payload, digest_size=2).digest(), 'big')
+
+
+def item(callback, items):
+    """Элемент списка, на который указывает кнопка, или None, если меню построено по другому списку."""
+    items = list(items)
+    if callback.version != list_version(items) or callback.index >= len(items):
+        return None
+    return items[callback.index]
@@ -0,0 +1,221 @@
+import asyncio
+import csv
+import gzip
+import json
+import logging
+import os
+import re
+import tempfile
+import time
+import zipfile
+from datetime import datetime
+from xml.sax.saxutils import escape
+
+from utils import get_connection, is_active_admin
+
+logger = logging.getLogger(__name__)
+
+FETCH_CHUNK = 1000
+# CSV больше этого размера отправляется в gzip: Telegram не примет документ больше 50 МБ
+GZIP_THRESHOLD = 5 * 1024 * 1024
+
+CLIENT_COLUMNS = ['user_id', 'Заявок сегодня', 'Последняя заявка (дата)', 'Операция', 'Сумма', 'Выдать', 'Локация']
+ORDER_COLUMNS = ['№', 'Клиент', 'Создана', 'Операция', 'Сумма', 'Курс', 'Комиссия', 'Выдать', 'Локация',
+                 'Точное место', 'Широта', 'Долгота', 'Статус']
+
+_running = set()
+
+
+def stream_rows(query, params):
+    """Строки запроса пачками по FETCH_CHUNK: в памяти одновременно не больше одной пачки."""
+    conn = get_connection()
+    try:
+        c = conn.cursor()
+        c.execute(query, params)
+        while True:
+            rows = c.fetchmany(FETCH_CHUNK)
+            if not rows:
+                break
+            yield from rows
+    finally:
+        conn.close()
+
+
+def client_rows(admin_id):
+    rows = stream_rows('SELECT user_id, request_count, last_request_date, active_order FROM users '
+                       'WHERE referrer_id = ? ORDER BY user_id', (admin_id,))
+    for user_id, request_count, last_request_date, active_order in rows:
+        try:
+            order = json.loads(active_order) if active_order else {}
+        except json.JSONDecodeError:
+            order = {}
+        if not isinstance(order, dict):
+            order = {}
+        yield [user_id, request_count or 0, last_request_date or '', order.get('operation', ''),
+               order.get('amount', ''), order.get('result', ''), order.get('location', '')]
+
+
+def order_rows(admin_id):
+    rows = stream_rows('SELECT order_id, user_id, created_at, operation, amount, rate, fee, result, location, '
+                       'fine_location, latitude, longitude, status FROM orders WHERE admin_id = ? ORDER BY order_id',
+                       (admin_id,))
+    for row in rows:
+        row = list(row)
+        row[2] = datetime.fromtimestamp(row[2]).strftime('%Y-%m-%d %H:%M:%S')
+        yield ['' if value is None else value for value in row]
+
+
+EXPORTS = {
+    'clients': ('клиенты', CLIENT_COLUMNS, client_rows),
+    'orders': ('заявки', ORDER_COLUMNS, order_rows),
+}
+
+
+# Символы, недопустимые в XML 1.0: без их вырезания Excel откажется открывать файл
+_ILLEGAL_XML = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+_XLSX_STATIC = {
+    '[Content_Types].xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>'
+    ),
+    '_rels/.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+        'Target="xl/workbook.xml"/></Relationships>'
+    ),
+    'xl/workbook.xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="{sheet}" sheetId="1" r:id="rId1"/></sheets></workbook>'
+    ),
+    'xl/_rels/workbook.xml.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+        'Target="worksheets/sheet1.xml"/></Relationships>'
+    ),
+}
+
+
+def _xlsx_cell(value):
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return f'<c><v>{value}</v></c>'
+    text = escape(_ILLEGAL_XML.sub('', str(value)))
+    return f'<c t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>'
+
+
+def write_xlsx(path, sheet, header, rows):
+    """Минимальный XLSX без сторонних библиотек: лист пишется в zip построчно, строки не копятся в памяти."""
+    count = 0
+    with zipfile.ZipFile(path, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for name, content in _XLSX_STATIC.items():
+            archive.writestr(name, content.replace('{sheet}', escape(sheet)))
+        with archive.open('xl/worksheets/sheet1.xml', 'w', force_zip64=True) as raw:
+            raw.write(b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                      b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>')
+            raw.write(('<row>' + ''.join(map(_xlsx_cell, header)) + '</row>').encode('utf-8'))
+            for row in rows:
+                raw.write(('<row>' + ''.join(map(_xlsx_cell, row)) + '</row>').encode('utf-8'))
+                count += 1
+            raw.write(b'</sheetData></worksheet>')
+    return count
+
+
+def write_csv(path, header, rows):
+    count = 0
+    # utf-8-sig: Excel иначе открывает кириллицу кракозябрами
+    with open(path, 'w', encoding='utf-8-sig', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+    return count
+
+
+def gzip_file(path):
+    with open(path, 'rb') as source, gzip.open(path + '.gz', 'wb') as target:
+        while True:
+            chunk = source.read(1024 * 1024)
+            if not chunk:
+                break
+            target.write(chunk)
+    os.remove(path)
+    return path + '.gz'
+
+
+def build_export(admin_id, kind, fmt):
+    """Пишет выгрузку во временный файл (вызывается в рабочем потоке); возвращает (путь, имя файла, строк)."""
+    title, header, rows = EXPORTS[kind]
+    stamp = datetime.now().strftime('%Y%m%d_%H%M')
+    fd, path = tempfile.mkstemp(prefix=f'export_{kind}_', suffix=f'.{fmt}')
+    os.close(fd)
+    try:
+        if fmt == 'xlsx':
+            count = write_xlsx(path, title, header, rows(admin_id))
+        else:
+            count = write_csv(path, header, rows(admin_id))
+            if os.path.getsize(path) > GZIP_THRESHOLD:
+                path = gzip_file(path)
+    except Exception:
+        for leftover in (path, path + '.gz'):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+        raise
+    filename = f"{kind}_{stamp}.{fmt}" + ('.gz' if path.endswith('.gz') else '')
+    return path, filename, count
+
+
+EXPORT_USAGE = (
+    "Выгрузка:\n"
+    "/export clients — клиенты, пришедшие по твоей ссылке\n"
+    "/export orders — журнал заявок\n"
+    "Формат по умолчанию CSV, для Excel добавь xlsx: /export orders xlsx"
+)
+
+
+async def export_command(update, context):
+    user_id = update.message.from_user.id
+    if not is_active_admin(user_id):
+        await update.message.reply_text("Эта команда доступна только администраторам!")
+        return
+    args = [a.lower() for a in context.args or []]
+    if not args or args[0] not in EXPORTS or len(args) > 2 or (len(args) == 2 and args[1] not in ('csv', 'xlsx')):
+        await update.message.reply_text(EXPORT_USAGE)
+        return
+    kind, fmt = args[0], args[1] if len(args) == 2 else 'csv'
+    if user_id in _running:
+        await update.message.reply_text("Предыдущая выгрузка ещё готовится, подожди немного.")
+        return
+
+    _running.add(user_id)
+    path = None
+    try:
+        await update.message.reply_text("Готовлю выгрузку, пришлю файлом…")
+        started = time.perf_counter()
+        # Чтение базы и запись файла — в рабочем потоке, бот в это время продолжает отвечать
+        path, filename, count = await asyncio.to_thread(build_export, user_id, kind, fmt)
+        logger.info(f"Выгрузка {kind}.{fmt} для {user_id}: строк {count}, {os.path.getsize(path)} байт, "
+                    f"{(time.perf_counter() - started) * 1000:.0f} мс")
+        with open(path, 'rb') as document:
+            await context.bot.send_document(chat_id=user_id, document=document, filename=filename,
+                                            caption=f"Строк: {count}")
+    except Exception as e:
+        logger.error(f"Ошибка выгрузки {kind} для {user_id}: {str(e)}")
+        await update.message.reply_text(f"Не удалось подготовить выгрузку: {str(e)}")
+    finally:
+        _running.discard(user_id)
+        if path and os.path.exists(path):
+            os.remove(path)
@@ -0,0 +1,254 @@
+import asyncio
+import csv
+import io
+import json
+import logging
+import sqlite3
+import time
+import urllib.request
+from decimal import Decimal, ROUND_DOWN
+
+from ex_history import record_many
+from ex_quotes import PAIR_SEPARATOR, invalidate, to_decimal
+from ex_shards import notify
+from utils import get_connection, get_admin_data, get_feed_margins, save_feed_margins
+
+logger = logging.getLogger(__name__)
+
+# Курс после наценки хранится с этой точностью (как и ручные курсы — float в JSON)
+RATE_PRECISION = Decimal('0.000001')
+FETCH_CHUNK = 500
+
+last_run = {}
+
+
+def parse_feed(text):
+    """JSON {"пара": курс} (или {"rates": {...}}) либо CSV «пара,курс» → {пара: Decimal}."""
+    text = text.strip()
+    rates = {}
+    if text.startswith('{'):
+        document = json.loads(text)
+        items = (document.get('rates', document)).items()
+    else:
+        items = (row[:2] for row in csv.reader(io.StringIO(text)) if len(row) >= 2)
+    for label, value in items:
+        label = ' '.join(str(label).replace('->', PAIR_SEPARATOR).split())
+        try:
+            rate = to_decimal(value)
+        except ValueError:
+            logger.warning(f"Фид: пропущен некорректный курс {value!r} для пары {label}")
+            continue
+        if rate > 0:
+            rates[label] = rate
+    return rates
+
+
+class FileSource:
+    def __init__(self, path):
+        self.path = path
+
+    def fetch(self):
+        with open(self.path, 'r', encoding='utf-8') as f:
+            return parse_feed(f.read())
+
+
+class HttpSource:
+    def __init__(self, url, timeout=10):
+        self.url = url
+        self.timeout = timeout
+
+    def fetch(self):
+        request = urllib.request.Request(self.url, headers={'Accept': 'application/json, text/csv'})
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            return parse_feed(response.read().decode('utf-8'))
+
+
+# Схема адреса → класс источника; сторонний источник регистрируется через register_source
+SOURCES = {'file': FileSource, 'http': HttpSource, 'https': HttpSource}
+
+
+def register_source(scheme, factory):
+    SOURCES[scheme] = factory
+
+
+def make_source(spec):
+    scheme, sep, rest = spec.partition('://')
+    if not sep:
+        return FileSource(spec)
+    if scheme not in SOURCES:
+        raise ValueError(f"Неизвестный источник фида: {scheme}")
+    return SOURCES[scheme](rest if scheme == 'file' else spec)
+
+
+def margin_rule(margins, label):
+    return margins.get(label) or margins.get('*')
+
+
+def apply_margin(reference, rule):
+    """Наценка уменьшает курс для клиента: процент от опорного курса и/или фиксированный спред."""
+    rate = reference
+    if rule:
+        rate = rate * (1 - to_decimal(rule.get('percent', 0)) / 100) - to_decimal(rule.get('fixed', 0))
+    return rate.quantize(RATE_PRECISION, rounding=ROUND_DOWN)
+
+
+def ingest(reference_rates):
+    """Пересчитывает курсы всех подписанных админов одной транзакцией.
+
+    Профили читаются и пишутся пачками прямо в SQL, без get_admin_data/save_admin_data
+    на каждого админа; кэш каталогов сбрасывается один раз в конце.
+    """
+    started = time.perf_counter()
+    stats = {'admins': 0, 'updated': 0, 'rates': 0, 'skipped_tiered': 0}
+    conn = get_connection()
+    try:
+        c = conn.cursor()
+        c.execute('BEGIN IMMEDIATE')
+        c.execute('SELECT admin_id, rates, pairs, tiers, feed_margins FROM admins WHERE feed_margins IS NOT NULL')
+        updates = []
+        while True:
+            rows = c.fetchmany(FETCH_CHUNK)
+            if not rows:
+                break
+            for admin_id, rates_json, pairs_json, tiers_json, margins_json in rows:
+                stats['admins'] += 1
+                rates = json.loads(rates_json) if rates_json else {}
+                pairs = json.loads(pairs_json) if pairs_json else []
+                tiers = json.loads(tiers_json) if tiers_json else {}
+                margins = json.loads(margins_json)
+                changed = 0
+                for label in pairs:
+                    reference = reference_rates.get(label)
+                    if reference is None:
+                        continue
+                    if label in tiers:
+                        # Уровни задаются вручную и перекрывают базовый курс
+                        stats['skipped_tiered'] += 1
+                        continue
+                    rate = apply_margin(reference, margin_rule(margins, label))
+                    if rate <= 0:
+                        logger.warning(f"Фид: наценка админа {admin_id} обнуляет курс пары {label}, пропуск")
+                        continue
+                    if rates.get(label) != float(rate):
+                        rates[label] = float(rate)
+                        changed += 1
+                if changed:
+                    updates.append((json.dumps(rates), admin_id))
+                    stats['rates'] += changed
+        if updates:
+            c.executemany('UPDATE admins SET rates = ?, version = COALESCE(version, 0) + 1 WHERE admin_id = ?', updates)
+        conn.commit()
+        stats['updated'] = len(updates)
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    if stats['updated']:
+        invalidate()
+        notify('quotes')
+        try:
+            record_many((admin_id, json.loads(rates_json)) for rates_json, admin_id in updates)
+        except sqlite3.Error as e:
+            logger.error(f"Фид: не удалось записать историю курсов: {e}")
+    stats['elapsed_ms'] = round((time.perf_counter() - started) * 1000, 1)
+    logger.info(f"Фид курсов применён: {stats}")
+    return stats
+
+
+def run_once(spec):
+    reference_rates = make_source(spec).fetch()
+    stats = ingest(reference_rates)
+    stats['pairs'] = len(reference_rates)
+    last_run.update(stats, at=time.strftime('%Y-%m-%d %H:%M:%S'), source=spec)
+    return stats
+
+
+async def run_rate_feed(application):
+    from bot_config import bot_config
+    feed = bot_config.get('rate_feed') or {}
+    if not feed.get('source'):
+        return
+    logger.info(f"Фоновая задача фида курсов запущена: {feed['source']}")
+    while not application.stop_event.is_set():
+        try:
+            # Сеть и SQLite — в отдельном потоке, чтобы не блокировать обработку апдейтов
+            await asyncio.to_thread(run_once, feed['source'])
+        except Exception as e:
+            logger.error(f"Ошибка в фиде курсов: {str(e)}")
+        for _ in range(int(feed.get('interval', 300))):
+            if application.stop_event.is_set():
+                break
+            await asyncio.sleep(1)
+    logger.info("Фоновая задача фида курсов завершена")
+
+
+def parse_margin(text):
+    """«1.5%» → {'percent': '1.5'}, «0.3» → {'fixed': '0.3'}."""
+    text = text.strip()
+    if text.endswith('%'):
+        return {'percent': str(to_decimal(text[:-1]))}
+    return {'fixed': str(to_decimal(text))}
+
+
+FEED_USAGE = (
+    "Фид курсов:\n"
+    "/feed — текущие правила\n"
+    "/feed 1.5% — наценка в процентах на все пары\n"
+    "/feed 0.3 — фиксированный спред на все пары\n"
+    "/feed USDT → Рупии (нал) 2% — наценка для одной пары\n"
+    "/feed off — отписаться от фида"
+)
+
+
+async def feed_command(update, context):
+    from bot_config import bot_config
+    from utils import is_active_admin
+    user_id = update.message.from_user.id
+    is_owner = str(user_id) == bot_config["owner_id"]
+    if not is_active_admin(user_id):
+        await update.message.reply_text("Эта команда доступна только администраторам!")
+        return
+    args = context.args or []
+
+    if args == ['now'] and is_owner:
+        source = (bot_config.get('rate_feed') or {}).get('source')
+        if not source:
+            await update.message.reply_text("Источник фида не задан (rate_feed.source в config.json).")
+            return
+        try:
+            stats = await asyncio.to_thread(run_once, source)
+        except Exception as e:
+            logger.error(f"Ошибка ручного запуска фида: {str(e)}")
+            await update.message.reply_text(f"Ошибка фида: {str(e)}")
+            return
+        await update.message.reply_text(
+            f"Фид применён: пар в фиде {stats['pairs']}, подписанных админов {stats['admins']}, "
+            f"обновлено профилей {stats['updated']} ({stats['rates']} курсов) за {stats['elapsed_ms']} мс"
+        )
+        return
+
+    get_admin_data(user_id)  # профиль должен существовать
+    margins = get_feed_margins(user_id)
+    if not args:
+        status = json.dumps(margins, ensure_ascii=False) if margins is not None else "не подписан"
+        text = f"Правила фида: {status}"
+        if last_run:
+            text += f"\nПоследний прогон: {last_run['at']}, обновлено профилей {last_run['updated']}"
+        await update.message.reply_text(f"{text}\n\n{FEED_USAGE}")
+        return
+    if args == ['off']:
+        save_feed_margins(user_id, None)
+        await update.message.reply_text("Ты отписан от фида курсов, курсы больше не обновляются автоматически.")
+        return
+    try:
+        rule = parse_margin(args[-1])
+    except ValueError:
+        await update.message.reply_text(FEED_USAGE)
+        return
+    label = ' '.join(args[:-1]).replace('->', PAIR_SEPARATOR) or '*'
+    margins = margins or {}
+    margins[label] = rule
+    save_feed_margins(user_id, margins)
+    target = "всех пар" if label == '*' else f"пары {label}"
+    await update.message.reply_text(f"Наценка для {target} сохранена: {args[-1]}. Курсы обновятся при следующем прогоне фида.")
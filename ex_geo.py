@@ -0,0 +1,283 @@
+import logging
+import math
+import re
+from dataclasses import dataclass
+
+logger = logging.getLogger(__name__)
+
+# Сторона ячейки сетки в градусах (~11 км по широте)
+CELL_DEG = 0.1
+KM_PER_DEG_LAT = 110.574
+KM_PER_DEG_LON = 111.320
+# Дальше этого расстояния от края зоны геолокацию не сопоставляем
+DEFAULT_MATCH_KM = 15.0
+DEFAULT_RADIUS_KM = 2.0
+
+
+@dataclass(frozen=True)
+class Zone:
+    name: str
+    lat: float  # точка или центр многоугольника
+    lon: float
+    radius_km: float  # для точечной зоны; у многоугольника 0
+    polygon: tuple  # ((lat, lon), ...) или ()
+    bbox: tuple  # (min_lat, min_lon, max_lat, max_lon) с учётом радиуса
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * 6371.0 * math.asin(math.sqrt(a))
+
+
+def _contains(polygon, lat, lon):
+    inside = False
+    j = len(polygon) - 1
+    for i in range(len(polygon)):
+        (lat_i, lon_i), (lat_j, lon_j) = polygon[i], polygon[j]
+        if (lon_i > lon) != (lon_j > lon) and lat < (lat_j - lat_i) * (lon - lon_i) / (lon_j - lon_i) + lat_i:
+            inside = not inside
+        j = i
+    return inside
+
+
+def _edge_distance_km(polygon, lat, lon):
+    # Локальная равнопромежуточная проекция вокруг точки запроса: на масштабе города погрешность мала
+    kx = KM_PER_DEG_LON * math.cos(math.radians(lat))
+    best = float('inf')
+    for (lat_a, lon_a), (lat_b, lon_b) in zip(polygon, polygon[1:] + polygon[:1]):
+        ax, ay = (lon_a - lon) * kx, (lat_a - lat) * KM_PER_DEG_LAT
+        bx, by = (lon_b - lon) * kx, (lat_b - lat) * KM_PER_DEG_LAT
+        dx, dy = bx - ax, by - ay
+        length = dx * dx + dy * dy
+        t = 0.0 if not length else max(0.0, min(1.0, -(ax * dx + ay * dy) / length))
+        best = min(best, math.hypot(ax + t * dx, ay + t * dy))
+    return best
+
+
+def make_zone(name, spec):
+    """spec из admins.zones: {"point": [lat, lon], "radius_km": r} или {"polygon": [[lat, lon], ...]}."""
+    if spec.get('polygon'):
+        polygon = tuple((float(lat), float(lon)) for lat, lon in spec['polygon'])
+        if len(polygon) < 3:
+            raise ValueError("в многоугольнике нужно минимум 3 точки")
+        lats, lons = [p[0] for p in polygon], [p[1] for p in polygon]
+        return Zone(name, sum(lats) / len(lats), sum(lons) / len(lons), 0.0, polygon,
+                    (min(lats), min(lons), max(lats), max(lons)))
+    lat, lon = (float(v) for v in spec['point'])
+    radius = float(spec.get('radius_km', DEFAULT_RADIUS_KM))
+    dlat = radius / KM_PER_DEG_LAT
+    dlon = radius / (KM_PER_DEG_LON * max(0.01, math.cos(math.radians(lat))))
+    return Zone(name, lat, lon, radius, (), (lat - dlat, lon - dlon, lat + dlat, lon + dlon))
+
+
+COORDINATES_RE = re.compile(r'(-?\d{1,2}\.\d+)\s*,\s*(-?\d{1,3}\.\d+)')
+
+
+def coordinates_from_text(text):
+    """Координаты из ссылки Google Maps (…?q=15.6,73.7 или …/@15.6,73.7,15z) или None."""
+    match = COORDINATES_RE.search(text or '')
+    if not match:
+        return None
+    try:
+        return validate_coordinates(float(match.group(1)), float(match.group(2)))
+    except ValueError:
+        return None
+
+
+def validate_coordinates(lat, lon):
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        raise ValueError("координаты вне диапазона")
+    return lat, lon
+
+
+class ZoneIndex:
+    """Сетка CELL_DEG×CELL_DEG: ячейка → зоны, чей габарит её задевает."""
+
+    def __init__(self, zones, cell_deg=CELL_DEG):
+        self.zones = list(zones)
+        self.cell_deg = cell_deg
+        self.cells = {}
+        for index, zone in enumerate(self.zones):
+            min_lat, min_lon, max_lat, max_lon = zone.bbox
+            for x in range(self._cell(min_lat), self._cell(max_lat) + 1):
+                for y in range(self._cell(min_lon), self._cell(max_lon) + 1):
+                    self.cells.setdefault((x, y), []).append(index)
+
+    def _cell(self, value):
+        return math.floor(value / self.cell_deg)
+
+    def distance_km(self, zone, lat, lon):
+        """0 внутри зоны, иначе расстояние до её края."""
+        if zone.polygon:
+            if _contains(zone.polygon, lat, lon):
+                return 0.0
+            return _edge_distance_km(zone.polygon, lat, lon)
+        return max(0.0, haversine_km(lat, lon, zone.lat, zone.lon) - zone.radius_km)
+
+    def nearest(self, lat, lon, max_km=DEFAULT_MATCH_KM):
+        """(зона, расстояние до края в км) или None. Обходит кольца ячеек вокруг точки,
+        пока ближайшая найденная зона не окажется ближе любой ещё не просмотренной."""
+        if not self.zones:
+            return None
+        cx, cy = self._cell(lat), self._cell(lon)
+        cell_km = self.cell_deg * min(KM_PER_DEG_LAT, KM_PER_DEG_LON * math.cos(math.radians(lat)))
+        # У полюсов ячейка сужается по долготе почти до нуля, и колец до max_km становится тысячи;
+        # если ячеек в них больше, чем зон, дешевле просто перебрать зоны
+        rings = (max_km + cell_km) / cell_km if cell_km > 0 else float('inf')
+        if (2 * rings + 1) ** 2 > len(self.zones):
+            return self._scan(lat, lon, max_km)
+        best, best_distance, seen = None, float('inf'), set()
+        ring = 0
+        while True:
+            # Просмотрены кольца 0..ring-1: всё, что их не задело, дальше (ring - 1) ячеек от точки
+            if best is not None and best_distance <= (ring - 1) * cell_km:
+                break
+            if ring * cell_km > max_km + cell_km or len(seen) == len(self.zones):
+                break
+            for x, y in self._ring_cells(cx, cy, ring):
+                for index in self.cells.get((x, y), ()):
+                    if index in seen:
+                        continue
+                    seen.add(index)
+                    distance = self.distance_km(self.zones[index], lat, lon)
+                    if distance < best_distance:
+                        best, best_distance = self.zones[index], distance
+            ring += 1
+        if best is None or best_distance > max_km:
+            return None
+        return best, best_distance
+
+    @staticmethod
+    def _ring_cells(cx, cy, ring):
+        """Ячейки на границе квадрата (2·ring+1)×(2·ring+1) вокруг (cx, cy)."""
+        if ring == 0:
+            yield cx, cy
+            return
+        for y in range(cy - ring, cy + ring + 1):
+            yield cx - ring, y
+            yield cx + ring, y
+        for x in range(cx - ring + 1, cx + ring):
+            yield x, cy - ring
+            yield x, cy + ring
+
+    def _scan(self, lat, lon, max_km):
+        best, best_distance = None, float('inf')
+        for zone in self.zones:
+            distance = self.distance_km(zone, lat, lon)
+            if distance < best_distance:
+                best, best_distance = zone, distance
+        if best is None or best_distance > max_km:
+            return None
+        return best, best_distance
+
+
+_indexes = {}
+
+
+def get_zone_index(admin_id, admin_data):
+    """Индекс активных зон админа; пересобирается только при смене версии профиля."""
+    version = admin_data.get('version')
+    cached = _indexes.get(admin_id)
+    if cached is not None and version is not None and cached[0] == version:
+        return cached[1]
+    zones = []
+    for name, spec in (admin_data.get('zones') or {}).items():
+        if name not in admin_data['active_locations']:
+            continue
+        try:
+            zones.append(make_zone(name, spec))
+        except (KeyError, TypeError, ValueError) as e:
+            logger.error(f"Некорректная зона {name} у админа {admin_id}: {str(e)}")
+    index = ZoneIndex(zones)
+    if version is not None:
+        _indexes[admin_id] = (version, index)
+    return index
+
+
+def match_location(admin_id, admin_data, lat, lon):
+    from bot_config import bot_config
+    found = get_zone_index(admin_id, admin_data).nearest(lat, lon, bot_config.get('zone_match_km', DEFAULT_MATCH_KM))
+    return found[0].name if found else None
+
+
+def parse_zone_spec(tokens):
+    """«15.6,73.7 [радиус_км]» → точка; три и больше «lat,lon» → многоугольник."""
+    try:
+        return _parse_zone_tokens(tokens)
+    except ValueError as e:
+        if 'could not convert' in str(e):
+            raise ValueError("координаты и радиус — числа, например 15.631,73.738 3")
+        raise
+
+
+def _parse_zone_tokens(tokens):
+    points, radius = [], None
+    for token in tokens:
+        if ',' in token:
+            lat, _, lon = token.partition(',')
+            points.append(list(validate_coordinates(float(lat), float(lon))))
+        elif points and radius is None and len(points) == 1:
+            radius = float(token)
+            if not 0 < radius <= 100:
+                raise ValueError("радиус должен быть от 0 до 100 км")
+        else:
+            raise ValueError(f"не понял «{token}»")
+    if len(points) == 1:
+        return {'point': points[0], 'radius_km': radius if radius is not None else DEFAULT_RADIUS_KM}
+    if len(points) >= 3 and radius is None:
+        return {'polygon': points}
+    raise ValueError("нужна одна точка (и радиус) или минимум три вершины многоугольника")
+
+
+ZONE_USAGE = (
+    "Зоны локаций для автоподбора по геолокации клиента:\n"
+    "/zone — список зон\n"
+    "/zone Морджим 15.631,73.738 3 — точка и радиус в км\n"
+    "/zone Морджим 15.64,73.73 15.64,73.75 15.62,73.75 15.62,73.73 — многоугольник\n"
+    "/zone Морджим off — убрать зону"
+)
+
+
+async def zone_command(update, context):
+    from utils import get_admin_data, is_active_admin, save_admin_data
+    user_id = update.message.from_user.id
+    if not is_active_admin(user_id):
+        await update.message.reply_text("Эта команда доступна только администраторам!")
+        return
+    admin_data = get_admin_data(user_id)
+    zones = admin_data.setdefault('zones', {})
+    args = context.args or []
+    if not args:
+        lines = []
+        for name in admin_data['locations']:
+            spec = zones.get(name)
+            if spec is None:
+                lines.append(f"{name}: нет зоны")
+            elif spec.get('polygon'):
+                lines.append(f"{name}: многоугольник, вершин {len(spec['polygon'])}")
+            else:
+                lines.append(f"{name}: {spec['point'][0]},{spec['point'][1]}, радиус {spec['radius_km']} км")
+        await update.message.reply_text("\n".join(lines + ["", ZONE_USAGE]))
+        return
+
+    # Название локации может быть из нескольких слов: всё до первых координат (или «off»)
+    split = next((i for i, token in enumerate(args) if ',' in token or token.lower() == 'off'), len(args))
+    name = ' '.join(args[:split])
+    if name not in admin_data['locations']:
+        await update.message.reply_text(f"Локация «{name}» не найдена.\n\n{ZONE_USAGE}")
+        return
+    if [token.lower() for token in args[split:]] == ['off']:
+        zones.pop(name, None)
+        save_admin_data(user_id, admin_data)
+        await update.message.reply_text(f"Зона для «{name}» удалена.")
+        return
+    try:
+        spec = parse_zone_spec(args[split:])
+    except ValueError as e:
+        await update.message.reply_text(f"Ошибка: {str(e)}\n\n{ZONE_USAGE}")
+        return
+    zones[name] = spec
+    save_admin_data(user_id, admin_data)
+    logger.info(f"Админ {user_id} задал зону для {name}: {spec}")
+    await update.message.reply_text(f"Зона для «{name}» сохранена. Клиенты с геолокацией рядом попадут сюда автоматически.")
@@ -0,0 +1,239 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+import utils
+from ex_shards import notify
+
+logger = logging.getLogger(__name__)
+
+# История курсов лежит в отдельном файле рядом с основной базой, чтобы миллионы точек
+# не раздували database.db и не мешали её бэкапам/VACUUM
+HISTORY_PATH = os.getenv("RATE_HISTORY_DB")
+
+SPARK = '▁▂▃▄▅▆▇█'
+# Лимит длины сообщения Telegram
+MAX_MESSAGE_LENGTH = 4096
+LAST_CACHE_LIMIT = 100000
+
+_lock = threading.Lock()
+_initialized = set()
+_pair_ids = {}  # (файл, подпись пары) → pair_id
+_last = {}  # (файл, admin_id, pair_id) → последний записанный курс; в WORKERS>1 сбрасывается по notify('history')
+
+
+def history_path():
+    return HISTORY_PATH or os.path.join(os.path.dirname(os.path.abspath(utils.DB_PATH)), 'rate_history.db')
+
+
+def get_history_connection():
+    path = history_path()
+    conn = utils.get_connection(path)
+    if path not in _initialized:
+        # Точка = (админ, пара, секунда) → курс; WITHOUT ROWID хранит строки прямо в B-дереве ключа
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS rate_history (
+                admin_id INTEGER NOT NULL,
+                pair_id INTEGER NOT NULL,
+                ts INTEGER NOT NULL,
+                rate REAL NOT NULL,
+                PRIMARY KEY (admin_id, pair_id, ts)
+            ) WITHOUT ROWID
+        ''')
+        # Подписи пар длинные — в точках храним только их номер
+        conn.execute('CREATE TABLE IF NOT EXISTS rate_pairs (pair_id INTEGER PRIMARY KEY, label TEXT UNIQUE NOT NULL)')
+        conn.commit()
+        _initialized.add(path)
+    return conn
+
+
+def _pair_id(c, path, label, create=True):
+    key = (path, label)
+    if key not in _pair_ids:
+        row = c.execute('SELECT pair_id FROM rate_pairs WHERE label = ?', (label,)).fetchone()
+        if row is None:
+            if not create:
+                return None
+            row = (c.execute('INSERT INTO rate_pairs (label) VALUES (?)', (label,)).lastrowid,)
+        _pair_ids[key] = row[0]
+    return _pair_ids[key]
+
+
+def record_many(entries, ts=None):
+    """Дописывает точки для [(admin_id, {пара: курс})], пропуская курсы, не изменившиеся с прошлой точки."""
+    ts = int(ts if ts is not None else time.time())
+    path = history_path()
+    with _lock:
+        conn = get_history_connection()
+        try:
+            c = conn.cursor()
+            points = []
+            for admin_id, rates in entries:
+                for label, rate in rates.items():
+                    if rate is None:
+                        continue
+                    rate = float(rate)
+                    pair_id = _pair_id(c, path, label)
+                    key = (path, admin_id, pair_id)
+                    if key not in _last:
+                        row = c.execute('SELECT rate FROM rate_history WHERE admin_id = ? AND pair_id = ? '
+                                        'ORDER BY ts DESC LIMIT 1', (admin_id, pair_id)).fetchone()
+                        _last[key] = row[0] if row else None
+                    if _last[key] == rate:
+                        continue
+                    points.append((admin_id, pair_id, ts, rate))
+                    _last[key] = rate
+            if points:
+                # Несколько правок в одну секунду: остаётся последняя
+                c.executemany('INSERT OR REPLACE INTO rate_history (admin_id, pair_id, ts, rate) VALUES (?, ?, ?, ?)', points)
+            conn.commit()
+            if len(_last) > LAST_CACHE_LIMIT:
+                _last.clear()
+            if points:
+                # Курсы админа пишут и фид (первый обработчик), и сам админ (его обработчик): у остальных
+                # процессов последний курс в _last устарел
+                notify('history', sorted({point[0] for point in points}))
+            return len(points)
+        except sqlite3.Error as e:
+            conn.rollback()
+            _last.clear()
+            _pair_ids.clear()
+            logger.error(f"Ошибка записи истории курсов: {e}")
+            raise
+        finally:
+            conn.close()
+
+
+def forget(admin_ids=None):
+    """Сбрасывает запомненные последние курсы админов (всех при None): следующая точка сверится с базой."""
+    with _lock:
+        if admin_ids is None:
+            _last.clear()
+            return
+        admin_ids = set(admin_ids)
+        for key in [key for key in _last if key[1] in admin_ids]:
+            del _last[key]
+
+
+def record_rates(admin_id, rates, ts=None):
+    return record_many([(admin_id, rates)], ts)
+
+
+def rate_at(admin_id, pair, ts):
+    """Курс, действовавший в момент ts (последняя точка не позже ts), или None."""
+    conn = get_history_connection()
+    try:
+        c = conn.cursor()
+        pair_id = _pair_id(c, history_path(), pair, create=False)
+        if pair_id is None:
+            return None
+        row = c.execute('SELECT rate FROM rate_history WHERE admin_id = ? AND pair_id = ? AND ts <= ? '
+                        'ORDER BY ts DESC LIMIT 1', (admin_id, pair_id, int(ts))).fetchone()
+        return row[0] if row else None
+    finally:
+        conn.close()
+
+
+def rate_range(admin_id, pair, start, end, buckets=24):
+    """Прореженный ряд за [start, end): по каждому интервалу (минимум, максимум, последний курс).
+
+    Пустые интервалы заполняются последним известным курсом, первый — курсом на момент start.
+    """
+    start, end = int(start), int(end)
+    step = max(1, -(-(end - start) // buckets))
+    conn = get_history_connection()
+    try:
+        c = conn.cursor()
+        pair_id = _pair_id(c, history_path(), pair, create=False)
+        if pair_id is None:
+            return []
+        row = c.execute('SELECT rate FROM rate_history WHERE admin_id = ? AND pair_id = ? AND ts < ? '
+                        'ORDER BY ts DESC LIMIT 1', (admin_id, pair_id, start)).fetchone()
+        carry = row[0] if row else None
+        # Закрытие интервала — курс точки с максимальным ts в нём (поиск по первичному ключу)
+        c.execute('''
+            SELECT g.bucket, g.low, g.high, h.rate
+            FROM (
+                SELECT (ts - ?) / ? AS bucket, MIN(rate) AS low, MAX(rate) AS high, MAX(ts) AS last_ts
+                FROM rate_history
+                WHERE admin_id = ? AND pair_id = ? AND ts >= ? AND ts < ?
+                GROUP BY bucket
+            ) g
+            JOIN rate_history h ON h.admin_id = ? AND h.pair_id = ? AND h.ts = g.last_ts
+        ''', (start, step, admin_id, pair_id, start, end, admin_id, pair_id))
+        found = {bucket: (low, high, close) for bucket, low, high, close in c.fetchall()}
+    finally:
+        conn.close()
+    series = []
+    for bucket in range(buckets):
+        if bucket in found:
+            low, high, close = found[bucket]
+            if carry is not None:
+                low, high = min(low, carry), max(high, carry)
+            series.append((start + bucket * step, low, high, close))
+            carry = close
+        else:
+            series.append((start + bucket * step, carry, carry, carry))
+    return series
+
+
+def sparkline(values):
+    known = [v for v in values if v is not None]
+    if not known:
+        return ''
+    low, high = min(known), max(known)
+    # Интервалы до первой точки истории остаются пустыми
+    return ''.join(
+        ' ' if v is None else SPARK[len(SPARK) // 2] if high == low else SPARK[int((v - low) / (high - low) * (len(SPARK) - 1))]
+        for v in values
+    )
+
+
+def summary(admin_id, pairs, days=7, buckets=24, now=None):
+    """Строки сводки для админа: текущий курс, изменение за период, мин/макс и спарклайн."""
+    end = int(now if now is not None else time.time()) + 1
+    start = end - days * 86400
+    lines = []
+    for pair in pairs:
+        series = rate_range(admin_id, pair, start, end, buckets)
+        closes = [point[3] for point in series]
+        known = [v for v in closes if v is not None]
+        if not known:
+            lines.append(f"*{pair}*: истории нет")
+            continue
+        first, last = known[0], known[-1]
+        low = min(point[1] for point in series if point[1] is not None)
+        high = max(point[2] for point in series if point[2] is not None)
+        change = (last - first) / first * 100 if first else 0.0
+        lines.append(f"*{pair}*: {last:.2f} ({change:+.1f}%), мин {low:.2f}, макс {high:.2f}\n`{sparkline(closes)}`")
+    return lines
+
+
+async def history_command(update, context):
+    user_id = update.message.from_user.id
+    if not utils.is_active_admin(user_id):
+        await update.message.reply_text("Эта команда доступна только администраторам!")
+        return
+    args = context.args or []
+    days = 7
+    if args and args[-1].isdigit():
+        days = max(1, min(365, int(args.pop())))
+    admin_data = utils.get_admin_data(user_id)
+    pairs = admin_data['active_pairs'] or admin_data['pairs']
+    if args:
+        query = ' '.join(args).lower()
+        pairs = [p for p in admin_data['pairs'] if query in p.lower()]
+        if not pairs:
+            await update.message.reply_text("Пара не найдена. Используйте: /history [часть названия пары] [дней]")
+            return
+    lines = summary(user_id, pairs, days)
+    text = f"Курсы за {days} дн.:\n"
+    # Обрезаем по целым строкам, чтобы не разорвать разметку; место под хвост «…и ещё» оставляем заранее
+    for shown, line in enumerate(lines):
+        if len(text) + 1 + len(line) > MAX_MESSAGE_LENGTH - 100:
+            text += f"\n…и ещё {len(lines) - shown} пар — уточните запрос: /history <часть названия пары>"
+            break
+        text += "\n" + line
+    await update.message.reply_text(text, parse_mode='Markdown')
@@ -0,0 +1,242 @@
+import logging
+import sqlite3
+import time
+
+from ex_quotes import format_amount, from_minor, split_pair, to_minor
+from ex_shards import notify
+from utils import get_admin_data, get_connection, insert_order, is_active_admin
+
+logger = logging.getLogger(__name__)
+
+# Индекс доступных наличных перечитывается из базы не реже этого: страхует от правок
+# из других процессов; свои резервы и /cash обновляют его сразу
+INDEX_TTL = 30
+
+
+def payout_asset(order):
+    """Актив, который админ выдаёт по заявке, — его наличные и резервируются."""
+    return split_pair(order['operation'])[1]
+
+
+class AvailabilityIndex:
+    """admin_id → {(локация, актив): доступно в минимальных единицах}; чего нет в словаре, не учитывается."""
+
+    def __init__(self, ttl=INDEX_TTL):
+        self.ttl = ttl
+        self.admins = {}
+
+    def get(self, admin_id):
+        cached = self.admins.get(admin_id)
+        if cached is not None and time.monotonic() - cached[0] < self.ttl:
+            return cached[1]
+        conn = get_connection()
+        try:
+            rows = conn.execute('SELECT location, asset, balance - reserved FROM inventory WHERE admin_id = ?',
+                                (admin_id,)).fetchall()
+        finally:
+            conn.close()
+        available = {(location, asset): value for location, asset, value in rows}
+        self.admins[admin_id] = (time.monotonic(), available)
+        return available
+
+    def set(self, admin_id, location, asset, value):
+        cached = self.admins.get(admin_id)
+        if cached is not None:
+            cached[1][(location, asset)] = value
+
+    def discard(self, admin_id, location, asset):
+        cached = self.admins.get(admin_id)
+        if cached is not None:
+            cached[1].pop((location, asset), None)
+
+    def invalidate(self, admin_id=None):
+        if admin_id is None:
+            self.admins.clear()
+        else:
+            self.admins.pop(admin_id, None)
+
+
+index = AvailabilityIndex()
+
+
+def has_cash(admin_id, location, order):
+    if not order or not order.get('result'):
+        return True
+    asset = payout_asset(order)
+    available = index.get(admin_id).get((location, asset))
+    return available is None or available >= to_minor(asset, order['result'])
+
+
+def available_locations(admin_id, locations, order):
+    """Локации, где хватит наличных на выдачу по заявке; без учёта остатков — все."""
+    if not order or not order.get('result'):
+        return list(locations)
+    asset = payout_asset(order)
+    needed = to_minor(asset, order['result'])
+    available = index.get(admin_id)
+    return [location for location in locations if available.get((location, asset), needed) >= needed]
+
+
+def place_order(user_id, admin_id, order, latitude=None, longitude=None, created_at=None):
+    """Записывает заявку и резервирует наличные одной транзакцией.
+
+    Резерв — условный UPDATE «доступно ≥ суммы»: при одновременных заявках SQLite
+    выполняет их по очереди, и остаток не уходит в минус. Возвращает order_id
+    или None, если в локации не хватает наличных.
+    """
+    asset = payout_asset(order)
+    needed = to_minor(asset, order['result'])
+    location = order.get('location')
+    conn = get_connection()
+    try:
+        c = conn.cursor()
+        c.execute('BEGIN IMMEDIATE')
+        c.execute('''
+            UPDATE inventory SET reserved = reserved + ?
+            WHERE admin_id = ? AND location = ? AND asset = ? AND balance - reserved >= ?
+            RETURNING balance - reserved
+        ''', (needed, admin_id, location, asset, needed))
+        row = c.fetchone()
+        reserve = None
+        if row is not None:
+            reserve = (asset, needed)
+        else:
+            c.execute('SELECT balance - reserved FROM inventory WHERE admin_id = ? AND location = ? AND asset = ?',
+                      (admin_id, location, asset))
+            tracked = c.fetchone()
+            if tracked is not None:
+                conn.rollback()
+                index.set(admin_id, location, asset, tracked[0])
+                notify('cash', (admin_id, location, asset, tracked[0]))
+                logger.info(f"Заявка клиента {user_id} отклонена: в локации {location} админа {admin_id} "
+                            f"доступно {tracked[0]}, нужно {needed} ({asset})")
+                return None
+        order_id = insert_order(c, user_id, admin_id, order, latitude, longitude, created_at, reserve)
+        conn.commit()
+    except sqlite3.Error as e:
+        conn.rollback()
+        logger.error(f"Ошибка при сохранении заявки клиента {user_id}: {e}")
+        raise
+    finally:
+        conn.close()
+    if reserve is not None:
+        index.set(admin_id, location, asset, row[0])
+        notify('cash', (admin_id, location, asset, row[0]))
+    logger.debug(f"Заявка {order_id} клиента {user_id} сохранена для админа {admin_id}, резерв {reserve}")
+    return order_id
+
+
+def order_closed(admin_id):
+    # Отмена возвращает резерв в доступные, выдача списывает остаток — перечитаем при следующем меню
+    index.invalidate(admin_id)
+    notify('inventory', admin_id)
+
+
+def set_cash(admin_id, location, asset, value, relative=False):
+    """Задаёт (или при relative меняет на value) остаток; возвращает (остаток, резерв) в минимальных единицах."""
+    conn = get_connection()
+    try:
+        c = conn.cursor()
+        if relative:
+            c.execute('''
+                INSERT INTO inventory (admin_id, location, asset, balance) VALUES (?, ?, ?, ?)
+                ON CONFLICT(admin_id, location, asset) DO UPDATE SET balance = balance + excluded.balance
+                RETURNING balance, reserved
+            ''', (admin_id, location, asset, value))
+        else:
+            c.execute('''
+                INSERT INTO inventory (admin_id, location, asset, balance) VALUES (?, ?, ?, ?)
+                ON CONFLICT(admin_id, location, asset) DO UPDATE SET balance = excluded.balance
+                RETURNING balance, reserved
+            ''', (admin_id, location, asset, value))
+        balance, reserved = c.fetchone()
+        conn.commit()
+    finally:
+        conn.close()
+    index.set(admin_id, location, asset, balance - reserved)
+    notify('cash', (admin_id, location, asset, balance - reserved))
+    logger.info(f"Наличные админа {admin_id} в {location}: {asset} = {balance} (резерв {reserved})")
+    return balance, reserved
+
+
+def drop_cash(admin_id, location, asset):
+    conn = get_connection()
+    try:
+        deleted = conn.execute('DELETE FROM inventory WHERE admin_id = ? AND location = ? AND asset = ?',
+                               (admin_id, location, asset)).rowcount
+        conn.commit()
+    finally:
+        conn.close()
+    index.discard(admin_id, location, asset)
+    notify('cash', (admin_id, location, asset, None))
+    return bool(deleted)
+
+
+def list_cash(admin_id):
+    conn = get_connection()
+    try:
+        return conn.execute('SELECT location, asset, balance, reserved FROM inventory WHERE admin_id = ? '
+                            'ORDER BY location, asset', (admin_id,)).fetchall()
+    finally:
+        conn.close()
+
+
+CASH_USAGE = (
+    "Наличные по локациям (локации без нужной суммы скрываются из меню клиента):\n"
+    "/cash — остатки\n"
+    "/cash Морджим Рупии (нал) 500000 — задать остаток\n"
+    "/cash Морджим Рупии (нал) +100000 — пополнить (или -50000 — изъять)\n"
+    "/cash Морджим Рупии (нал) off — не учитывать остаток"
+)
+
+
+def parse_cash_args(args, locations, assets):
+    """(локация, актив, значение) из аргументов; названия могут быть из нескольких слов."""
+    if len(args) < 3:
+        raise ValueError("не хватает аргументов")
+    location = next((' '.join(args[:k]) for k in range(len(args) - 2, 0, -1) if ' '.join(args[:k]) in locations), None)
+    if location is None:
+        raise ValueError("локация не найдена")
+    asset = ' '.join(args[len(location.split()):-1])
+    if asset not in assets:
+        raise ValueError(f"валюта «{asset}» не выдаётся ни в одной паре; доступны: {', '.join(sorted(assets))}")
+    return location, asset, args[-1]
+
+
+async def cash_command(update, context):
+    user_id = update.message.from_user.id
+    if not is_active_admin(user_id):
+        await update.message.reply_text("Эта команда доступна только администраторам!")
+        return
+    args = context.args or []
+    if not args:
+        lines = []
+        for location, asset, balance, reserved in list_cash(user_id):
+            lines.append(f"{location} · {asset}: {format_amount(from_minor(asset, balance))}, "
+                         f"в резерве {format_amount(from_minor(asset, reserved))}, "
+                         f"доступно {format_amount(from_minor(asset, balance - reserved))}")
+        await update.message.reply_text("\n".join((lines or ["Остатки не заданы — наличные не учитываются."]) + ["", CASH_USAGE]))
+        return
+
+    admin_data = get_admin_data(user_id)
+    assets = {split_pair(label)[1] for label in admin_data['pairs']}
+    try:
+        location, asset, value = parse_cash_args(args, admin_data['locations'], assets)
+        if value.lower() == 'off':
+            drop_cash(user_id, location, asset)
+            await update.message.reply_text(f"Остаток {asset} в «{location}» больше не учитывается.")
+            return
+        relative = value[0] in '+-'
+        amount = to_minor(asset, value)
+    except ValueError as e:
+        await update.message.reply_text(f"Ошибка: {str(e)}\n\n{CASH_USAGE}")
+        return
+    try:
+        balance, reserved = set_cash(user_id, location, asset, amount, relative)
+    except sqlite3.IntegrityError:
+        await update.message.reply_text("Остаток не может стать отрицательным.")
+        return
+    await update.message.reply_text(
+        f"{location} · {asset}: остаток {format_amount(from_minor(asset, balance))}, "
+        f"доступно {format_amount(from_minor(asset, balance - reserved))}"
+    )
@@ -0,0 +1,194 @@
+import asyncio
+import logging
+import sqlite3
+import time
+from datetime import datetime
+
+import pytz
+
+from utils import get_connection
+
+logger = logging.getLogger(__name__)
+
+# Настройки по умолчанию; переопределяются секцией "maintenance" в config.json
+DEFAULTS = {
+    'interval': 3600,  # 0 — только по команде
+    'budget': 2.0,  # секунд на прогон: очистка и вакуум останавливаются, когда время вышло
+    'batch': 500,  # строк за одну транзакцию удаления
+    'vacuum_pages': 256,  # страниц за один шаг incremental_vacuum
+    # Перевод базы в auto_vacuum=INCREMENTAL — полный VACUUM: переписывает файл и держит эксклюзивную
+    # блокировку, писатели (и все процессы при WORKERS>1) ждут. По умолчанию — только командой
+    # /maintenance vacuum; True — разрешить плановому прогону
+    'convert': False,
+}
+
+last_run = {}
+_lock = asyncio.Lock()
+_warned = False
+
+
+def maintenance_settings():
+    from bot_config import bot_config
+    return dict(DEFAULTS, **(bot_config.get('maintenance') or {}))
+
+
+def purge_expired_otps(conn, deadline, batch):
+    """Удаляет просроченные коды пачками по индексу idx_otps_expiry; соединение в автокоммите,
+    так что каждая пачка — своя короткая транзакция и писатели не ждут всю очистку."""
+    now = datetime.now(pytz.UTC).strftime('%Y-%m-%d %H:%M:%S')
+    deleted = 0
+    while time.monotonic() < deadline:
+        count = conn.execute('DELETE FROM otps WHERE rowid IN (SELECT rowid FROM otps WHERE expiry < ? LIMIT ?)',
+                             (now, batch)).rowcount
+        deleted += count
+        if count < batch:
+            break
+    return deleted
+
+
+def is_incremental(conn):
+    return conn.execute('PRAGMA auto_vacuum').fetchone()[0] == 2
+
+
+def ensure_incremental_vacuum(conn):
+    """Переводит базу в auto_vacuum=INCREMENTAL: режим вступает в силу только после полного VACUUM."""
+    if is_incremental(conn):
+        return False
+    started = time.perf_counter()
+    conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+    try:
+        conn.execute('VACUUM')
+    except sqlite3.OperationalError as e:
+        # Например, база занята долгим чтением — попробуем в следующий прогон
+        logger.warning(f"Не удалось перевести базу в auto_vacuum=INCREMENTAL: {e}")
+        return False
+    logger.info(f"База переведена в auto_vacuum=INCREMENTAL за {(time.perf_counter() - started) * 1000:.0f} мс")
+    return True
+
+
+def incremental_vacuum(conn, deadline, pages):
+    """Возвращает свободные страницы файлу шагами по pages, пока не кончатся страницы или время."""
+    freed = 0
+    while time.monotonic() < deadline:
+        free = conn.execute('PRAGMA freelist_count').fetchone()[0]
+        if not free:
+            break
+        # execute() делает у этой прагмы один шаг и освобождает одну страницу; executescript доводит её до конца
+        conn.executescript(f'PRAGMA incremental_vacuum({min(free, int(pages))});')
+        freed += min(free, pages)
+    return freed
+
+
+def run_maintenance_once(settings=None, convert=False):
+    """convert — перевести базу в auto_vacuum=INCREMENTAL, если она ещё не в нём (полный VACUUM вне бюджета)."""
+    global _warned
+    settings = settings or maintenance_settings()
+    started = time.perf_counter()
+    deadline = time.monotonic() + float(settings['budget'])
+    conn = get_connection()
+    # isolation_level=None: PRAGMA и VACUUM нельзя выполнять внутри неявной транзакции модуля sqlite3
+    conn.isolation_level = None
+    try:
+        page_size = conn.execute('PRAGMA page_size').fetchone()[0]
+        size_before = conn.execute('PRAGMA page_count').fetchone()[0] * page_size
+        report = {'otps': purge_expired_otps(conn, deadline, int(settings['batch']))}
+        report['converted'] = ensure_incremental_vacuum(conn) if convert or settings['convert'] else False
+        report['incremental'] = is_incremental(conn)
+        if not report['incremental'] and not _warned:
+            _warned = True
+            logger.warning("Инкрементальный вакуум недоступен: база не в auto_vacuum=INCREMENTAL. "
+                           "Перевести её — командой /maintenance vacuum (полный VACUUM, запись на это время встанет)")
+        # PRAGMA optimize запускает ANALYZE только для таблиц, где статистика устарела;
+        # analysis_limit ограничивает число просматриваемых строк индекса
+        conn.execute('PRAGMA analysis_limit = 1000')
+        conn.execute('PRAGMA optimize')
+        # Без auto_vacuum=INCREMENTAL прагма ничего не освобождает, и цикл впустую съел бы весь бюджет
+        report['vacuum_pages'] = (incremental_vacuum(conn, deadline, int(settings['vacuum_pages']))
+                                  if report['incremental'] else 0)
+        size_after = conn.execute('PRAGMA page_count').fetchone()[0] * page_size
+        report['free_pages'] = conn.execute('PRAGMA freelist_count').fetchone()[0]
+    finally:
+        conn.close()
+    report['reclaimed'] = size_before - size_after
+    report['size'] = size_after
+    report['elapsed_ms'] = round((time.perf_counter() - started) * 1000, 1)
+    report['at'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    logger.info(f"Обслуживание базы: {report}")
+    return report
+
+
+def drop_empty_conversation_data(application):
+    """PTB держит словарь user_data/chat_data на каждого, кто хоть раз писал боту; пустые выкидываем."""
+    dropped = 0
+    for user_id, data in list(application.user_data.items()):
+        if not data:
+            application.drop_user_data(user_id)
+            dropped += 1
+    for chat_id, data in list(application.chat_data.items()):
+        if not data:
+            application.drop_chat_data(chat_id)
+            dropped += 1
+    return dropped
+
+
+async def run_maintenance(application, convert=False):
+    async with _lock:
+        report = await asyncio.to_thread(run_maintenance_once, None, convert)
+        # Словари PTB меняются обработчиками, поэтому чистим их в цикле событий, а не в потоке
+        report['conversation_data'] = drop_empty_conversation_data(application)
+    last_run.clear()
+    last_run.update(report)
+    return report
+
+
+async def run_maintenance_loop(application):
+    interval = int(maintenance_settings()['interval'])
+    if interval <= 0:
+        return
+    logger.info(f"Фоновая задача обслуживания базы запущена, интервал {interval} с")
+    while not application.stop_event.is_set():
+        try:
+            await run_maintenance(application)
+        except Exception as e:
+            logger.error(f"Ошибка обслуживания базы: {str(e)}")
+        for _ in range(interval):
+            if application.stop_event.is_set():
+                break
+            await asyncio.sleep(1)
+    logger.info("Фоновая задача обслуживания базы завершена")
+
+
+def format_report(report):
+    text = (f"Обслуживание базы за {report['elapsed_ms']} мс: удалено просроченных кодов {report['otps']}, "
+            f"пустых данных диалогов {report['conversation_data']}, возвращено страниц {report['vacuum_pages']} "
+            f"({max(0, report['reclaimed']) / 1024:.1f} КБ), размер базы {report['size'] / 1024:.1f} КБ")
+    if report['free_pages'] and report['incremental']:
+        text += f", ещё свободно страниц: {report['free_pages']} (доберём в следующий прогон)"
+    if report['converted']:
+        text += "\nБаза переведена в режим инкрементального вакуума."
+    elif not report['incremental']:
+        text += ("\nИнкрементальный вакуум выключен: база не в auto_vacuum=INCREMENTAL. Перевести — "
+                 "/maintenance vacuum (полный VACUUM, запись на это время встанет).")
+    return text
+
+
+async def maintenance_command(update, context):
+    from bot_config import bot_config
+    user_id = update.message.from_user.id
+    if str(user_id) != bot_config["owner_id"]:
+        await update.message.reply_text("Эта команда только для владельца!")
+        return
+    args = [arg.lower() for arg in context.args or []]
+    if args not in ([], ['vacuum']):
+        await update.message.reply_text("Используйте: /maintenance или /maintenance vacuum")
+        return
+    if _lock.locked():
+        await update.message.reply_text("Обслуживание уже идёт, дождись результата.")
+        return
+    try:
+        report = await run_maintenance(context.application, convert=args == ['vacuum'])
+    except Exception as e:
+        logger.error(f"Ошибка обслуживания базы по команде: {str(e)}")
+        await update.message.reply_text(f"Ошибка обслуживания: {str(e)}")
+        return
+    await update.message.reply_text(format_report(report))
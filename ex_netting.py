@@ -0,0 +1,173 @@
+import heapq
+import logging
+import time
+from collections import defaultdict
+from decimal import Decimal
+
+from ex_inventory import order_closed
+from ex_quotes import format_amount, split_pair, to_decimal
+from ex_shards import notify
+from utils import get_open_orders, is_active_admin, set_order_status
+
+logger = logging.getLogger(__name__)
+
+# Старые открытые заявки в зачёт не предлагаем: скорее всего, они уже закрыты вне бота
+NETTING_WINDOW = 24 * 3600
+MAX_PROPOSALS = 5
+
+
+class NettingBook:
+    """Открытые заявки одного админа: по книге на направление (отдаёт, получает) и нетто-позиция."""
+
+    def __init__(self, admin_id, window=NETTING_WINDOW):
+        self.admin_id = admin_id
+        self.window = window
+        # (актив, который клиент отдаёт, актив, который получает) → куча (-result, created_at, order_id)
+        self.books = defaultdict(list)
+        self.orders = {}
+        # актив → сколько админ получит минус сколько должен выдать по открытым заявкам
+        self.exposure = defaultdict(Decimal)
+
+    def add(self, order):
+        base, quote = split_pair(order['operation'])
+        order = dict(order, amount=to_decimal(order['amount']), result=to_decimal(order['result']), assets=(base, quote))
+        self.orders[order['order_id']] = order
+        heapq.heappush(self.books[(base, quote)], (-order['result'], order['created_at'], order['order_id']))
+        self.exposure[base] += order['amount']
+        self.exposure[quote] -= order['result']
+        return order
+
+    def close(self, order_id):
+        # Из кучи запись не вынимаем: устаревшие записи отбрасываются при следующем просмотре
+        order = self.orders.pop(order_id, None)
+        if order is not None:
+            base, quote = order['assets']
+            self.exposure[base] -= order['amount']
+            self.exposure[quote] += order['result']
+        return order
+
+    def propose(self, order_id, limit=MAX_PROPOSALS):
+        """Встречные заявки для order_id: крупнейшие первыми, пока не покроют её сумму.
+        Каждая снятая с кучи запись стоит O(log n); годные возвращаются обратно."""
+        order = self.orders.get(order_id)
+        if order is None:
+            return [], Decimal(0)
+        base, quote = order['assets']
+        heap = self.books.get((quote, base))
+        if not heap:
+            return [], Decimal(0)
+        cutoff = time.time() - self.window
+        remaining, picks, keep = order['amount'], [], []
+        while heap and remaining > 0 and len(picks) < limit:
+            entry = heapq.heappop(heap)
+            counterpart = self.orders.get(entry[2])
+            if counterpart is None:
+                continue
+            if counterpart['created_at'] < cutoff:
+                keep.append(entry)  # в окне её уже нет, но заявка ещё открыта — пусть остаётся в книге
+                continue
+            keep.append(entry)
+            if counterpart['user_id'] == order['user_id']:
+                continue
+            picks.append(counterpart)
+            remaining -= counterpart['result']
+        for entry in keep:
+            heapq.heappush(heap, entry)
+        netted = min(order['amount'], sum((c['result'] for c in picks), Decimal(0)))
+        return picks, netted
+
+    def exposure_lines(self):
+        return [f"{asset}: {'+' if value > 0 else ''}{format_amount(value)}"
+                for asset, value in sorted(self.exposure.items()) if value]
+
+
+# Книги локальны для процесса; в WORKERS>1 заявки админа приходят через разные обработчики, поэтому каждое
+# изменение рассылается notify('netting') и остальные пересобирают книгу из базы при следующем обращении
+_books = {}
+
+
+def get_book(admin_id):
+    """Книга админа; при первом обращении собирается из открытых заявок в базе."""
+    book = _books.get(admin_id)
+    if book is None:
+        book = NettingBook(admin_id)
+        for order in get_open_orders(admin_id, time.time() - book.window):
+            book.add(order)
+        _books[admin_id] = book
+    return book
+
+
+def register_order(admin_id, order):
+    """Добавляет новую заявку в книгу и возвращает текст предложения для админа или None."""
+    book = get_book(admin_id)
+    if order['order_id'] not in book.orders:
+        book.add(order)
+    notify('netting', admin_id)
+    picks, netted = book.propose(order['order_id'])
+    if not picks:
+        return None
+    base, _ = book.orders[order['order_id']]['assets']
+    lines = [f"Можно взаимозачесть заявку №{order['order_id']} ({order['operation']}, {format_amount(order['amount'])}):"]
+    for counterpart in picks:
+        lines.append(f"• №{counterpart['order_id']} {counterpart['operation']}: "
+                     f"{format_amount(counterpart['amount'])} → {format_amount(counterpart['result'])}")
+    lines.append(f"Внешняя конвертация сократится на {format_amount(netted)} ({base}).")
+    lines.append("Закрыть заявки: /done " + " ".join(str(o) for o in [order['order_id']] + [c['order_id'] for c in picks]))
+    exposure = book.exposure_lines()
+    if exposure:
+        lines.append("Нетто-позиция по открытым заявкам: " + ", ".join(exposure))
+    return "\n".join(lines)
+
+
+def close_orders(admin_id, order_ids):
+    book = _books.get(admin_id)
+    if book is not None:
+        for order_id in order_ids:
+            book.close(order_id)
+    notify('netting', admin_id)
+
+
+def drop_book(admin_id):
+    _books.pop(admin_id, None)
+
+
+async def _close_command(update, context, status, command, verb):
+    user_id = update.message.from_user.id
+    if not is_active_admin(user_id):
+        await update.message.reply_text("Эта команда доступна только администраторам!")
+        return
+    args = context.args or []
+    if not args or not all(a.lstrip('№#').isdigit() for a in args):
+        await update.message.reply_text(f"Используйте: /{command} <номер заявки> [номер ...]")
+        return
+    order_ids = [int(a.lstrip('№#')) for a in args]
+    closed = set_order_status(user_id, order_ids, status)
+    close_orders(user_id, closed)
+    order_closed(user_id)
+    missing = [o for o in order_ids if o not in closed]
+    text = f"{verb} заявок: {len(closed)}"
+    if missing:
+        text += f"\nНе найдены среди открытых: {', '.join(map(str, missing))}"
+    await update.message.reply_text(text)
+
+
+async def done_command(update, context):
+    # Выданные наличные списываются с остатка локации
+    await _close_command(update, context, 'done', 'done', "Закрыто")
+
+
+async def reject_command(update, context):
+    # Резерв наличных возвращается в доступные
+    await _close_command(update, context, 'cancelled', 'reject', "Отменено")
+
+
+async def exposure_command(update, context):
+    user_id = update.message.from_user.id
+    if not is_active_admin(user_id):
+        await update.message.reply_text("Эта команда доступна только администраторам!")
+        return
+    book = get_book(user_id)
+    lines = book.exposure_lines()
+    await update.message.reply_text(
+        f"Открытых заявок: {len(book.orders)}\n" + ("\n".join(lines) if lines else "Нетто-позиция нулевая.")
+    )
@@ -1,20 +1,42 @@
 import asyncio
+import io
 import logging
+import sqlite3
 from datetime import datetime, timedelta
 import pytz
 import secrets
-from utils import get_otp_data, save_otp_data, delete_otp, get_user_data, save_user_data
+from utils import claim_otp, insert_otp_batch, save_otp_data, get_user_data, save_user_data
 import json
 
 logger = logging.getLogger(__name__)
 
 OWNER_ID = '669497764'
 
+# 4 байта — 8 hex-символов; совпадения всё равно отсекаются уникальным индексом при выдаче
+OTP_BYTES = 4
+MAX_BATCH = 500
+# Столько кодов ещё помещается в одно сообщение; больше — только файлом
+INLINE_CODES = 10
+
 def generate_otp(days):
-    otp = secrets.token_hex(3).upper()
+    otp = secrets.token_hex(OTP_BYTES).upper()
     expiry = datetime.now(pytz.UTC) + timedelta(days=days)
     return otp, expiry
 
+def issue_otps(count, days):
+    """Выдаёт count уникальных кодов на days дней одной транзакцией; возвращает (коды, срок)."""
+    expiry = datetime.now(pytz.UTC) + timedelta(days=days)
+    codes = insert_otp_batch(count, lambda: secrets.token_hex(OTP_BYTES).upper(),
+                             expiry.strftime('%Y-%m-%d %H:%M:%S'), days)
+    return codes, expiry
+
+def restore_otp(otp_code, otp_data):
+    # Активация не удалась после того, как код уже забран, — возвращаем его, чтобы можно было повторить
+    try:
+        save_otp_data(otp_code, *otp_data)
+    except sqlite3.Error as e:
+        logger.error(f"Не удалось вернуть OTP {otp_code} после неудачной активации: {e}")
+
 async def activate_otp(update, context):
     logger.info("Получена команда /otp")
     user_id = update.message.from_user.id
@@ -25,7 +47,8 @@ async def activate_otp(update, context):
         return
 
     otp_code = args[0].strip()
-    otp_data = get_otp_data(otp_code)
+    # Код забирается сразу: повторная или одновременная активация того же кода его уже не найдёт
+    otp_data = claim_otp(otp_code)
 
     if not otp_data:
         await update.message.reply_text("Неверный или истёкший код OTP!")
@@ -37,7 +60,6 @@ async def activate_otp(update, context):
 
     if datetime.now(pytz.UTC) > expiry_date:
         await update.message.reply_text("Срок действия этого OTP-кода истёк.")
-        delete_otp(otp_code)
         return
 
     # Получаем текущие данные пользователя
@@ -69,6 +91,7 @@ async def activate_otp(update, context):
         logger.debug(f"Данные сохранены: user_id={user_id}, active_order_dict={active_order_dict}")
     except Exception as e:
         logger.error(f"Ошибка при сохранении данных: {str(e)}")
+        restore_otp(otp_code, otp_data)
         await update.message.reply_text("Ошибка при сохранении данных. Попробуйте снова или обратитесь в поддержку.")
         return
 
@@ -78,6 +101,7 @@ async def activate_otp(update, context):
     
     if not active_order_check:
         logger.error(f"После сохранения active_order пустой для user_id={user_id}")
+        restore_otp(otp_code, otp_data)
         await update.message.reply_text("Ошибка при активации OTP. Попробуйте снова или обратитесь в поддержку.")
         return
 
@@ -85,16 +109,15 @@ async def activate_otp(update, context):
         active_order_check_dict = json.loads(active_order_check) if isinstance(active_order_check, str) else active_order_check
         if not isinstance(active_order_check_dict, dict) or 'admin_expiry' not in active_order_check_dict:
             logger.error(f"Ошибка в проверке сохраненных данных: active_order_check_dict={active_order_check_dict}")
+            restore_otp(otp_code, otp_data)
             await update.message.reply_text("Ошибка проверки данных после активации. Повторно активируйте OTP.")
             return
     except (json.JSONDecodeError, TypeError) as e:
         logger.error(f"Ошибка парсинга active_order_check: {e}")
+        restore_otp(otp_code, otp_data)
         await update.message.reply_text("Ошибка проверки данных после активации. Попробуйте снова или обратитесь в поддержку.")
         return
 
-    # Если все проверки прошли успешно, удаляем OTP и возвращаем успех
-    delete_otp(otp_code)
-
     # Возвращаем меню клиента с кнопкой "Админка"
     from exbot import build_client_menu
     reply_markup = build_client_menu(user_id)
@@ -140,3 +163,29 @@ async def check_subscription(update, context):
         await update.message.reply_text(text)
     elif update.callback_query:
         await update.callback_query.message.reply_text(text)
+
+async def otp_batch_command(update, context):
+    from bot_config import bot_config
+    user_id = update.message.from_user.id
+    if str(user_id) != bot_config["owner_id"]:
+        await update.message.reply_text("Эта команда только для владельца!")
+        return
+    args = context.args or []
+    if len(args) != 2 or not all(a.isdigit() for a in args) or not 1 <= int(args[0]) <= MAX_BATCH or not 1 <= int(args[1]) <= 365:
+        await update.message.reply_text(f"Используйте: /otps <количество 1–{MAX_BATCH}> <срок в днях 1–365>\nНапример: /otps 20 30")
+        return
+    count, days = int(args[0]), int(args[1])
+    try:
+        codes, expiry = await asyncio.to_thread(issue_otps, count, days)
+    except sqlite3.Error as e:
+        await update.message.reply_text(f"Не удалось выдать коды: {str(e)}")
+        return
+    lines = [f"/otp {otp}" for otp in codes]
+    header = f"Сгенерировано OTP: {len(codes)}\nСрок действия: {days} дн. (действует до {expiry.strftime('%Y-%m-%d %H:%M')} UTC)"
+    if len(codes) <= INLINE_CODES:
+        await update.message.reply_text(header + "\n\n" + "\n".join(f"`{line}`" for line in lines), parse_mode='Markdown')
+    else:
+        await update.message.reply_text(header + "\nСписок — в файле ниже.")
+    document = io.BytesIO(("\n".join(lines) + "\n").encode('utf-8'))
+    await context.bot.send_document(chat_id=user_id, document=document,
+                                    filename=f"otp_{days}d_{datetime.now().strftime('%Y%m%d_%H%M')}.txt")
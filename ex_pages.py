@@ -0,0 +1,72 @@
+import re
+
+from telegram import InlineKeyboardButton
+
+from ex_callbacks import encode
+from ex_render import RenderCache
+
+# Кнопок с элементами на странице: у операторов бывают сотни локаций, а клавиатура
+# на все сразу упирается в лимиты Telegram и целиком пересылается на каждое нажатие
+PAGE_SIZE = 12
+# Сколько выбранных названий перечислять в заголовке меню; дальше — только число
+SHOW_NAMES = 20
+MAX_PREFIX = 50
+
+# (admin_id, меню, версия профиля, фильтр, начало страницы) → (текст, клавиатура).
+# Любое изменение профиля меняет версию, так что устаревшие страницы просто вытесняются
+pages = RenderCache(size=1000)
+
+
+def search(items, prefix):
+    """[(индекс в профиле, название)] — всё или только названия, начинающиеся с prefix, без учёта регистра."""
+    if not prefix:
+        return list(enumerate(items))
+    prefix = prefix.casefold()
+    return [(index, name) for index, name in enumerate(items) if name.casefold().startswith(prefix)]
+
+
+def page(found, offset):
+    """(начало страницы, её элементы); offset выравнивается по странице и не выходит за последнюю."""
+    last = max(0, (len(found) - 1) // PAGE_SIZE * PAGE_SIZE)
+    offset = min(max(0, offset - offset % PAGE_SIZE), last)
+    return offset, found[offset:offset + PAGE_SIZE]
+
+
+def nav_row(action, offset, total):
+    """Кнопки листания: в callback_data — начало соседней страницы. Пусто, если всё влезло на одну."""
+    if total <= PAGE_SIZE:
+        return []
+    row = []
+    if offset > 0:
+        row.append(InlineKeyboardButton("◀️", callback_data=encode(action, offset - PAGE_SIZE)))
+    row.append(InlineKeyboardButton(f"{offset // PAGE_SIZE + 1}/{(total + PAGE_SIZE - 1) // PAGE_SIZE}",
+                                    callback_data=encode('noop')))
+    if offset + PAGE_SIZE < total:
+        row.append(InlineKeyboardButton("▶️", callback_data=encode(action, offset + PAGE_SIZE)))
+    return row
+
+
+def selection_text(active):
+    if not active:
+        return "Пока не выбрано"
+    if len(active) <= SHOW_NAMES:
+        return ", ".join(str(name) for name in active)
+    return f"{len(active)} шт."
+
+
+def search_hint(total, prefix, found):
+    if prefix:
+        # Меню отправляется с parse_mode='Markdown': введённый текст экранируем
+        shown = re.sub(r'([_*`\[])', r'\\\1', prefix)
+        return f"\n🔎 Начинается на «{shown}»: найдено {found}. Пришли другое начало названия или сбрось фильтр."
+    if total > PAGE_SIZE:
+        return "\n🔎 Чтобы найти, пришли начало названия."
+    return ""
+
+
+def cached(key, build):
+    rendered = pages.get(key)
+    if rendered is None:
+        rendered = build()
+        pages.put(key, rendered)
+    return rendered
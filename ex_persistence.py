@@ -0,0 +1,168 @@
+import asyncio
+import json
+import logging
+import time
+from collections import defaultdict
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+import ex_sessions
+from utils import get_connection
+
+logger = logging.getLogger(__name__)
+
+# Настройки по умолчанию; переопределяются секцией "persistence" в config.json
+DEFAULTS = {
+    'enabled': True,
+    'update_interval': 10,  # секунд между сбросами на диск; всё, что изменилось за это время, — одной транзакцией
+}
+
+
+def persistence_settings(config):
+    return dict(DEFAULTS, **(config.get('persistence') or {}))
+
+
+def write_rows(full, states_only):
+    """full: [(user_id, data, states, seen_at)], states_only: [(user_id, states, seen_at)]; одна транзакция."""
+    conn = get_connection()
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        now = int(time.time())
+        conn.executemany('INSERT OR REPLACE INTO sessions (user_id, data, states, seen_at, saved_at) VALUES (?, ?, ?, ?, ?)',
+                         [(*row, now) for row in full])
+        # Изменилось только состояние диалога (например, его сбросил таймаут) — user_data в строке не трогаем
+        conn.executemany('''
+            INSERT INTO sessions (user_id, data, states, seen_at, saved_at) VALUES (?, '{}', ?, ?, ?)
+            ON CONFLICT(user_id) DO UPDATE SET states = excluded.states, seen_at = excluded.seen_at,
+                saved_at = excluded.saved_at
+        ''', [(*row, now) for row in states_only])
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+class SqlitePersistence(BasePersistence):
+    """Состояния диалогов и user_data в таблице sessions — той же, куда ex_sessions вытесняет сессии.
+
+    PTB сам помечает пользователей, от которых пришли апдейты, и диалоги, сменившие состояние, и раз в
+    update_interval отдаёт их сюда; здесь они копятся и пишутся одной транзакцией на весь интервал.
+    При старте в память ничего не загружается: сессию поднимает ex_sessions.restore при первом апдейте
+    пользователя, так что после перезапуска память не забивается давно ушедшими пользователями.
+    """
+
+    def __init__(self, update_interval=DEFAULTS['update_interval']):
+        super().__init__(store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+                         update_interval=update_interval)
+        self.dirty_data = {}
+        self.dirty_states = set()
+        self._writer = None
+
+    async def get_user_data(self):
+        return {}
+
+    async def get_chat_data(self):
+        return {}
+
+    async def get_bot_data(self):
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name):
+        return {}
+
+    async def update_user_data(self, user_id, data):
+        self.dirty_data[user_id] = data
+        self._schedule()
+
+    async def update_conversation(self, name, key, new_state):
+        self.dirty_states.add(key[-1])
+        self._schedule()
+
+    async def drop_user_data(self, user_id):
+        # Данные убирают из памяти при вытеснении (строку только что записал ex_sessions) и когда они пусты;
+        # в обоих случаях строку оставляем — устаревшие удаляются по сроку
+        pass
+
+    async def update_chat_data(self, chat_id, data):
+        pass
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def drop_chat_data(self, chat_id):
+        pass
+
+    async def refresh_user_data(self, user_id, user_data):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    def _schedule(self):
+        # update_persistence вызывает update_* пачкой через gather; запись стартует, когда пачка собрана
+        if self._writer is None or self._writer.done():
+            self._writer = asyncio.create_task(self._write())
+
+    def _take_rows(self):
+        data, touched = self.dirty_data, self.dirty_states
+        self.dirty_data, self.dirty_states = {}, set()
+        by_user = defaultdict(list)
+        for name, handler in ex_sessions.handlers.items():
+            for key, state in handler._conversations.items():
+                if isinstance(state, (int, str)):
+                    by_user[key[-1]].append([name, list(key), state])
+        full, states_only = [], []
+        for user_id in set(data) | touched:
+            seen = ex_sessions.last_seen.get(user_id)
+            if seen is None:
+                # Сессия уже вытеснена, её строку записал ex_sessions
+                continue
+            states = json.dumps(by_user.get(user_id, []))
+            if user_id not in data:
+                states_only.append((user_id, states, int(seen)))
+                continue
+            try:
+                full.append((user_id, json.dumps(data[user_id], ensure_ascii=False), states, int(seen)))
+            except (TypeError, ValueError) as e:
+                logger.warning(f"user_data пользователя user_id={user_id} не сохранить в базу: {str(e)}")
+                states_only.append((user_id, states, int(seen)))
+        return data, touched, full, states_only
+
+    async def _write(self):
+        await asyncio.sleep(0)
+        while self.dirty_data or self.dirty_states:
+            data, touched, full, states_only = self._take_rows()
+            if not full and not states_only:
+                continue
+            started = time.perf_counter()
+            try:
+                await asyncio.to_thread(write_rows, full, states_only)
+            except Exception as e:
+                logger.error(f"Ошибка записи сессий в базу: {str(e)}")
+                # Вернуть в очередь до следующего интервала, не затирая более свежие данные
+                for user_id, value in data.items():
+                    self.dirty_data.setdefault(user_id, value)
+                self.dirty_states |= touched
+                return
+            ex_sessions.counters['persisted'] += len(full) + len(states_only)
+            ex_sessions.counters['flushes'] += 1
+            logger.debug(f"Сессии сохранены: {len(full) + len(states_only)} строк за "
+                         f"{(time.perf_counter() - started) * 1000:.1f} мс")
+
+    async def flush(self):
+        # Остановка приложения: последний update_persistence уже отдал всё сюда — дожидаемся записи
+        if self._writer is not None:
+            await self._writer
+        if self.dirty_data or self.dirty_states:
+            await self._write()
@@ -0,0 +1,280 @@
+import asyncio
+import copy
+import json
+import logging
+import sqlite3
+import time
+from datetime import datetime
+
+import pytz
+from telegram.error import BadRequest
+
+from ex_history import record_many
+from ex_quotes import invalidate
+from ex_shards import notify
+from utils import get_admin_data, get_connection, get_propagate_optout, is_active_admin, save_propagate_optout
+
+logger = logging.getLogger(__name__)
+
+# Поле профиля → ключ дефолта в bot_config
+FIELDS = {
+    'rates': 'default_rates',
+    'pairs': 'default_pairs',
+    'locations': 'default_locations',
+}
+CHUNK_SIZE = 200
+PROGRESS_INTERVAL = 2.0
+
+_job = None
+
+
+def merge_defaults(row, fields, defaults):
+    """Дописывает дефолты в профиль: курсы дефолтных пар перезаписываются,
+    пары и локации только добавляются (свои у админа не трогаем).
+    Возвращает новые столбцы или None, если менять нечего."""
+    data = copy.deepcopy(row)
+    if 'pairs' in fields:
+        for pair in defaults['pairs']:
+            if pair not in data['pairs']:
+                data['pairs'].append(pair)
+                data['active_pairs'].append(pair)
+            if pair not in data['rates'] and pair in defaults['rates']:
+                data['rates'][pair] = defaults['rates'][pair]
+    if 'rates' in fields:
+        # Только для пар, которые у админа есть: удалённые им пары курсами не воскрешаем
+        for pair, rate in defaults['rates'].items():
+            if pair in data['pairs']:
+                data['rates'][pair] = rate
+    if 'locations' in fields:
+        for location in defaults['locations']:
+            if location not in data['locations']:
+                data['locations'].append(location)
+                data['active_locations'].append(location)
+    return data if data != row else None
+
+
+def active_admin_ids():
+    """Админы с действующей подпиской (по admin_expiry в users) плюс владелец."""
+    from bot_config import bot_config
+    now = datetime.now(pytz.UTC)
+    ids = {int(bot_config["owner_id"])}
+    conn = get_connection()
+    try:
+        c = conn.cursor()
+        c.execute("SELECT user_id, active_order FROM users WHERE active_order LIKE '%admin_expiry%'")
+        for user_id, active_order in c.fetchall():
+            try:
+                expiry = datetime.strptime(json.loads(active_order)['admin_expiry'], '%Y-%m-%d %H:%M:%S')
+            except (ValueError, KeyError, TypeError):
+                continue
+            if expiry.replace(tzinfo=pytz.UTC) > now:
+                ids.add(user_id)
+    finally:
+        conn.close()
+    return sorted(ids)
+
+
+class PropagationJob:
+    """Фоновая раскатка дефолтов по профилям админов пачками по CHUNK_SIZE, каждая — своя транзакция."""
+
+    def __init__(self, fields, admin_ids=None, chunk_size=CHUNK_SIZE):
+        from bot_config import bot_config
+        self.fields = [f for f in FIELDS if f in fields]
+        # Снимок дефолтов на момент запуска: reload_config посреди раскатки её не меняет
+        self.defaults = {field: copy.deepcopy(bot_config[key]) for field, key in FIELDS.items()}
+        self.admin_ids = sorted(set(admin_ids)) if admin_ids is not None else None
+        self.chunk_size = chunk_size
+        self.total = self.scanned = self.updated = self.unchanged = self.opted_out = 0
+        self.started = self.finished = None
+        self.cancelled = False
+        self.error = None
+
+    def count_total(self):
+        if self.admin_ids is not None:
+            return len(self.admin_ids)
+        conn = get_connection()
+        try:
+            return conn.execute('SELECT COUNT(*) FROM admins').fetchone()[0]
+        finally:
+            conn.close()
+
+    def process_chunk(self, cursor_value):
+        """Обрабатывает следующую пачку; возвращает новый курсор или None, если админы кончились."""
+        columns = 'admin_id, rates, locations, active_locations, pairs, active_pairs, propagate_optout'
+        conn = get_connection()
+        try:
+            c = conn.cursor()
+            c.execute('BEGIN IMMEDIATE')
+            if self.admin_ids is not None:
+                ids = self.admin_ids[cursor_value:cursor_value + self.chunk_size]
+                if not ids:
+                    conn.rollback()
+                    return None
+                c.execute(f'SELECT {columns} FROM admins WHERE admin_id IN ({",".join("?" * len(ids))})', ids)
+                next_cursor = cursor_value + len(ids)
+            else:
+                c.execute(f'SELECT {columns} FROM admins WHERE admin_id > ? ORDER BY admin_id LIMIT ?',
+                          (cursor_value, self.chunk_size))
+            rows = c.fetchall()
+            if self.admin_ids is None:
+                if not rows:
+                    conn.rollback()
+                    return None
+                next_cursor = rows[-1][0]
+            updates = []
+            for admin_id, rates, locations, active_locations, pairs, active_pairs, optout in rows:
+                self.scanned += 1
+                fields = [f for f in self.fields if f not in (json.loads(optout) if optout else [])]
+                if not fields:
+                    self.opted_out += 1
+                    continue
+                row = {
+                    'rates': json.loads(rates) if rates else {},
+                    'locations': json.loads(locations) if locations else [],
+                    'active_locations': json.loads(active_locations) if active_locations else [],
+                    'pairs': json.loads(pairs) if pairs else [],
+                    'active_pairs': json.loads(active_pairs) if active_pairs else [],
+                }
+                data = merge_defaults(row, fields, self.defaults)
+                if data is None:
+                    self.unchanged += 1
+                    continue
+                updates.append((json.dumps(data['rates']), json.dumps(data['locations']),
+                                json.dumps(data['active_locations']), json.dumps(data['pairs']),
+                                json.dumps(data['active_pairs']), admin_id))
+            if updates:
+                c.executemany('''
+                    UPDATE admins SET rates = ?, locations = ?, active_locations = ?, pairs = ?, active_pairs = ?,
+                        version = COALESCE(version, 0) + 1
+                    WHERE admin_id = ?
+                ''', updates)
+            conn.commit()
+            self.updated += len(updates)
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+        if updates and 'rates' in self.fields:
+            try:
+                record_many((update[-1], json.loads(update[0])) for update in updates)
+            except sqlite3.Error as e:
+                logger.error(f"Раскатка: не удалось записать историю курсов: {e}")
+        return next_cursor
+
+    def progress_text(self):
+        state = "отменена" if self.cancelled else "ошибка" if self.error else "завершена" if self.finished else "идёт"
+        text = (f"Раскатка дефолтов ({', '.join(self.fields)}) {state}: {self.scanned}/{self.total}\n"
+                f"Обновлено: {self.updated}, без изменений: {self.unchanged}, отказались: {self.opted_out}")
+        if self.finished:
+            text += f"\nЗаняло {self.finished - self.started:.1f} с"
+        if self.error:
+            text += f"\n{self.error}"
+        return text
+
+    async def run(self, bot, chat_id, message_id):
+        self.started = time.monotonic()
+        self.total = await asyncio.to_thread(self.count_total)
+        cursor_value = 0
+        last_report = self.started
+        try:
+            while not self.cancelled:
+                # SQLite — в отдельном потоке; между пачками бот успевает обрабатывать апдейты
+                cursor_value = await asyncio.to_thread(self.process_chunk, cursor_value)
+                if cursor_value is None:
+                    break
+                if time.monotonic() - last_report >= PROGRESS_INTERVAL:
+                    last_report = time.monotonic()
+                    await self.report(bot, chat_id, message_id)
+        except Exception as e:
+            logger.error(f"Ошибка раскатки дефолтов: {str(e)}")
+            self.error = str(e)
+        self.finished = time.monotonic()
+        if self.updated:
+            invalidate()
+            notify('quotes')
+        logger.info(f"Раскатка дефолтов: {self.progress_text()}")
+        await self.report(bot, chat_id, message_id)
+
+    async def report(self, bot, chat_id, message_id):
+        try:
+            await bot.edit_message_text(self.progress_text(), chat_id=chat_id, message_id=message_id)
+        except BadRequest as e:
+            if "Message is not modified" not in str(e):
+                logger.error(f"Не удалось обновить прогресс раскатки: {str(e)}")
+
+
+PROPAGATE_USAGE = (
+    "Раскатка дефолтов из config.json по админам:\n"
+    "/propagate rates pairs locations — всем админам (all — все поля)\n"
+    "/propagate rates active — только админам с действующей подпиской\n"
+    "/propagate pairs 123456 789012 — выбранным админам\n"
+    "/propagate status — прогресс, /propagate cancel — остановить"
+)
+
+
+async def propagate_command(update, context):
+    global _job
+    from bot_config import bot_config
+    user_id = update.message.from_user.id
+    if str(user_id) != bot_config["owner_id"]:
+        await update.message.reply_text("Эта команда только для владельца!")
+        return
+    args = [a.lower() for a in context.args or []]
+    running = _job is not None and _job.finished is None
+
+    if args == ['status']:
+        await update.message.reply_text(_job.progress_text() if _job else "Раскатка ещё не запускалась.")
+        return
+    if args == ['cancel']:
+        if running:
+            _job.cancelled = True
+            await update.message.reply_text("Останавливаю после текущей пачки…")
+        else:
+            await update.message.reply_text("Раскатка не идёт.")
+        return
+
+    fields = list(FIELDS) if 'all' in args else [a for a in args if a in FIELDS]
+    admin_ids = [int(a) for a in args if a.isdigit()]
+    if not fields:
+        await update.message.reply_text(PROPAGATE_USAGE)
+        return
+    if running:
+        await update.message.reply_text("Раскатка уже идёт: /propagate status")
+        return
+    if 'active' in args:
+        admin_ids = await asyncio.to_thread(active_admin_ids)
+    _job = PropagationJob(fields, admin_ids or None)
+    message = await update.message.reply_text(f"Раскатка дефолтов ({', '.join(_job.fields)}) запущена…")
+    logger.info(f"Владелец {user_id} запустил раскатку дефолтов: поля {_job.fields}, "
+                f"админов {'все' if _job.admin_ids is None else len(_job.admin_ids)}")
+    context.application.create_task(_job.run(context.bot, message.chat_id, message.message_id))
+
+
+async def defaults_command(update, context):
+    """Админ отказывается (или снова соглашается) получать дефолты владельца по отдельным полям."""
+    user_id = update.message.from_user.id
+    if not is_active_admin(user_id):
+        await update.message.reply_text("Эта команда доступна только администраторам!")
+        return
+    get_admin_data(user_id)  # профиль должен существовать
+    optout = set(get_propagate_optout(user_id))
+    args = [a.lower() for a in context.args or []]
+    fields = list(FIELDS) if 'all' in args else [a for a in args[1:] if a in FIELDS]
+    if args and args[0] in ('on', 'off') and fields:
+        if args[0] == 'off':
+            optout.update(fields)
+        else:
+            optout.difference_update(fields)
+        save_propagate_optout(user_id, optout)
+    elif args:
+        await update.message.reply_text(
+            "Используйте: /defaults off rates — не получать дефолтные курсы, /defaults on rates — снова получать "
+            "(поля: rates, pairs, locations, all)"
+        )
+        return
+    accepted = [f for f in FIELDS if f not in optout]
+    await update.message.reply_text(
+        f"Дефолты владельца применяются к: {', '.join(accepted) or 'ничему'}\n"
+        f"Отказ: {', '.join(sorted(optout)) or 'нет'}"
+    )
@@ -0,0 +1,278 @@
+import logging
+from bisect import bisect_right
+from dataclasses import dataclass
+from decimal import Decimal, InvalidOperation, ROUND_CEILING, ROUND_DOWN
+from functools import lru_cache
+
+from pytils import numeral
+
+logger = logging.getLogger(__name__)
+
+PAIR_SEPARATOR = '→'
+# Через эти активы выводятся кросс-курсы, если у пары нет прямого курса
+PIVOT_ASSETS = ('USDT',)
+DEFAULT_MAX_AMOUNT = Decimal('1000000000')
+
+
+@dataclass(frozen=True)
+class Currency:
+    code: str
+    forms: tuple  # (1 рубль, 2 рубля, 5 рублей)
+    precision: int  # знаков после запятой в выдаче
+
+
+@dataclass(frozen=True)
+class Pair:
+    label: str
+    base_asset: str  # «Рубли (безнал)» — что клиент отдаёт
+    quote_asset: str  # «Рупии (нал)» — что получает
+    base: Currency
+    quote: Currency
+    min_amount: Decimal
+    max_amount: Decimal
+
+
+@dataclass(frozen=True)
+class Quote:
+    pair: Pair
+    amount: Decimal
+    rate: Decimal
+    result: Decimal
+    derived: bool  # курс выведен через промежуточный актив
+    fee: Decimal = Decimal(0)  # комиссия уровня в валюте выдачи
+
+
+# Корень названия валюты → (код, формы для numeral.choose_plural, точность)
+CURRENCIES = {
+    'рубль': Currency('RUB', ('рубль', 'рубля', 'рублей'), 0),
+    'рупия': Currency('INR', ('рупия', 'рупии', 'рупий'), 0),
+    'донг': Currency('VND', ('донг', 'донга', 'донгов'), 0),
+    'юань': Currency('CNY', ('юань', 'юаня', 'юаней'), 0),
+    'бат': Currency('THB', ('бат', 'бата', 'батов'), 0),
+    'usdt': Currency('USDT', ('USDT', 'USDT', 'USDT'), 2),
+}
+
+CURRENCY_ALIASES = {
+    'рубли': 'рубль', 'рублей': 'рубль', 'руб': 'рубль',
+    'рупии': 'рупия', 'рупий': 'рупия',
+    'донги': 'донг', 'юани': 'юань', 'баты': 'бат',
+}
+
+
+class QuoteError(ValueError):
+    pass
+
+
+@lru_cache(maxsize=None)
+def parse_currency(asset):
+    word = asset.split()[0].lower() if asset.strip() else 'unknown'
+    root = CURRENCY_ALIASES.get(word, word)
+    currency = CURRENCIES.get(root)
+    if currency is None:
+        currency = Currency(root.upper(), (root, root, root), 2)
+    return currency
+
+
+@lru_cache(maxsize=None)
+def split_pair(label):
+    if PAIR_SEPARATOR not in label:
+        return label.strip(), 'unknown'
+    base, quote = label.split(PAIR_SEPARATOR, 1)
+    return base.strip(), quote.strip()
+
+
+@lru_cache(maxsize=4096)
+def parse_pair(label, min_amount=None, max_amount=None):
+    """Разбирает подпись пары один раз на процесс."""
+    base_asset, quote_asset = split_pair(label)
+    return Pair(
+        label=label,
+        base_asset=base_asset,
+        quote_asset=quote_asset,
+        base=parse_currency(base_asset),
+        quote=parse_currency(quote_asset),
+        min_amount=Decimal(str(min_amount)) if min_amount is not None else Decimal(0),
+        max_amount=Decimal(str(max_amount)) if max_amount is not None else DEFAULT_MAX_AMOUNT,
+    )
+
+
+def to_decimal(value):
+    """Число из ввода/JSON без двоичной погрешности float; пробелы между разрядами допускаются."""
+    if isinstance(value, Decimal):
+        result = value
+    else:
+        try:
+            result = Decimal(str(value).strip().replace(' ', ''))
+        except InvalidOperation:
+            raise ValueError(f"Не число: {value!r}")
+    if not result.is_finite():
+        raise ValueError(f"Не число: {value!r}")
+    return result
+
+
+def to_minor(asset, value):
+    """Сумма в минимальных единицах валюты актива (копейки, центы) — для целочисленных остатков и сводок."""
+    scale = Decimal(10) ** parse_currency(asset).precision
+    return int((to_decimal(value) * scale).to_integral_value(rounding=ROUND_CEILING))
+
+
+def from_minor(asset, value):
+    return Decimal(value).scaleb(-parse_currency(asset).precision)
+
+
+def round_result(value, currency):
+    # Выдача округляется вниз до точности валюты: обменник не переплачивает
+    return value.quantize(Decimal(1).scaleb(-currency.precision), rounding=ROUND_DOWN)
+
+
+class Catalog:
+    """Разобранные пары и матрица курсов одного админа для конкретной версии профиля."""
+
+    def __init__(self, admin_id, version, admin_data, limits=None):
+        self.admin_id = admin_id
+        self.version = version
+        limits = limits or {}
+        self.pairs = {}
+        for label in dict.fromkeys(list(admin_data.get('pairs', [])) + list(admin_data.get('rates', {}))):
+            pair_limits = limits.get(label, {})
+            self.pairs[label] = parse_pair(label, pair_limits.get('min'), pair_limits.get('max'))
+        # (актив отдачи, актив выдачи) → (курс, выведен ли через промежуточный актив)
+        self.matrix = self._build_matrix(admin_data.get('rates', {}))
+        # пара → (пороги, курсы, комиссии): отсортированные столбцы для bisect
+        self.tiers = {}
+        for label, columns in (admin_data.get('tiers') or {}).items():
+            try:
+                self.tiers[label] = tiers_from_columns(columns)
+            except (KeyError, TypeError, ValueError) as e:
+                logger.error(f"Некорректные уровни для пары {label} у админа {self.admin_id}: {str(e)}")
+
+    def _build_matrix(self, rates):
+        direct = {}
+        for label, value in rates.items():
+            if value is None:
+                continue
+            try:
+                rate = to_decimal(value)
+            except ValueError:
+                logger.error(f"Некорректный курс {value!r} для пары {label} у админа {self.admin_id}")
+                continue
+            if rate <= 0:
+                continue
+            pair = self.pairs.get(label) or parse_pair(label)
+            direct[(pair.base_asset, pair.quote_asset)] = (rate, False)
+        matrix = dict(direct)
+        assets = {asset for key in direct for asset in key}
+        pivots = [a for a in assets if parse_currency(a).code in PIVOT_ASSETS]
+        for pair in self.pairs.values():
+            key = (pair.base_asset, pair.quote_asset)
+            if key in matrix:
+                continue
+            for pivot in pivots:
+                first, second = direct.get((pair.base_asset, pivot)), direct.get((pivot, pair.quote_asset))
+                if first and second:
+                    matrix[key] = (first[0] * second[0], True)
+                    break
+        return matrix
+
+    def quote(self, label, amount):
+        pair = self.pairs.get(label)
+        if pair is None:
+            raise QuoteError(f"Пара {label} не найдена")
+        entry = self.matrix.get((pair.base_asset, pair.quote_asset))
+        if entry is None:
+            raise QuoteError(f"Для пары {label} не задан курс")
+        amount = to_decimal(amount)
+        rate, derived = entry
+        fee = Decimal(0)
+        tiers = self.tiers.get(label)
+        if tiers:
+            # Суммы ниже первого порога считаются по первому уровню
+            index = max(0, bisect_right(tiers[0], amount) - 1)
+            rate, fee, derived = tiers[1][index], tiers[2][index], False
+        return Quote(pair, amount, rate, round_result(amount * rate - fee, pair.quote), derived, fee)
+
+
+def tiers_from_columns(columns):
+    thresholds = tuple(to_decimal(v) for v in columns['t'])
+    rates = tuple(to_decimal(v) for v in columns['r'])
+    fees = tuple(to_decimal(v) for v in columns.get('f') or ['0'] * len(thresholds))
+    if not thresholds or not len(thresholds) == len(rates) == len(fees):
+        raise ValueError("столбцы уровней разной длины")
+    if list(thresholds) != sorted(thresholds):
+        raise ValueError("пороги не отсортированы")
+    return thresholds, rates, fees
+
+
+def parse_tiers(text):
+    """Строки «порог курс [комиссия]» → столбцы {'t': [...], 'r': [...], 'f': [...]} для admins.tiers."""
+    rows = []
+    for number, line in enumerate(text.strip().splitlines(), 1):
+        parts = line.replace(';', ' ').split()
+        if not parts:
+            continue
+        if len(parts) not in (2, 3):
+            raise ValueError(f"Строка {number}: нужно «порог курс [комиссия]»")
+        threshold, rate = to_decimal(parts[0]), to_decimal(parts[1])
+        fee = to_decimal(parts[2]) if len(parts) == 3 else Decimal(0)
+        if threshold < 0 or rate <= 0 or fee < 0:
+            raise ValueError(f"Строка {number}: порог и комиссия не могут быть отрицательными, курс — больше 0")
+        rows.append((threshold, rate, fee))
+    if not rows:
+        raise ValueError("Не задано ни одного уровня")
+    rows.sort(key=lambda row: row[0])
+    thresholds = [row[0] for row in rows]
+    if len(set(thresholds)) != len(thresholds):
+        raise ValueError("Пороги не должны повторяться")
+    return {
+        't': [str(row[0]) for row in rows],
+        'r': [str(row[1]) for row in rows],
+        'f': [str(row[2]) for row in rows],
+    }
+
+
+_catalogs = {}
+
+
+def get_catalog(admin_id, admin_data=None):
+    """Каталог из кэша; пересобирается только когда меняется версия профиля админа."""
+    from bot_config import bot_config
+    if admin_data is None:
+        from utils import get_admin_data
+        admin_data = get_admin_data(admin_id)
+    version = admin_data.get('version')
+    cached = _catalogs.get(admin_id)
+    if cached is not None and version is not None and cached.version == version:
+        return cached
+    catalog = Catalog(admin_id, version, admin_data, bot_config.get('pair_limits'))
+    if version is not None:
+        _catalogs[admin_id] = catalog
+    return catalog
+
+
+def invalidate(admin_id=None):
+    if admin_id is None:
+        _catalogs.clear()
+    else:
+        _catalogs.pop(admin_id, None)
+
+
+def currency_name(pair_label, value):
+    """Название валюты выдачи в нужном падеже для суммы value."""
+    currency = parse_pair(pair_label).quote
+    if currency.forms[0] == currency.forms[2]:
+        return currency.forms[0]
+    return numeral.choose_plural(int(to_decimal(value)), currency.forms)
+
+
+def format_amount(value, precision=None):
+    """До миллиона — как есть, миллионы — с точками; дробная часть через запятую."""
+    value = to_decimal(value)
+    if precision is not None:
+        value = value.quantize(Decimal(1).scaleb(-precision), rounding=ROUND_DOWN)
+    integer = int(value)
+    text = str(integer) if abs(integer) < 1000000 else "{:,}".format(integer).replace(",", ".")
+    fraction = abs(value - integer)
+    if fraction:
+        digits = format(fraction.normalize(), 'f').split('.')[1]
+        text += ',' + digits
+    return text
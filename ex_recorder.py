@@ -0,0 +1,112 @@
+import gzip
+import hashlib
+import hmac
+import json
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+# Поля с персональными данными, которые вырезаются при анонимизации
+PERSONAL_FIELDS = ('username', 'last_name', 'phone_number', 'bio', 'language_code')
+
+
+def _open(path, mode):
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+
+class UpdateRecorder:
+    """Пишет каждый входящий апдейт с временем прихода в append-only JSON Lines (.gz — сжато)."""
+
+    def __init__(self, path, anonymize=False, salt=None, keep_ids=(), flush_every=100, flush_interval=1.0):
+        self.path = path
+        self.anonymize = anonymize
+        self.salt = (salt or os.getenv("UPDATE_RECORD_SALT") or "exbot").encode('utf-8')
+        # id, которые нельзя подменять (владелец): от них зависит поведение бота
+        self.keep_ids = {int(i) for i in keep_ids}
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self._file = _open(path, 'a')
+        self._pending = 0
+        self._last_flush = time.monotonic()
+        self.recorded = 0
+
+    def pseudonym(self, value):
+        value = int(value)
+        if value in self.keep_ids or value <= 0:
+            return value
+        digest = hmac.new(self.salt, str(value).encode('utf-8'), hashlib.sha256).digest()
+        return 100000000 + int.from_bytes(digest[:6], 'big') % 900000000
+
+    def _scrub(self, node):
+        if isinstance(node, dict):
+            for key in list(node):
+                value = node[key]
+                if key in PERSONAL_FIELDS:
+                    del node[key]
+                elif key in ('id', 'user_id', 'chat_id') and isinstance(value, int):
+                    node[key] = self.pseudonym(value)
+                elif key == 'first_name':
+                    node[key] = 'User'
+                elif key in ('latitude', 'longitude') and isinstance(value, float):
+                    node[key] = round(value, 2)
+                elif key == 'text' and isinstance(value, str) and 'ref_' in value:
+                    node[key] = ' '.join(
+                        f"ref_{self.pseudonym(part[4:])}" if part.startswith('ref_') and part[4:].isdigit() else part
+                        for part in value.split(' ')
+                    )
+                else:
+                    self._scrub(value)
+        elif isinstance(node, list):
+            for item in node:
+                self._scrub(item)
+        return node
+
+    def write(self, data, arrived=None):
+        if self.anonymize:
+            data = self._scrub(data)
+        line = json.dumps({'t': round(arrived or time.time(), 3), 'u': data}, ensure_ascii=False, separators=(',', ':'))
+        self._file.write(line + '\n')
+        self.recorded += 1
+        self._pending += 1
+        if self._pending >= self.flush_every or time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    async def record(self, update, context):
+        try:
+            self.write(update.to_dict())
+        except Exception as e:
+            logger.error(f"Ошибка записи апдейта {update.update_id}: {str(e)}")
+
+    def flush(self):
+        self._file.flush()
+        self._pending = 0
+        self._last_flush = time.monotonic()
+
+    def close(self):
+        if self._file and not self._file.closed:
+            self.flush()
+            self._file.close()
+            logger.info(f"Запись апдейтов завершена: {self.recorded} шт. в {self.path}")
+
+
+def read_recording(path):
+    """Отдаёт (время прихода, словарь апдейта) в порядке записи."""
+    with _open(path, 'r') as f:
+        try:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # Хвост мог оборваться при аварийной остановке — пропускаем
+                    logger.warning(f"Пропущена повреждённая строка записи в {path}")
+                    continue
+                yield entry['t'], entry['u']
+        except EOFError:
+            logger.warning(f"Запись {path} обрывается на середине gzip-блока")
@@ -0,0 +1,87 @@
+import hashlib
+import logging
+from collections import Counter, OrderedDict
+
+from telegram.error import BadRequest
+
+logger = logging.getLogger(__name__)
+
+# Сколько последних сообщений с меню помнить; хватает на все открытые админ-сессии
+CACHE_SIZE = 5000
+
+counters = Counter()
+
+
+def fingerprint(text, reply_markup=None, parse_mode=None, disable_web_page_preview=None):
+    markup = reply_markup.to_json() if reply_markup is not None else ''
+    payload = '\x00'.join((text, markup, parse_mode or '', str(bool(disable_web_page_preview))))
+    return hashlib.blake2b(payload.encode('utf-8'), digest_size=16).digest()
+
+
+class RenderCache:
+    """(chat_id, message_id) → отпечаток последнего показанного текста с клавиатурой, LRU."""
+
+    def __init__(self, size=CACHE_SIZE):
+        self.size = size
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        value = self.entries.get(key)
+        if value is not None:
+            self.entries.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def discard(self, key):
+        self.entries.pop(key, None)
+
+
+cache = RenderCache()
+
+
+def remember(message, text, reply_markup=None, parse_mode=None, disable_web_page_preview=None):
+    cache.put((message.chat_id, message.message_id),
+              fingerprint(text, reply_markup, parse_mode, disable_web_page_preview))
+
+
+async def reply_message(message, text, reply_markup=None, parse_mode=None, disable_web_page_preview=None):
+    """reply_text, запоминающий, что показано: следующее такое же редактирование не уйдёт в Telegram."""
+    sent = await message.reply_text(text, reply_markup=reply_markup, parse_mode=parse_mode,
+                                    disable_web_page_preview=disable_web_page_preview)
+    remember(sent, text, reply_markup, parse_mode, disable_web_page_preview)
+    return sent
+
+
+async def edit_message(query, text, reply_markup=None, parse_mode=None, disable_web_page_preview=None):
+    """Показывает text в сообщении с кнопкой, на которую нажали.
+
+    Если там уже ровно это (по кэшу отпечатков), запрос в Telegram не отправляется.
+    «Message is not modified» считается успехом; любая другая ошибка редактирования
+    (сообщение удалено, слишком старое) — отправка нового сообщения с тем же содержимым.
+    """
+    message = query.message
+    key = (message.chat_id, message.message_id)
+    current = fingerprint(text, reply_markup, parse_mode, disable_web_page_preview)
+    if cache.get(key) == current:
+        counters['skipped'] += 1
+        return message
+    try:
+        result = await query.edit_message_text(text, reply_markup=reply_markup, parse_mode=parse_mode,
+                                               disable_web_page_preview=disable_web_page_preview)
+    except BadRequest as e:
+        if "Message is not modified" in str(e):
+            counters['not_modified'] += 1
+            cache.put(key, current)
+            return message
+        logger.error(f"Ошибка при редактировании сообщения для user_id={query.from_user.id}: {str(e)}")
+        counters['fallback'] += 1
+        cache.discard(key)
+        return await reply_message(message, text, reply_markup, parse_mode, disable_web_page_preview)
+    counters['edited'] += 1
+    cache.put(key, current)
+    return result
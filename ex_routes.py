@@ -0,0 +1,195 @@
+import logging
+import math
+import time
+from datetime import datetime
+
+from ex_geo import KM_PER_DEG_LAT, KM_PER_DEG_LON, make_zone
+from ex_quotes import format_amount
+from utils import get_admin_data, get_open_orders, is_active_admin
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WINDOW_HOURS = 12
+MAX_COURIERS = 20
+# Бюджет на 2-opt для всех курьеров вместе
+OPTIMIZE_BUDGET = 0.8
+STOPS_PER_MAP_LINK = 10
+MESSAGE_LIMIT = 4000
+
+
+def order_point(order, zones):
+    """Координаты заявки: геолокация клиента, иначе центр зоны её локации, иначе None."""
+    if order.get('latitude') is not None and order.get('longitude') is not None:
+        return order['latitude'], order['longitude']
+    zone = zones.get(order.get('location'))
+    return (zone.lat, zone.lon) if zone else None
+
+
+def project(points):
+    """Локальная проекция в километры вокруг центра: дальше считаем обычным евклидовым расстоянием."""
+    lat0 = sum(p[0] for p in points) / len(points)
+    kx = KM_PER_DEG_LON * math.cos(math.radians(lat0))
+    return [((lon * kx), (lat * KM_PER_DEG_LAT)) for lat, lon in points]
+
+
+def distance_matrix(xy):
+    return [[math.hypot(ax - bx, ay - by) for bx, by in xy] for ax, ay in xy]
+
+
+def path_length(route, dist):
+    return sum(dist[a][b] for a, b in zip(route, route[1:]))
+
+
+def nearest_neighbour(stops, dist, start):
+    route, left = [start], set(stops) - {start}
+    while left:
+        last = route[-1]
+        following = min(left, key=lambda stop: dist[last][stop])
+        route.append(following)
+        left.remove(following)
+    return route
+
+
+def two_opt(route, dist, deadline):
+    """2-opt для открытого маршрута с фиксированным началом, пока есть улучшения и не вышло время."""
+    n = len(route)
+    improved = True
+    while improved and time.monotonic() < deadline:
+        improved = False
+        for i in range(n - 2):
+            a, b = route[i], route[i + 1]
+            dist_a, ab = dist[a], dist[a][b]
+            for j in range(i + 2, n):
+                c = route[j]
+                if j + 1 < n:
+                    d = route[j + 1]
+                    delta = dist_a[c] + dist[b][d] - ab - dist[c][d]
+                else:
+                    delta = dist_a[c] - ab
+                if delta < -1e-9:
+                    route[i + 1:j + 1] = reversed(route[i + 1:j + 1])
+                    b, ab = route[i + 1], dist_a[route[i + 1]]
+                    improved = True
+            if time.monotonic() >= deadline:
+                break
+    return route
+
+
+def split_by_sweep(indices, xy, groups, couriers):
+    """Делит точки между курьерами: зоны упорядочиваются по углу вокруг общего центра
+    и режутся на равные по числу заявок куски, так что зона дробится, только если иначе никак."""
+    cx = sum(xy[i][0] for i in indices) / len(indices)
+    cy = sum(xy[i][1] for i in indices) / len(indices)
+
+    def angle(x, y):
+        return math.atan2(y - cy, x - cx)
+
+    centres = {}
+    for group, members in groups.items():
+        gx = sum(xy[i][0] for i in members) / len(members)
+        gy = sum(xy[i][1] for i in members) / len(members)
+        centres[group] = angle(gx, gy)
+    ordered = []
+    for group in sorted(groups, key=lambda g: centres[g]):
+        ordered.extend(sorted(groups[group], key=lambda i: angle(*xy[i])))
+    couriers = max(1, min(couriers, len(ordered)))
+    size = math.ceil(len(ordered) / couriers)
+    return [ordered[k:k + size] for k in range(0, len(ordered), size)]
+
+
+def plan_routes(orders, zones, couriers=1, budget=OPTIMIZE_BUDGET):
+    """Возвращает ([(заявки маршрута по порядку, длина в км)], заявки без координат)."""
+    located, unlocated = [], []
+    for order in orders:
+        point = order_point(order, zones)
+        (located if point else unlocated).append((order, point))
+    if not located:
+        return [], [order for order, _ in unlocated]
+    xy = project([point for _, point in located])
+    dist = distance_matrix(xy)
+    groups = {}
+    for index, (order, _) in enumerate(located):
+        groups.setdefault(order.get('location') or '', []).append(index)
+    chunks = split_by_sweep(list(range(len(located))), xy, groups, couriers)
+    deadline = time.monotonic() + budget
+    routes = []
+    for chunk in chunks:
+        # Начинаем с крайней точки куска: открытый маршрут без возврата на базу
+        cx = sum(xy[i][0] for i in chunk) / len(chunk)
+        cy = sum(xy[i][1] for i in chunk) / len(chunk)
+        start = max(chunk, key=lambda i: math.hypot(xy[i][0] - cx, xy[i][1] - cy))
+        route = two_opt(nearest_neighbour(chunk, dist, start), dist, deadline)
+        routes.append(([located[i][0] for i in route], path_length(route, dist)))
+    return routes, [order for order, _ in unlocated]
+
+
+def map_links(points):
+    links = []
+    for k in range(0, len(points), STOPS_PER_MAP_LINK):
+        part = points[max(0, k - 1):k + STOPS_PER_MAP_LINK]  # куски стыкуются по последней точке
+        links.append("https://www.google.com/maps/dir/" + "/".join(f"{lat:.6f},{lon:.6f}" for lat, lon in part))
+    return links
+
+
+def format_stop(number, order):
+    created = datetime.fromtimestamp(order['created_at']).strftime('%H:%M')
+    return (f"{number}. №{order['order_id']} {order['location']} ({created}): "
+            f"{order['operation']}, {format_amount(order['amount'])} → {format_amount(order['result'])}")
+
+
+def split_message(lines):
+    messages, current = [], ""
+    for line in lines:
+        if current and len(current) + len(line) + 1 > MESSAGE_LIMIT:
+            messages.append(current)
+            current = ""
+        current = f"{current}\n{line}" if current else line
+    if current:
+        messages.append(current)
+    return messages
+
+
+ROUTE_USAGE = "Используйте: /route [часов назад, по умолчанию 12] [курьеров, по умолчанию 1]"
+
+
+async def route_command(update, context):
+    user_id = update.message.from_user.id
+    if not is_active_admin(user_id):
+        await update.message.reply_text("Эта команда доступна только администраторам!")
+        return
+    args = context.args or []
+    if len(args) > 2 or not all(a.isdigit() for a in args):
+        await update.message.reply_text(ROUTE_USAGE)
+        return
+    hours = int(args[0]) if args else DEFAULT_WINDOW_HOURS
+    couriers = max(1, min(MAX_COURIERS, int(args[1]))) if len(args) > 1 else 1
+
+    admin_data = get_admin_data(user_id)
+    zones = {}
+    for name, spec in (admin_data.get('zones') or {}).items():
+        try:
+            zones[name] = make_zone(name, spec)
+        except (KeyError, TypeError, ValueError):
+            continue
+    orders = get_open_orders(user_id, time.time() - hours * 3600)
+    if not orders:
+        await update.message.reply_text(f"Открытых заявок за последние {hours} ч нет.")
+        return
+
+    started = time.perf_counter()
+    routes, unlocated = plan_routes(orders, zones, couriers)
+    elapsed = (time.perf_counter() - started) * 1000
+    logger.info(f"Маршруты для админа {user_id}: заявок {len(orders)}, курьеров {len(routes)}, {elapsed:.0f} мс")
+
+    lines = [f"Заявок за {hours} ч: {len(orders)}, маршрутов: {len(routes)}"]
+    for number, (route, length) in enumerate(routes, 1):
+        lines.append("")
+        lines.append(f"Курьер {number}: {len(route)} точек, ~{length:.1f} км")
+        lines.extend(format_stop(k, order) for k, order in enumerate(route, 1))
+        lines.extend(map_links([order_point(order, zones) for order in route]))
+    if unlocated:
+        lines.append("")
+        lines.append(f"Без координат и зоны ({len(unlocated)}):")
+        lines.extend(format_stop(k, order) for k, order in enumerate(unlocated, 1))
+    for text in split_message(lines):
+        await update.message.reply_text(text, disable_web_page_preview=True)
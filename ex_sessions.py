@@ -0,0 +1,269 @@
+import asyncio
+import json
+import logging
+import time
+from collections import Counter, OrderedDict, defaultdict
+
+from telegram import Update
+from telegram.ext import TypeHandler
+
+from utils import get_connection
+
+logger = logging.getLogger(__name__)
+
+# Настройки по умолчанию; переопределяются секцией "sessions" в config.json
+DEFAULTS = {
+    'idle_timeout': 1800,  # клиентский диалог без ответа дольше этого сбрасывается, 0 — никогда
+    'admin_idle_timeout': 3600,  # то же для админ-панели
+    'evict_after': 900,  # через сколько секунд тишины данные пользователя уходят из памяти
+    'max_sessions': 10000,  # больше — вытесняются самые давние, даже если не простаивали evict_after
+    'sweep_interval': 60,
+    'spill': True,  # сохранять вытесненное в таблицу sessions, чтобы вернувшийся продолжил с того же места
+    'spill_ttl': 7 * 86400,  # сколько хранить вытесненные сессии
+}
+
+# Ключи user_data, которые принадлежат незавершённому диалогу: при таймауте сбрасываются вместе с ним
+FLOW_KEYS = {
+    'client': ('user_data',),
+    'admin': ('editing_rate', 'bulk_edit', 'admin_menu'),
+}
+
+# user_id → время последнего апдейта; порядок — от самого давнего к свежему
+last_seen = OrderedDict()
+handlers = {}
+# Вытесненные, но ещё не записанные сессии (None — строку надо удалить) и те, что пишутся прямо сейчас
+pending = {}
+writing = {}
+counters = Counter()
+last_sweep = {}
+
+
+def session_settings():
+    from bot_config import bot_config
+    return dict(DEFAULTS, **(bot_config.get('sessions') or {}))
+
+
+def idle_timeout(name, settings):
+    return int(settings['admin_idle_timeout'] if name == 'admin' else settings['idle_timeout'])
+
+
+def track(application, *conversation_handlers):
+    """Подключает учёт активности: апдейт сначала проходит через touch (группа -2), потом — диалоги."""
+    last_seen.clear()
+    handlers.clear()
+    for handler in conversation_handlers:
+        handlers[handler.name] = handler
+    application.add_handler(TypeHandler(Update, touch), group=-2)
+
+
+def end_conversation(application, name, key):
+    handlers[name]._conversations.pop(key, None)
+    data = application.user_data.get(key[-1])
+    if data:
+        for field in FLOW_KEYS.get(name, ()):
+            data.pop(field, None)
+        if application.persistence:
+            application.mark_data_for_update_persistence(user_ids=key[-1])
+    counters['expired'] += 1
+
+
+def load_session(user_id):
+    conn = get_connection()
+    try:
+        return conn.execute('SELECT data, states, seen_at FROM sessions WHERE user_id = ?', (user_id,)).fetchone()
+    finally:
+        conn.close()
+
+
+def write_sessions(rows, purge_before):
+    """rows: user_id → (data, states, seen_at) или None. Одна транзакция на весь сброс."""
+    conn = get_connection()
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        now = int(time.time())
+        conn.executemany('INSERT OR REPLACE INTO sessions (user_id, data, states, seen_at, saved_at) VALUES (?, ?, ?, ?, ?)',
+                         [(user_id, *row, now) for user_id, row in rows.items() if row is not None])
+        conn.executemany('DELETE FROM sessions WHERE user_id = ?',
+                         [(user_id,) for user_id, row in rows.items() if row is None])
+        purged = conn.execute('DELETE FROM sessions WHERE saved_at < ?', (purge_before,)).rowcount
+        conn.commit()
+        return purged
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+async def restore(application, user_id, now, settings):
+    if user_id in pending:
+        row = pending[user_id]
+    elif user_id in writing:
+        row = writing[user_id]
+    else:
+        row = await asyncio.to_thread(load_session, user_id)
+    if row is None:
+        return
+    data, states, seen_at = json.loads(row[0]), json.loads(row[1]), row[2]
+    for name, key, state in states:
+        if name not in handlers:
+            continue
+        timeout = idle_timeout(name, settings)
+        if timeout and now - seen_at > timeout:
+            for field in FLOW_KEYS.get(name, ()):
+                data.pop(field, None)
+            counters['expired'] += 1
+            continue
+        handlers[name]._conversations[tuple(key)] = state
+    application.user_data[user_id].update(data)
+    if application.persistence:
+        # Строку дальше ведёт ex_persistence: сессия снова в памяти и сохраняется по мере изменений
+        pending.pop(user_id, None)
+    else:
+        # Строка больше не нужна: удалится при следующем сбросе
+        pending[user_id] = None
+    counters['restored'] += 1
+    logger.info(f"Сессия user_id={user_id} восстановлена после {now - seen_at:.0f} с простоя")
+
+
+async def touch(update, context):
+    user = update.effective_user
+    if user is None:
+        return
+    settings = session_settings()
+    now = time.time()
+    previous = last_seen.pop(user.id, None)
+    last_seen[user.id] = now
+    if previous is None:
+        if settings['spill'] or context.application.persistence:
+            await restore(context.application, user.id, now, settings)
+        return
+    if update.effective_chat is None:
+        return
+    # Между проходами сборщика таймаут проверяется здесь, до того как апдейт попадёт в диалог
+    key = (update.effective_chat.id, user.id)
+    for name, handler in handlers.items():
+        timeout = idle_timeout(name, settings)
+        if timeout and now - previous > timeout and key in handler._conversations:
+            end_conversation(context.application, name, key)
+
+
+def evict(application, user_id, states, settings):
+    data = application.user_data.get(user_id)
+    if settings['spill'] and (data or states):
+        try:
+            pending[user_id] = (json.dumps(data or {}, ensure_ascii=False),
+                                json.dumps([[name, list(key), state] for name, key, state in states]),
+                                int(last_seen[user_id]))
+            counters['spilled'] += 1
+        except (TypeError, ValueError) as e:
+            logger.warning(f"Сессию user_id={user_id} не сохранить в базу, она будет потеряна: {str(e)}")
+            counters['lost'] += 1
+    for name, key, _ in states:
+        handlers[name]._conversations.pop(key, None)
+    application.drop_user_data(user_id)
+    del last_seen[user_id]
+    counters['evicted'] += 1
+
+
+async def sweep(application, settings=None):
+    settings = settings or session_settings()
+    now = time.time()
+    by_user = defaultdict(list)
+    for name, handler in handlers.items():
+        timeout = idle_timeout(name, settings)
+        for key, state in list(handler._conversations.items()):
+            seen = last_seen.get(key[-1])
+            if timeout and (seen is None or now - seen > timeout):
+                end_conversation(application, name, key)
+            else:
+                by_user[key[-1]].append((name, key, state))
+    evicted = 0
+    evict_after = float(settings['evict_after'])
+    max_sessions = int(settings['max_sessions'])
+    while last_seen:
+        user_id, seen = next(iter(last_seen.items()))
+        if now - seen <= evict_after and len(last_seen) <= max_sessions:
+            break
+        evict(application, user_id, by_user.get(user_id, ()), settings)
+        evicted += 1
+    await flush(settings)
+    last_sweep.update(at=now, evicted=evicted, resident=len(last_seen))
+    return evicted
+
+
+async def flush(settings):
+    global writing
+    if writing:
+        return
+    writing = dict(pending)
+    pending.clear()
+    try:
+        purged = await asyncio.to_thread(write_sessions, writing, int(time.time() - float(settings['spill_ttl'])))
+        counters['purged'] += purged
+    except Exception as e:
+        logger.error(f"Ошибка записи сессий в базу: {str(e)}")
+        # Не потерять: вернуть в очередь, не затирая то, что появилось за время записи
+        for user_id, row in writing.items():
+            pending.setdefault(user_id, row)
+    finally:
+        writing = {}
+
+
+async def run_session_sweeper(application):
+    interval = int(session_settings()['sweep_interval'])
+    if interval <= 0:
+        return
+    logger.info(f"Фоновая задача вытеснения сессий запущена, интервал {interval} с")
+    while not application.stop_event.is_set():
+        for _ in range(interval):
+            if application.stop_event.is_set():
+                break
+            await asyncio.sleep(1)
+        try:
+            await sweep(application)
+        except Exception as e:
+            logger.error(f"Ошибка вытеснения сессий: {str(e)}")
+    # Перед остановкой сохраняем всё, что ещё в очереди
+    await flush(session_settings())
+    logger.info("Фоновая задача вытеснения сессий завершена")
+
+
+def resident_stats(application):
+    size = 0
+    for data in application.user_data.values():
+        if data:
+            size += len(json.dumps(data, ensure_ascii=False, default=str).encode('utf-8'))
+    conversations = {name: len(handler._conversations) for name, handler in handlers.items()}
+    return {'users': len(application.user_data), 'tracked': len(last_seen), 'bytes': size,
+            'conversations': conversations, 'pending': len(pending)}
+
+
+def count_spilled():
+    conn = get_connection()
+    try:
+        return conn.execute('SELECT COUNT(*) FROM sessions').fetchone()[0]
+    finally:
+        conn.close()
+
+
+async def sessions_command(update, context):
+    from bot_config import bot_config
+    user_id = update.message.from_user.id
+    if str(user_id) != bot_config["owner_id"]:
+        await update.message.reply_text("Эта команда только для владельца!")
+        return
+    stats = resident_stats(context.application)
+    spilled = await asyncio.to_thread(count_spilled)
+    conversations = ", ".join(f"{name}: {count}" for name, count in stats['conversations'].items()) or "нет"
+    text = (f"Сессий в памяти: {stats['users']} (отслеживается {stats['tracked']}), "
+            f"≈{stats['bytes'] / 1024:.1f} КБ user_data\n"
+            f"Открытых диалогов: {conversations}\n"
+            f"Сохранено в базе: {spilled}, ждут записи: {stats['pending']}\n"
+            f"Вытеснено: {counters['evicted']}, восстановлено: {counters['restored']}, "
+            f"сброшено по таймауту: {counters['expired']}, потеряно: {counters['lost']}")
+    if counters['flushes']:
+        text += f"\nСохранено изменений: {counters['persisted']} за {counters['flushes']} записей в базу"
+    if last_sweep:
+        text += f"\nПоследний проход: вытеснено {last_sweep['evicted']}, осталось {last_sweep['resident']}"
+    await update.message.reply_text(text)
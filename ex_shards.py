@@ -0,0 +1,246 @@
+import asyncio
+import logging
+import multiprocessing
+import queue
+import signal
+import time
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+# Один процесс принимает апдейты и раздаёт их N процессам-обработчикам по user_id % N: все апдейты
+# пользователя идут в один процесс по порядку, его диалог и user_data живут там же.
+# Общие данные — в базе; локальные кэши процессов сбрасываются сообщениями через приёмный процесс.
+
+# Сколько элементов забирать из очереди за одно обращение из потока
+TAKE_BATCH = 100
+
+shard_id = None
+_outbox = None
+counters = Counter()
+
+
+def user_of(data):
+    """user_id отправителя из апдейта в виде dict (как в Bot API); 0, если отправителя нет."""
+    for value in data.values():
+        if isinstance(value, dict):
+            sender = value.get('from') or value.get('user')
+            if isinstance(sender, dict) and 'id' in sender:
+                return sender['id']
+            chat = value.get('chat')
+            if isinstance(chat, dict) and 'id' in chat:
+                return chat['id']
+    return 0
+
+
+def shard_of(data, workers):
+    return user_of(data) % workers
+
+
+def notify(kind, key=None):
+    """Сообщить остальным процессам, что их кэш устарел; в однопроцессном режиме ничего не делает."""
+    if _outbox is None:
+        return
+    _outbox.put((shard_id, kind, key))
+    counters['notified'] += 1
+
+
+def apply(kind, key):
+    if kind == 'config':
+        from bot_config import load_config
+        from ex_quotes import invalidate
+        load_config()
+        invalidate()
+    elif kind == 'quotes':
+        from ex_quotes import invalidate
+        invalidate(key)
+    elif kind == 'cash':
+        from ex_inventory import index
+        admin_id, location, asset, value = key
+        if value is None:
+            index.discard(admin_id, location, asset)
+        else:
+            index.set(admin_id, location, asset, value)
+    elif kind == 'inventory':
+        from ex_inventory import index
+        index.invalidate(key)
+    elif kind == 'netting':
+        from ex_netting import drop_book
+        drop_book(key)
+    elif kind == 'history':
+        from ex_history import forget
+        forget(key)
+    else:
+        logger.warning(f"Неизвестное сообщение об изменении кэша: {kind}")
+        return
+    counters['applied'] += 1
+
+
+def take(inbox, timeout=1.0):
+    """Блокирующе ждёт первый элемент, остальные забирает без ожидания; [] — таймаут."""
+    try:
+        items = [inbox.get(timeout=timeout)]
+    except queue.Empty:
+        return []
+    while len(items) < TAKE_BATCH:
+        try:
+            items.append(inbox.get_nowait())
+        except queue.Empty:
+            break
+    return items
+
+
+async def consume(application, inbox):
+    """Обрабатывает апдейты из очереди по одному, в порядке поступления; None в очереди — остановка."""
+    from telegram import Update
+    while True:
+        for item in await asyncio.to_thread(take, inbox):
+            if item is None:
+                return
+            kind, payload = item
+            if kind == 'update':
+                await application.process_update(Update.de_json(payload, application.bot))
+                counters['updates'] += 1
+            else:
+                apply(*payload)
+
+
+def worker_main(shard, workers, inbox, outbox, build=None):
+    """Точка входа процесса-обработчика. build — фабрика Application (бенчмарк подставляет фейковый транспорт)."""
+    global shard_id, _outbox
+    shard_id, _outbox = shard, outbox
+    # Останавливает приёмный процесс: он допишет очереди и пришлёт None
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    asyncio.run(serve(shard, workers, inbox, build))
+
+
+async def serve(shard, workers, inbox, build=None):
+    import exbot
+    if build is None:
+        from bot_config import application
+        exbot.register_handlers(application)
+    else:
+        application = build()
+        application.stop_event = asyncio.Event()
+    await application.initialize()
+    await application.start()
+    if build is None:
+        # Фоновые задачи с рассылками и записью в базу нужны в одном экземпляре
+        exbot.start_background_tasks(application, primary=shard == 0)
+    logger.info(f"Обработчик {shard + 1}/{workers} запущен")
+    notify('ready')
+    try:
+        await consume(application, inbox)
+        notify('drained', counters['updates'])
+    finally:
+        application.stop_event.set()
+        await application.stop()
+        await application.shutdown()
+    logger.info(f"Обработчик {shard + 1}/{workers} остановлен, апдейтов: {counters['updates']}")
+
+
+class Shards:
+    """Процессы-обработчики со своими очередями и общая очередь сообщений о кэшах от них."""
+
+    def __init__(self, workers, build=None):
+        self.workers = workers
+        self.build = build
+        self.context = multiprocessing.get_context('spawn')
+        self.inboxes = [self.context.Queue() for _ in range(workers)]
+        self.outbox = self.context.Queue()
+        self.processes = [None] * workers
+        self.routed = Counter()
+        self.stopping = False
+        # Служебные сообщения обработчиков: shard → значение
+        self.ready = {}
+        self.drained = {}
+
+    def start_worker(self, shard):
+        process = self.context.Process(target=worker_main, name=f"exbot-shard-{shard}",
+                                       args=(shard, self.workers, self.inboxes[shard], self.outbox, self.build))
+        process.start()
+        self.processes[shard] = process
+
+    def start(self):
+        for shard in range(self.workers):
+            self.start_worker(shard)
+
+    def route(self, data):
+        shard = shard_of(data, self.workers)
+        self.inboxes[shard].put(('update', data))
+        self.routed[shard] += 1
+
+    def relay(self, timeout=1.0):
+        """Раздаёт сообщения о кэшах всем, кроме отправителя, и перезапускает упавшие процессы."""
+        for sender, kind, key in take(self.outbox, timeout):
+            if kind == 'ready':
+                self.ready[sender] = time.monotonic()
+                if len(self.ready) == self.workers:
+                    logger.info(f"Все обработчики запущены: {self.workers}")
+                continue
+            if kind == 'drained':
+                self.drained[sender] = key
+                continue
+            for shard, inbox in enumerate(self.inboxes):
+                if shard != sender:
+                    inbox.put(('invalidate', (kind, key)))
+            counters['relayed'] += 1
+        for shard, process in enumerate(self.processes):
+            if self.stopping:
+                break
+            if process is not None and not process.is_alive() and process.exitcode != 0:
+                # Новый экземпляр продолжит с того, что осталось в очереди. Апдейты, которые упавший уже
+                # забрал из неё (до TAKE_BATCH штук, включая обрабатывавшийся), потеряны
+                logger.error(f"Обработчик {shard} завершился с кодом {process.exitcode}, перезапускаем")
+                counters['restarted'] += 1
+                self.start_worker(shard)
+
+    def finish(self):
+        """Обработчики доделают то, что уже в очередях, и завершатся."""
+        self.stopping = True
+        for inbox in self.inboxes:
+            inbox.put(None)
+
+    def stop(self, timeout=30):
+        self.finish()
+        deadline = time.monotonic() + timeout
+        for process in self.processes:
+            process.join(max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                logger.warning(f"Обработчик {process.name} не остановился за {timeout} с, завершаем")
+                process.terminate()
+
+
+async def run_sharded(application, workers, recorder=None):
+    """Приёмный процесс: polling в update_queue приложения, оттуда — в очереди обработчиков."""
+    shards = Shards(workers)
+    shards.start()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, application.stop_event.set)
+
+    async def relay():
+        while not application.stop_event.is_set():
+            await asyncio.to_thread(shards.relay)
+
+    relay_task = asyncio.create_task(relay())
+    await application.initialize()
+    await application.updater.start_polling(allowed_updates=["message", "callback_query"], drop_pending_updates=True)
+    logger.info(f"Приём апдейтов запущен, обработчиков: {workers}")
+    try:
+        while not application.stop_event.is_set():
+            try:
+                update = await asyncio.wait_for(application.update_queue.get(), timeout=1)
+            except asyncio.TimeoutError:
+                continue
+            data = update.to_dict()
+            if recorder:
+                recorder.write(data)
+            shards.route(data)
+    finally:
+        await application.updater.stop()
+        await asyncio.to_thread(shards.stop)
+        await relay_task
+        await application.shutdown()
+    logger.info(f"Приём апдейтов остановлен, распределено по обработчикам: {dict(shards.routed)}")
@@ -0,0 +1,239 @@
+import asyncio
+import json
+import logging
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from ex_quotes import format_amount, from_minor, split_pair, to_minor
+from utils import get_connection, is_active_admin
+
+logger = logging.getLogger(__name__)
+
+PERIODS = {'day': 1, 'week': 7, 'month': 30}
+PERIOD_NAMES = {'day': 'сегодня', 'week': 'за 7 дней', 'month': 'за 30 дней'}
+TOP_LOCATIONS = 5
+STATUS_COLUMNS = {'done': 'done', 'cancelled': 'cancelled'}
+
+backfill_state = {}
+
+
+def rollup_day(timestamp):
+    return datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d')
+
+
+def order_volume(order):
+    """(сумма в минимальных единицах актива отдачи, выдача — в единицах актива выдачи)."""
+    base, quote = split_pair(order['operation'])
+    try:
+        return to_minor(base, order.get('amount') or 0), to_minor(quote, order.get('result') or 0)
+    except ValueError:
+        logger.warning(f"Сводка: некорректные суммы заявки {order}")
+        return 0, 0
+
+
+def add_order(c, admin_id, created_at, order):
+    """Учитывает новую заявку в дневной сводке; вызывается внутри транзакции вставки заявки."""
+    amount, result = order_volume(order)
+    c.execute('''
+        INSERT INTO order_rollups (admin_id, day, operation, location, orders, amount, result)
+        VALUES (?, ?, ?, ?, 1, ?, ?)
+        ON CONFLICT(admin_id, day, operation, location) DO UPDATE SET
+            orders = orders + 1, amount = amount + excluded.amount, result = result + excluded.result
+    ''', (admin_id, rollup_day(created_at), order.get('operation') or '', order.get('location') or '', amount, result))
+
+
+def add_status(c, admin_id, status, orders):
+    """orders — [(created_at, operation, location)] заявок, закрытых этим статусом."""
+    column = STATUS_COLUMNS.get(status)
+    if column is None or not orders:
+        return
+    c.executemany(f'UPDATE order_rollups SET {column} = {column} + 1 '
+                  f'WHERE admin_id = ? AND day = ? AND operation = ? AND location = ?',
+                  [(admin_id, rollup_day(created_at), operation or '', location or '')
+                   for created_at, operation, location in orders])
+
+
+def read_stats(admin_id, days, today=None):
+    """Сводка за последние days дней: читает только строки сводок, а не заявки."""
+    today = today or datetime.now()
+    since = (today - timedelta(days=days - 1)).strftime('%Y-%m-%d')
+    conn = get_connection()
+    try:
+        if admin_id is None:
+            rows = conn.execute('''
+                SELECT operation, location, SUM(orders), SUM(done), SUM(cancelled), SUM(amount), SUM(result)
+                FROM order_rollups WHERE day >= ? GROUP BY operation, location
+            ''', (since,)).fetchall()
+        else:
+            rows = conn.execute('''
+                SELECT operation, location, SUM(orders), SUM(done), SUM(cancelled), SUM(amount), SUM(result)
+                FROM order_rollups WHERE admin_id = ? AND day >= ? GROUP BY operation, location
+            ''', (admin_id, since)).fetchall()
+    finally:
+        conn.close()
+    pairs = defaultdict(lambda: [0, 0, 0, 0, 0])
+    locations = defaultdict(int)
+    for operation, location, orders, done, cancelled, amount, result in rows:
+        totals = pairs[operation]
+        for k, value in enumerate((orders, done, cancelled, amount, result)):
+            totals[k] += value
+        locations[location] += orders
+    return pairs, locations
+
+
+def format_stats(period, pairs, locations):
+    total = sum(totals[0] for totals in pairs.values())
+    if not total:
+        return f"Заявок {PERIOD_NAMES[period]} нет."
+    lines = [f"Заявок {PERIOD_NAMES[period]}: {total}"]
+    for operation, (orders, done, cancelled, amount, result) in sorted(pairs.items(), key=lambda item: -item[1][0]):
+        base, quote = split_pair(operation)
+        lines.append(f"{operation}: {orders} (выдано {done}, отменено {cancelled}), "
+                     f"{format_amount(from_minor(base, amount))} → {format_amount(from_minor(quote, result))}")
+    top = sorted(locations.items(), key=lambda item: -item[1])[:TOP_LOCATIONS]
+    lines.append("")
+    lines.append("Локации: " + ", ".join(f"{location or 'не указана'} — {orders}" for location, orders in top))
+    return "\n".join(lines)
+
+
+# Клиенты, у которых нет ни одной строки в журнале: их active_order записан до появления журнала заявок
+LEGACY_QUERY = '''
+    SELECT active_order, last_request_date, referrer_id FROM users
+    WHERE active_order IS NOT NULL AND user_id NOT IN (SELECT user_id FROM orders)
+'''
+
+
+def needs_backfill():
+    conn = get_connection()
+    try:
+        has_rollups = conn.execute('SELECT 1 FROM order_rollups LIMIT 1').fetchone()
+        has_orders = (conn.execute('SELECT 1 FROM orders LIMIT 1').fetchone()
+                      or conn.execute(LEGACY_QUERY + ' LIMIT 1').fetchone())
+    finally:
+        conn.close()
+    return bool(has_orders and not has_rollups)
+
+
+def legacy_orders(conn):
+    """admin_id → [(день, пара, локация, сумма, выдача)] из users.active_order клиентов без журнала.
+
+    До журнала заявок от каждого клиента оставалась только последняя заявка, а её день — это
+    last_request_date; более ранние заявки не восстановить. Статус таких заявок неизвестен.
+    """
+    from bot_config import bot_config
+    owner_id = int(bot_config["owner_id"])
+    by_admin = defaultdict(list)
+    for active_order, last_request_date, referrer_id in conn.execute(LEGACY_QUERY):
+        try:
+            order = json.loads(active_order)
+        except (TypeError, ValueError):
+            continue
+        if not isinstance(order, dict) or not order.get('operation') or not last_request_date:
+            continue
+        by_admin[referrer_id or owner_id].append((last_request_date, order['operation'], order.get('location') or '',
+                                                  order.get('amount'), order.get('result')))
+    return by_admin
+
+
+def backfill():
+    """Пересобирает сводки из журнала заявок и последних заявок клиентов, оставшихся с версии без
+    журнала (legacy_orders), по админу за транзакцию.
+
+    На время пересчёта одного админа база заблокирована на запись, поэтому новые
+    заявки не попадут в сводку дважды и не потеряются.
+    """
+    started = time.perf_counter()
+    backfill_state.update(running=True, admins=0, orders=0, legacy=0)
+    conn = get_connection()
+    try:
+        legacy = legacy_orders(conn)
+        admin_ids = {row[0] for row in conn.execute('SELECT DISTINCT admin_id FROM orders').fetchall()} | set(legacy)
+        for admin_id in sorted(admin_ids):
+            c = conn.cursor()
+            c.execute('BEGIN IMMEDIATE')
+            totals = defaultdict(lambda: [0, 0, 0, 0, 0])
+            c.execute('SELECT created_at, operation, location, amount, result, status FROM orders WHERE admin_id = ?',
+                      (admin_id,))
+            for created_at, operation, location, amount, result, status in c:
+                row = totals[(rollup_day(created_at), operation or '', location or '')]
+                minor_amount, minor_result = order_volume({'operation': operation or '', 'amount': amount, 'result': result})
+                row[0] += 1
+                row[1] += status == 'done'
+                row[2] += status == 'cancelled'
+                row[3] += minor_amount
+                row[4] += minor_result
+                backfill_state['orders'] += 1
+            for day, operation, location, amount, result in legacy.get(admin_id, ()):
+                row = totals[(day, operation, location)]
+                minor_amount, minor_result = order_volume({'operation': operation, 'amount': amount, 'result': result})
+                row[0] += 1
+                row[3] += minor_amount
+                row[4] += minor_result
+                backfill_state['legacy'] += 1
+            c.execute('DELETE FROM order_rollups WHERE admin_id = ?', (admin_id,))
+            c.executemany('INSERT INTO order_rollups (admin_id, day, operation, location, orders, done, cancelled, '
+                          'amount, result) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                          [(admin_id, *key, *values) for key, values in totals.items()])
+            conn.commit()
+            backfill_state['admins'] += 1
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+        backfill_state['running'] = False
+    backfill_state['elapsed_ms'] = round((time.perf_counter() - started) * 1000, 1)
+    logger.info(f"Сводки заявок пересобраны: {backfill_state}")
+    return dict(backfill_state)
+
+
+async def run_backfill():
+    try:
+        await asyncio.to_thread(backfill)
+    except Exception as e:
+        logger.error(f"Ошибка пересборки сводок заявок: {str(e)}")
+
+
+STATS_USAGE = (
+    "Используйте: /stats [day|week|month]\n"
+    "Владелец: /stats week all — по всем админам, /stats rebuild — пересобрать сводки"
+)
+
+
+async def stats_command(update, context):
+    from bot_config import bot_config
+    user_id = update.message.from_user.id
+    is_owner = str(user_id) == bot_config["owner_id"]
+    if not is_active_admin(user_id):
+        await update.message.reply_text("Эта команда доступна только администраторам!")
+        return
+    args = [a.lower() for a in context.args or []]
+
+    if args == ['rebuild'] and is_owner:
+        if backfill_state.get('running'):
+            await update.message.reply_text("Сводки уже пересобираются.")
+            return
+        try:
+            stats = await asyncio.to_thread(backfill)
+        except Exception as e:
+            logger.error(f"Ошибка пересборки сводок заявок: {str(e)}")
+            await update.message.reply_text(f"Ошибка пересборки: {str(e)}")
+            return
+        await update.message.reply_text(
+            f"Сводки пересобраны: админов {stats['admins']}, заявок {stats['orders']} "
+            f"(и {stats['legacy']} последних заявок клиентов до журнала) за {stats['elapsed_ms']} мс"
+        )
+        return
+
+    everyone = is_owner and 'all' in args
+    periods = [a for a in args if a != 'all'] or ['day']
+    if len(periods) != 1 or periods[0] not in PERIODS or ('all' in args and not is_owner):
+        await update.message.reply_text(STATS_USAGE)
+        return
+    period = periods[0]
+    pairs, locations = read_stats(None if everyone else user_id, PERIODS[period])
+    text = format_stats(period, pairs, locations)
+    if everyone:
+        text = "Все админы.\n" + text
+    await update.message.reply_text(text)
@@ -11,15 +11,29 @@ import telegram.ext
 import inspect
 
 from telegram.error import NetworkError, TimedOut, TelegramError
-from telegram.ext import Application, CommandHandler, ConversationHandler, MessageHandler
+from telegram.ext import Application, CommandHandler, ConversationHandler, MessageHandler, TypeHandler
 from telegram.ext import filters
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup, ReplyKeyboardRemove, KeyboardButton
 from ex_admin import get_admin_handler, build_admin_entry_menu, ADMIN_STATE, ADD_LOCATION, ADD_PAIR
-from ex_owner import activate_otp, check_subscription
+from ex_owner import activate_otp, check_subscription, otp_batch_command
+from ex_feed import feed_command, run_rate_feed
+from ex_propagate import propagate_command, defaults_command
+from ex_history import history_command
+from ex_geo import coordinates_from_text, get_zone_index, match_location, zone_command
+from ex_routes import route_command
+from ex_netting import register_order, done_command, reject_command, exposure_command
+from ex_inventory import available_locations, has_cash, place_order, cash_command
+from ex_stats import needs_backfill, run_backfill, stats_command
+from ex_export import export_command
+from ex_backup import backup_command, run_backups
+from ex_maintenance import maintenance_command, run_maintenance_loop
+from ex_sessions import track as track_sessions, run_session_sweeper, sessions_command
+from ex_shards import notify, run_sharded
+from ex_recorder import UpdateRecorder
+from ex_quotes import invalidate as invalidate_quotes, get_catalog, parse_pair, to_decimal, format_amount, currency_name, QuoteError, DEFAULT_MAX_AMOUNT
 from bot_config import application, bot_config
-from utils import init_db, get_user_data, save_user_data, check_request_limit, log_request, get_admin_data
+from utils import init_db, enable_wal, get_user_data, save_user_data, check_request_limit, log_request, get_admin_data, get_connection
 from datetime import datetime, timedelta
-from pytils import numeral
 import json
 import os
 from dotenv import load_dotenv
@@ -99,11 +113,15 @@ def build_client_menu(user_id):
 def build_amount_menu():
     return ReplyKeyboardMarkup([["Назад"]], one_time_keyboard=True, resize_keyboard=True)
 
-def build_location_menu(user_id):
+def build_location_menu(user_id, order=None):
     active_order, request_count, referrer_id, in_admin_mode = get_user_data(user_id)  # Полная распаковка
     admin_id = referrer_id if referrer_id else bot_config["owner_id"]
     admin_data = get_admin_data(admin_id)
-    reply_keyboard = [admin_data['active_locations'][i:i+3] for i in range(0, len(admin_data['active_locations']), 3)]
+    # Локации, где наличных на эту заявку не хватит, клиенту не показываем (ex_inventory)
+    locations = available_locations(admin_id, admin_data['active_locations'], order)
+    reply_keyboard = [locations[i:i+3] for i in range(0, len(locations), 3)]
+    if get_zone_index(admin_id, admin_data).zones:
+        reply_keyboard.insert(0, [KeyboardButton("Определить по геолокации 📍", request_location=True)])
     reply_keyboard.append(["Назад"])
     return ReplyKeyboardMarkup(reply_keyboard, one_time_keyboard=True, resize_keyboard=True)
 
@@ -256,7 +274,6 @@ async def choose_operation(update, context):
     logger.info("Завершение выбора операции")
     return AMOUNT
 
-from pytils import numeral  # Добавляем импорт в начало файла
 
 async def get_amount(update, context):
     user_id = update.message.from_user.id
@@ -274,35 +291,61 @@ async def get_amount(update, context):
 
     active_order, request_count, referrer_id, in_admin_mode = get_user_data(user_id)
     admin_id = referrer_id if referrer_id else bot_config["owner_id"]
-    admin_data = get_admin_data(admin_id)
+    catalog = get_catalog(admin_id)
 
     try:
-        amount = float(update.message.text.strip())
+        amount = to_decimal(update.message.text)
         logger.debug(f"Сумма {amount} успешно преобразована для {user_id}")
-        
-        if amount <= 0:
-            await update.message.reply_text(bot_config["messages"]["negative_amount"])
-            logger.info(f"Отрицательная сумма, остаёмся в AMOUNT для {user_id}")
+
+        operation = context.user_data['user_data']['operation']
+        pair = catalog.pairs.get(operation) or parse_pair(operation)
+        if amount <= 0 or amount < pair.min_amount:
+            if pair.min_amount > 0:
+                await update.message.reply_text(f"Минимальная сумма — {format_amount(pair.min_amount)}. Пожалуйста, попробуйте ещё раз.")
+            else:
+                await update.message.reply_text(bot_config["messages"]["negative_amount"])
+            logger.info(f"Сумма ниже минимума, остаёмся в AMOUNT для {user_id}")
             return AMOUNT
-        if amount > 1_000_000_000:
-            await update.message.reply_text("Сумма слишком большая! Максимум — 1 миллиард.")
+        if amount > pair.max_amount:
+            if pair.max_amount == DEFAULT_MAX_AMOUNT:
+                await update.message.reply_text("Сумма слишком большая! Максимум — 1 миллиард.")
+            else:
+                await update.message.reply_text(f"Сумма слишком большая! Максимум — {format_amount(pair.max_amount)}.")
             logger.info(f"Сумма превышает лимит, остаёмся в AMOUNT для {user_id}")
             return AMOUNT
-        
-        context.user_data.setdefault('user_data', {})
-        context.user_data['user_data']['amount'] = amount
 
-        operation = context.user_data['user_data']['operation']
-        rate = admin_data['rates'].get(operation, 1)
-        result = amount * rate
-        context.user_data['user_data']['result'] = result
-        logger.debug(f"Результат расчёта для {operation}: {result}")
+        try:
+            quote = catalog.quote(operation, amount)
+        except QuoteError as e:
+            logger.error(f"Не удалось посчитать курс для {user_id}: {str(e)}")
+            context.user_data.pop('user_data', None)
+            await update.message.reply_text(
+                "Курс для этой пары сейчас не задан. Выберите другую операцию.",
+                reply_markup=build_client_menu(user_id)
+            )
+            return CHOOSING
 
-        # Форматируем результат: до миллиона — без изменений, миллионы — с точками
-        formatted_result = str(int(result)) if int(result) < 1000000 else "{:,}".format(int(result)).replace(",", ".")
+        if quote.result <= 0:
+            await update.message.reply_text("Сумма слишком мала с учётом комиссии. Пожалуйста, укажите сумму больше.")
+            return AMOUNT
+
+        # В user_data и заявке суммы хранятся строками Decimal — без потерь при JSON-сериализации
+        context.user_data['user_data']['amount'] = str(quote.amount)
+        context.user_data['user_data']['rate'] = str(quote.rate)
+        context.user_data['user_data']['fee'] = str(quote.fee)
+        context.user_data['user_data']['result'] = str(quote.result)
+        result = quote.result
+        logger.debug(f"Результат расчёта для {operation}: {result} (курс {quote.rate}, кросс={quote.derived})")
+
+        formatted_result = format_amount(result)
         currency = get_currency(operation, result)
-        
-        reply_markup = build_location_menu(user_id)
+
+        if not available_locations(admin_id, get_admin_data(admin_id)['active_locations'], context.user_data['user_data']):
+            await update.message.reply_text("Сейчас ни в одной локации нет такой суммы наличных. Укажите сумму меньше.")
+            logger.info(f"Нет локаций с наличными на {formatted_result} {currency}, остаёмся в AMOUNT для {user_id}")
+            return AMOUNT
+
+        reply_markup = build_location_menu(user_id, context.user_data['user_data'])
         logger.debug(f"Меню локаций построено для {user_id}")
         
         text = f"Вы получите {formatted_result} {currency}.\nКуда доставить деньги? Выберите локацию:"
@@ -336,29 +379,9 @@ async def get_amount(update, context):
         await update.message.reply_text("Произошла ошибка. Попробуйте снова.")
         return AMOUNT
 
-# Новая функция для получения валюты с правильным склонением
+# Валюта выдачи с правильным склонением; пара разбирается один раз (ex_quotes.parse_pair)
 def get_currency(operation, result):
-    currency_raw = operation.split('→')[1].strip() if '→' in operation else "unknown"
-    currency_base = currency_raw.split()[0].lower()
-    currency_corrections = {
-        "рубли": "рубль", "рупии": "рупия", "донги": "донг", "юани": "юань", "баты": "бат", "usdt": "USDT"
-    }
-    currency_root = currency_corrections.get(currency_base, currency_base)
-    if currency_root == "usdt":
-        return "USDT"
-    else:
-        if currency_root == "рубль":
-            return numeral.choose_plural(int(result), ("рубль", "рубля", "рублей"))
-        elif currency_root == "рупия":
-            return numeral.choose_plural(int(result), ("рупия", "рупии", "рупий"))
-        elif currency_root == "донг":
-            return numeral.choose_plural(int(result), ("донг", "донга", "донгов"))
-        elif currency_root == "юань":
-            return numeral.choose_plural(int(result), ("юань", "юаня", "юаней"))
-        elif currency_root == "бат":
-            return numeral.choose_plural(int(result), ("бат", "бата", "батов"))
-        else:
-            return currency_root
+    return currency_name(operation, result)
 
 async def get_location(update, context):
     user_id = update.message.from_user.id
@@ -373,8 +396,23 @@ async def get_location(update, context):
             reply_markup=reply_markup
         )
         return AMOUNT
+    if update.message.location:
+        # Геолокация клиента → ближайшая активная зона; точное место берём из той же геолокации
+        location = match_location(admin_id, admin_data, update.message.location.latitude, update.message.location.longitude)
+        if location is None:
+            await update.message.reply_text("Рядом с вами нет зоны доставки. Пожалуйста, выберите локацию из списка.")
+            return LOCATION
+        logger.info(f"Геолокация user_id={user_id} сопоставлена с локацией {location}")
+        if not has_cash(admin_id, location, context.user_data['user_data']):
+            await update.message.reply_text(
+                f"В локации «{location}» сейчас не хватает наличных. Пожалуйста, выберите другую локацию.",
+                reply_markup=build_location_menu(user_id, context.user_data['user_data'])
+            )
+            return LOCATION
+        context.user_data['user_data']['location'] = location
+        return await get_fine_location(update, context)
     location = update.message.text
-    if location not in admin_data['active_locations']:
+    if location not in admin_data['active_locations'] or not has_cash(admin_id, location, context.user_data['user_data']):
         await update.message.reply_text("Пожалуйста, выберите локацию из предложенных ниже.")
         return LOCATION
 
@@ -424,20 +462,22 @@ async def get_fine_location(update, context):
         )
         return CHOOSING
 
+    latitude = longitude = None
     if update.message.location:
         latitude = update.message.location.latitude
         longitude = update.message.location.longitude
         fine_location = f"Геолокация: https://maps.google.com/?q={latitude},{longitude}"
     elif update.message.text and "maps.google.com" in update.message.text:
         fine_location = update.message.text
+        latitude, longitude = coordinates_from_text(fine_location) or (None, None)
     elif update.message.text == "Пропустить":
         fine_location = "Не указано"
     elif update.message.text == "Назад":
-        reply_markup = build_location_menu(user_id)
+        reply_markup = build_location_menu(user_id, context.user_data['user_data'])
         await send_message_with_retry(
             context,
             chat_id=user_id,
-            text=f"Вы получите {int(result)} {get_currency(operation, result)}. Куда доставить деньги? Выберите локацию:",
+            text=f"Вы получите {format_amount(result)} {get_currency(operation, result)}. Куда доставить деньги? Выберите локацию:",
             reply_markup=reply_markup
         )
         return LOCATION
@@ -453,6 +493,8 @@ async def get_fine_location(update, context):
     active_order_dict = {
         'operation': operation,
         'amount': amount,
+        'rate': context.user_data['user_data'].get('rate'),
+        'fee': context.user_data['user_data'].get('fee'),
         'result': result,
         'location': location,
         'fine_location': fine_location
@@ -465,12 +507,31 @@ async def get_fine_location(update, context):
         except json.JSONDecodeError:
             logger.error(f"Ошибка парсинга active_order для user_id={user_id}: {active_order}")
 
+    # Определяем, кому отправлять уведомление
+    if in_admin_mode and referrer_id == user_id:  # Админ тестирует бота
+        admin_chat_id = user_id
+    else:
+        admin_chat_id = referrer_id if referrer_id else bot_config["owner_id"]
+    created_at = int(time.time())
+    # Заявка и резерв наличных в локации пишутся одной транзакцией; пока клиент выбирал,
+    # наличные могли уйти под другие заявки — тогда возвращаем его к выбору локации
+    order_id = place_order(user_id, int(admin_chat_id), active_order_dict, latitude, longitude, created_at)
+    if order_id is None:
+        await send_message_with_retry(
+            context,
+            chat_id=user_id,
+            text=f"В локации «{location}» уже не хватает наличных. Пожалуйста, выберите другую локацию:",
+            reply_markup=build_location_menu(user_id, context.user_data['user_data'])
+        )
+        return LOCATION
+    logger.info(f"Заявка {order_id} клиента {user_id} записана для админа {admin_chat_id}")
+
     save_user_data(user_id, active_order_dict, referrer_id=referrer_id, in_admin_mode=in_admin_mode)  # Передаём словарь
     log_request(user_id)
 
     # Форматируем числа: до миллиона — без изменений, миллионы — с точками
-    formatted_amount = str(int(amount)) if int(amount) < 1000000 else "{:,}".format(int(amount)).replace(",", ".")
-    formatted_result = str(int(result)) if int(result) < 1000000 else "{:,}".format(int(result)).replace(",", ".")
+    formatted_amount = format_amount(amount)
+    formatted_result = format_amount(result)
     currency = get_currency(operation, result)
 
     # Отправляем подтверждение пользователю
@@ -490,12 +551,6 @@ async def get_fine_location(update, context):
         reply_markup=reply_markup
     )
 
-    # Определяем, кому отправлять уведомление
-    if in_admin_mode and referrer_id == user_id:  # Админ тестирует бота
-        admin_chat_id = user_id
-    else:
-        admin_chat_id = referrer_id if referrer_id else bot_config["owner_id"]
-
     # Функция экранирования для MarkdownV2
     def escape_md(text):
         special_chars = r'_*[]()~`>#+-=|{}.!'
@@ -532,6 +587,13 @@ async def get_fine_location(update, context):
     else:
         logger.error(f"Не удалось отправить уведомление админу в чат {admin_chat_id}")
 
+    # Встречные заявки для взаимозачёта (ex_netting)
+    netting_text = register_order(int(admin_chat_id), dict(
+        active_order_dict, order_id=order_id, user_id=user_id, created_at=created_at
+    ))
+    if netting_text:
+        await send_message_with_retry(context, chat_id=admin_chat_id, text=netting_text)
+
     # Очищаем временные данные
     context.user_data.pop('user_data', None)
     return CHOOSING
@@ -561,6 +623,8 @@ async def reload_config(update, context):
     try:
         from bot_config import load_config  # Исправляем импорт
         load_config()  # Перезагружаем конфиг
+        invalidate_quotes()  # Лимиты пар могли измениться
+        notify('config')  # Остальные процессы-обработчики перечитают его у себя
         logger.info(f"Конфигурация перезагружена пользователем {user_id}")
         await update.message.reply_text("Конфигурация успешно перезагружена!")
     except Exception as e:
@@ -574,7 +638,7 @@ async def check_subscriptions(application):
 
     while not stop_event.is_set():
         try:
-            conn = sqlite3.connect('database.db')
+            conn = get_connection()
             c = conn.cursor()
             c.execute('SELECT user_id, active_order FROM users WHERE active_order IS NOT NULL')
             users = c.fetchall()
@@ -605,13 +669,8 @@ async def check_subscriptions(application):
 
     logger.info("Фоновая задача check_subscriptions завершена")
 
-async def main():
-    init_db()  # Конфиг уже загружен в bot_config.py
-
-    # Инициализируем приложение
-    await application.initialize()
-
-    client_handler = ConversationHandler(
+def get_client_handler(persistent=False):
+    return ConversationHandler(
         entry_points=[
             CommandHandler('start', start),
             MessageHandler(filters.TEXT & ~filters.COMMAND, start)
@@ -619,18 +678,98 @@ async def main():
         states={
             CHOOSING: [MessageHandler(filters.TEXT & ~filters.COMMAND, choose_operation)],
             AMOUNT: [MessageHandler(filters.TEXT & ~filters.COMMAND, get_amount)],
-            LOCATION: [MessageHandler(filters.TEXT & ~filters.COMMAND, get_location)],
+            LOCATION: [MessageHandler((filters.TEXT & ~filters.COMMAND) | filters.LOCATION, get_location)],
             FINE_LOCATION: [MessageHandler(filters.TEXT | filters.LOCATION, get_fine_location)]
         },
-        fallbacks=[CommandHandler('cancel', cancel)]
+        fallbacks=[CommandHandler('cancel', cancel)],
+        name='client',
+        persistent=persistent
     )
-    admin_handler = get_admin_handler(cancel)
 
-    application.add_handler(admin_handler)
-    application.add_handler(client_handler)
-    application.add_handler(CommandHandler('otp', activate_otp))
-    application.add_handler(CommandHandler('reload_config', reload_config))
-    application.add_error_handler(error_handler)
+def register_handlers(app):
+    # Один и тот же набор хендлеров для боевого бота и для бенчмарков/реплея
+    # Состояния диалогов сохраняются в базу, если у приложения есть persistence (ex_persistence)
+    persistent = app.persistence is not None
+    admin_handler = get_admin_handler(cancel, persistent)
+    client_handler = get_client_handler(persistent)
+    app.add_handler(admin_handler)
+    app.add_handler(client_handler)
+    # Таймауты простоя и вытеснение данных давно молчащих пользователей (ex_sessions)
+    track_sessions(app, admin_handler, client_handler)
+    app.add_handler(CommandHandler('otp', activate_otp))
+    app.add_handler(CommandHandler('otps', otp_batch_command))
+    app.add_handler(CommandHandler('reload_config', reload_config))
+    app.add_handler(CommandHandler('feed', feed_command))
+    app.add_handler(CommandHandler('propagate', propagate_command))
+    app.add_handler(CommandHandler('defaults', defaults_command))
+    app.add_handler(CommandHandler('history', history_command))
+    app.add_handler(CommandHandler('zone', zone_command))
+    app.add_handler(CommandHandler('route', route_command))
+    app.add_handler(CommandHandler('done', done_command))
+    app.add_handler(CommandHandler('reject', reject_command))
+    app.add_handler(CommandHandler('cash', cash_command))
+    app.add_handler(CommandHandler('stats', stats_command))
+    app.add_handler(CommandHandler('export', export_command))
+    app.add_handler(CommandHandler('backup', backup_command))
+    app.add_handler(CommandHandler('maintenance', maintenance_command))
+    app.add_handler(CommandHandler('exposure', exposure_command))
+    app.add_handler(CommandHandler('sessions', sessions_command))
+    app.add_error_handler(error_handler)
+
+def start_background_tasks(application, primary=True):
+    # Сброс простаивающих диалогов и вытеснение сессий из памяти (секция sessions в config.json):
+    # у каждого процесса-обработчика свои сессии
+    asyncio.create_task(run_session_sweeper(application))
+    if not primary:
+        return
+
+    # Фид курсов (rate_feed в config.json): периодически пересчитывает курсы подписанных админов
+    if (bot_config.get("rate_feed") or {}).get("source"):
+        asyncio.create_task(run_rate_feed(application))
+
+    # Резервные копии базы по расписанию (backup.interval в config.json, 0 — только по /backup)
+    asyncio.create_task(run_backups(application))
+
+    # Обслуживание базы: просроченные коды, статистика планировщика, инкрементальный вакуум
+    asyncio.create_task(run_maintenance_loop(application))
+
+    # Журнал заявок есть, а сводок ещё нет (первый запуск после обновления) — собираем их в фоне
+    if needs_backfill():
+        asyncio.create_task(run_backfill())
+
+async def main():
+    init_db()  # Конфиг уже загружен в bot_config.py
+
+    # Запись входящих апдейтов для офлайн-реплея (bench.replay)
+    recorder = None
+    if os.getenv("UPDATE_RECORD_FILE"):
+        recorder = UpdateRecorder(
+            os.getenv("UPDATE_RECORD_FILE"),
+            anonymize=os.getenv("UPDATE_RECORD_ANONYMIZE") == "1",
+            keep_ids=[bot_config["owner_id"]]
+        )
+        logger.info(f"Запись апдейтов в {recorder.path}")
+
+    # WORKERS=N: этот процесс только принимает апдейты и раздаёт их N процессам по user_id (ex_shards)
+    workers = int(os.getenv("WORKERS", "1"))
+    if workers > 1:
+        enable_wal()
+        try:
+            await run_sharded(application, workers, recorder)
+        finally:
+            if recorder:
+                recorder.close()
+        return
+
+    # Хендлеры добавляются до initialize: сохраняемые диалоги подключаются к persistence при инициализации
+    register_handlers(application)
+    if recorder:
+        application.add_handler(TypeHandler(telegram.Update, recorder.record), group=-1)
+
+    # Инициализируем приложение
+    await application.initialize()
+
+    start_background_tasks(application)
 
     def signal_handler(sig, frame):
         logger.info("Получен сигнал завершения, останавливаем бота...")
@@ -688,6 +827,8 @@ async def main():
             break
 
     # Финальная остановка
+    if recorder:
+        recorder.close()
     try:
         await application.shutdown()
         logger.info("Бот завершил работу")
@@ -1,13 +1,49 @@
 import sqlite3
 import json
-from datetime import datetime, timedelta
+import os
+from datetime import datetime, timedelta, timezone
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Путь к базе можно переопределить через окружение (бенчмарки, тестовые стенды)
+DB_PATH = os.getenv("DB_PATH", "database.db")
+
+# Режимы журнала и синхронизации (например, WAL и NORMAL); пусто — значения SQLite по умолчанию
+DB_JOURNAL_MODE = os.getenv("DB_JOURNAL_MODE")
+DB_SYNCHRONOUS = os.getenv("DB_SYNCHRONOUS")
+
+# Необязательный колбэк трассировки SQL, вешается на каждое новое соединение
+_trace_callback = None
+
+def set_trace_callback(callback):
+    global _trace_callback
+    _trace_callback = callback
+
+def get_connection(path=None):
+    conn = sqlite3.connect(path or DB_PATH)
+    if _trace_callback is not None:
+        conn.set_trace_callback(_trace_callback)
+    if DB_JOURNAL_MODE:
+        conn.execute(f"PRAGMA journal_mode={DB_JOURNAL_MODE}")
+    if DB_SYNCHRONOUS:
+        conn.execute(f"PRAGMA synchronous={DB_SYNCHRONOUS}")
+    return conn
+
+def enable_wal():
+    """В базу пишут несколько процессов (ex_shards): в WAL читатели не ждут писателя. Режим хранится в файле базы."""
+    if DB_JOURNAL_MODE:
+        return  # Режим задан явно через окружение
+    conn = get_connection()
+    try:
+        mode = conn.execute("PRAGMA journal_mode=WAL").fetchone()[0]
+        logger.info(f"Режим журнала базы: {mode}")
+    finally:
+        conn.close()
+
 def init_db():
     try:
-        conn = sqlite3.connect('database.db')
+        conn = get_connection()
         c = conn.cursor()
         # Создаём таблицу, если она ещё не существует
         c.execute('''
@@ -26,6 +62,8 @@ def init_db():
         if 'in_admin_mode' not in columns:
             c.execute('ALTER TABLE users ADD COLUMN in_admin_mode INTEGER DEFAULT 0')
             logger.info("Добавлена колонка in_admin_mode в таблицу users")
+        # Клиенты админа (выгрузка ex_export) выбираются по referrer_id
+        c.execute('CREATE INDEX IF NOT EXISTS idx_users_referrer ON users(referrer_id)')
         # Создаём остальные таблицы
         c.execute('''
             CREATE TABLE IF NOT EXISTS admins (
@@ -34,9 +72,36 @@ def init_db():
                 locations TEXT,
                 active_locations TEXT,
                 pairs TEXT,
-                active_pairs TEXT
+                active_pairs TEXT,
+                version INTEGER DEFAULT 0,
+                tiers TEXT,
+                feed_margins TEXT,
+                propagate_optout TEXT,
+                zones TEXT
             )
         ''')
+        # Версия профиля админа растёт при каждом сохранении — по ней сбрасываются кэши (курсы, меню)
+        c.execute("PRAGMA table_info(admins)")
+        columns = [col[1] for col in c.fetchall()]
+        if 'version' not in columns:
+            c.execute('ALTER TABLE admins ADD COLUMN version INTEGER DEFAULT 0')
+            logger.info("Добавлена колонка version в таблицу admins")
+        if 'tiers' not in columns:
+            c.execute('ALTER TABLE admins ADD COLUMN tiers TEXT')
+            logger.info("Добавлена колонка tiers в таблицу admins")
+        # Правила наценки для фида курсов (ex_feed); NULL — админ не подписан на фид
+        if 'feed_margins' not in columns:
+            c.execute('ALTER TABLE admins ADD COLUMN feed_margins TEXT')
+            logger.info("Добавлена колонка feed_margins в таблицу admins")
+        # Поля, в которые владелец не может разливать дефолты (ex_propagate); JSON-список
+        if 'propagate_optout' not in columns:
+            c.execute('ALTER TABLE admins ADD COLUMN propagate_optout TEXT')
+            logger.info("Добавлена колонка propagate_optout в таблицу admins")
+        # Координаты/многоугольники локаций для автоподбора по геолокации (ex_geo)
+        if 'zones' not in columns:
+            c.execute('ALTER TABLE admins ADD COLUMN zones TEXT')
+            logger.info("Добавлена колонка zones в таблицу admins")
+        c.execute('CREATE INDEX IF NOT EXISTS idx_admins_feed ON admins(admin_id) WHERE feed_margins IS NOT NULL')
         c.execute('''
             CREATE TABLE IF NOT EXISTS otps (
                 otp TEXT PRIMARY KEY,
@@ -45,6 +110,75 @@ def init_db():
                 duration INTEGER
             )
         ''')
+        # Просроченные коды вычищаются пачками по сроку (ex_maintenance); формат срока сортируется как текст
+        c.execute('CREATE INDEX IF NOT EXISTS idx_otps_expiry ON otps(expiry)')
+        # Журнал заявок: active_order хранит только последнюю заявку клиента
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS orders (
+                order_id INTEGER PRIMARY KEY,
+                user_id INTEGER NOT NULL,
+                admin_id INTEGER NOT NULL,
+                created_at INTEGER NOT NULL,
+                operation TEXT,
+                amount TEXT,
+                rate TEXT,
+                fee TEXT,
+                result TEXT,
+                location TEXT,
+                fine_location TEXT,
+                latitude REAL,
+                longitude REAL,
+                status TEXT NOT NULL DEFAULT 'open',
+                reserved_asset TEXT,
+                reserved INTEGER
+            )
+        ''')
+        # Резерв наличных под заявку (ex_inventory): актив и сумма в минимальных единицах валюты
+        c.execute("PRAGMA table_info(orders)")
+        columns = [col[1] for col in c.fetchall()]
+        if 'reserved_asset' not in columns:
+            c.execute('ALTER TABLE orders ADD COLUMN reserved_asset TEXT')
+            c.execute('ALTER TABLE orders ADD COLUMN reserved INTEGER')
+            logger.info("Добавлены колонки резерва в таблицу orders")
+        c.execute('CREATE INDEX IF NOT EXISTS idx_orders_admin_status ON orders(admin_id, status, created_at)')
+        # Наличные по локациям: учитываются только пары (локация, валюта), которые админ завёл сам
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS inventory (
+                admin_id INTEGER NOT NULL,
+                location TEXT NOT NULL,
+                asset TEXT NOT NULL,
+                balance INTEGER NOT NULL DEFAULT 0 CHECK (balance >= 0),
+                reserved INTEGER NOT NULL DEFAULT 0 CHECK (reserved >= 0),
+                PRIMARY KEY (admin_id, location, asset)
+            ) WITHOUT ROWID
+        ''')
+        # Дневные сводки заявок (ex_stats): обновляются в одной транзакции с заявкой
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS order_rollups (
+                admin_id INTEGER NOT NULL,
+                day TEXT NOT NULL,
+                operation TEXT NOT NULL,
+                location TEXT NOT NULL,
+                orders INTEGER NOT NULL DEFAULT 0,
+                done INTEGER NOT NULL DEFAULT 0,
+                cancelled INTEGER NOT NULL DEFAULT 0,
+                amount INTEGER NOT NULL DEFAULT 0,
+                result INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (admin_id, day, operation, location)
+            ) WITHOUT ROWID
+        ''')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_rollups_day ON order_rollups(day)')
+        # Сессии, вытесненные из памяти (ex_sessions): user_data и состояния диалогов в JSON
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS sessions (
+                user_id INTEGER PRIMARY KEY,
+                data TEXT NOT NULL,
+                states TEXT NOT NULL,
+                seen_at INTEGER NOT NULL,
+                saved_at INTEGER NOT NULL
+            )
+        ''')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_sessions_saved ON sessions(saved_at)')
         conn.commit()
         logger.info("База данных успешно инициализирована")
     except sqlite3.Error as e:
@@ -56,7 +190,7 @@ def init_db():
 def get_user_data(user_id):
     conn = None
     try:
-        conn = sqlite3.connect('database.db')
+        conn = get_connection()
         c = conn.cursor()
         c.execute('SELECT active_order, request_count, referrer_id, in_admin_mode FROM users WHERE user_id = ?', (user_id,))
         result = c.fetchone()
@@ -70,9 +204,28 @@ def get_user_data(user_id):
         if conn:
             conn.close()
 
+def is_active_admin(user_id):
+    """Владелец или админ с неистёкшей подпиской. active_order разбирается как JSON: в нём бывает
+    текст клиента (fine_location), так что поиск подстроки 'admin_expiry' пропустил бы кого угодно."""
+    from bot_config import bot_config
+    if str(user_id) == bot_config["owner_id"]:
+        return True
+    active_order, _, _, _ = get_user_data(user_id)
+    if not active_order:
+        return False
+    try:
+        order = json.loads(active_order)
+        if not isinstance(order, dict) or 'admin_expiry' not in order:
+            return False
+        expiry = datetime.strptime(order['admin_expiry'], '%Y-%m-%d %H:%M:%S')
+    except (TypeError, ValueError):
+        return False
+    # Срок записывается в UTC (ex_owner.activate_otp)
+    return datetime.now(timezone.utc).replace(tzinfo=None) <= expiry
+
 def save_user_data(user_id, active_order, referrer_id=None, in_admin_mode=None):
     try:
-        conn = sqlite3.connect('database.db')
+        conn = get_connection()
         c = conn.cursor()
         c.execute('SELECT COUNT(*) FROM users WHERE user_id = ?', (user_id,))
         exists = c.fetchone()[0] > 0
@@ -145,7 +298,7 @@ def save_user_data(user_id, active_order, referrer_id=None, in_admin_mode=None):
 def check_request_limit(user_id):
     from exbot import bot_config  # Локальный импорт bot_config
     try:
-        conn = sqlite3.connect('database.db')
+        conn = get_connection()
         c = conn.cursor()
         
         # Проверяем, является ли пользователь владельцем
@@ -186,7 +339,7 @@ def check_request_limit(user_id):
 
 def log_request(user_id):
     try:
-        conn = sqlite3.connect('database.db')
+        conn = get_connection()
         c = conn.cursor()
         current_date = datetime.now().strftime('%Y-%m-%d')
         c.execute('UPDATE users SET request_count = request_count + 1, last_request_date = ? WHERE user_id = ?',
@@ -201,9 +354,9 @@ def log_request(user_id):
 
 def get_admin_data(admin_id):
     try:
-        conn = sqlite3.connect('database.db')
+        conn = get_connection()
         c = conn.cursor()
-        c.execute('SELECT rates, locations, active_locations, pairs, active_pairs FROM admins WHERE admin_id = ?', (admin_id,))
+        c.execute('SELECT rates, locations, active_locations, pairs, active_pairs, version, tiers, zones FROM admins WHERE admin_id = ?', (admin_id,))
         result = c.fetchone()
         if result:
             return {
@@ -211,7 +364,10 @@ def get_admin_data(admin_id):
                 'locations': json.loads(result[1]) if result[1] else [],
                 'active_locations': json.loads(result[2]) if result[2] else [],
                 'pairs': json.loads(result[3]) if result[3] else [],
-                'active_pairs': json.loads(result[4]) if result[4] else []
+                'active_pairs': json.loads(result[4]) if result[4] else [],
+                'version': result[5] or 0,
+                'tiers': json.loads(result[6]) if result[6] else {},
+                'zones': json.loads(result[7]) if result[7] else {}
             }
         from exbot import bot_config
         default_data = {
@@ -219,7 +375,9 @@ def get_admin_data(admin_id):
             'locations': bot_config["default_locations"],
             'active_locations': bot_config["default_active_locations"],
             'pairs': bot_config["default_pairs"],
-            'active_pairs': bot_config["default_active_pairs"]
+            'active_pairs': bot_config["default_active_pairs"],
+            'tiers': {},
+            'zones': {}
         }
         save_admin_data(admin_id, default_data)
         return default_data
@@ -229,42 +387,211 @@ def get_admin_data(admin_id):
     finally:
         conn.close()
 
-def save_admin_data(admin_id, admin_data):
+def save_admin_data(admin_id, admin_data, expected_version=None):
+    """Сохраняет профиль админа и возвращает новую версию.
+
+    С expected_version запись проходит, только если профиль не менялся с этой
+    версии (иначе None) — так массовые правки не затирают чужие изменения.
+    """
+    params = (
+        json.dumps(admin_data['rates']),
+        json.dumps(admin_data['locations']),
+        json.dumps(admin_data['active_locations']),
+        json.dumps(admin_data['pairs']),
+        json.dumps(admin_data['active_pairs']),
+        json.dumps(admin_data.get('tiers') or {}),
+        json.dumps(admin_data.get('zones') or {}, ensure_ascii=False)
+    )
     try:
-        conn = sqlite3.connect('database.db')
+        conn = get_connection()
         c = conn.cursor()
-        c.execute('''
-            INSERT OR REPLACE INTO admins (admin_id, rates, locations, active_locations, pairs, active_pairs)
-            VALUES (?, ?, ?, ?, ?, ?)
-        ''', (
-            admin_id,
-            json.dumps(admin_data['rates']),
-            json.dumps(admin_data['locations']),
-            json.dumps(admin_data['active_locations']),
-            json.dumps(admin_data['pairs']),
-            json.dumps(admin_data['active_pairs'])
-        ))
+        if expected_version is not None:
+            c.execute('''
+                UPDATE admins SET rates = ?, locations = ?, active_locations = ?, pairs = ?, active_pairs = ?,
+                    tiers = ?, zones = ?, version = COALESCE(version, 0) + 1
+                WHERE admin_id = ? AND COALESCE(version, 0) = ?
+                RETURNING version
+            ''', params + (admin_id, expected_version))
+        else:
+            c.execute('''
+                INSERT INTO admins (admin_id, rates, locations, active_locations, pairs, active_pairs, tiers, zones, version)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, 1)
+                ON CONFLICT(admin_id) DO UPDATE SET
+                    rates = excluded.rates,
+                    locations = excluded.locations,
+                    active_locations = excluded.active_locations,
+                    pairs = excluded.pairs,
+                    active_pairs = excluded.active_pairs,
+                    tiers = excluded.tiers,
+                    zones = excluded.zones,
+                    version = COALESCE(admins.version, 0) + 1
+                RETURNING version
+            ''', (admin_id,) + params)
+        row = c.fetchone()
         conn.commit()
+        if row is None:
+            logger.warning(f"Данные админа {admin_id} не сохранены: версия изменилась с {expected_version}")
+            return None
+        admin_data['version'] = row[0]
         logger.debug(f"Данные админа {admin_id} сохранены: {admin_data}")
+        try:
+            from ex_history import record_rates  # Локальный импорт: ex_history сам зависит от utils
+            record_rates(admin_id, admin_data['rates'])
+        except sqlite3.Error as e:
+            # История — вспомогательные данные, сохранение профиля из-за неё не откатываем
+            logger.error(f"Не удалось записать историю курсов админа {admin_id}: {e}")
+        return admin_data['version']
     except sqlite3.Error as e:
         logger.error(f"Ошибка при сохранении данных админа {admin_id}: {e}")
         raise
     finally:
         conn.close()
 
+def get_feed_margins(admin_id):
+    try:
+        conn = get_connection()
+        c = conn.cursor()
+        c.execute('SELECT feed_margins FROM admins WHERE admin_id = ?', (admin_id,))
+        result = c.fetchone()
+        return json.loads(result[0]) if result and result[0] else None
+    except sqlite3.Error as e:
+        logger.error(f"Ошибка при получении правил фида админа {admin_id}: {e}")
+        raise
+    finally:
+        conn.close()
+
+def save_feed_margins(admin_id, margins):
+    # Профиль (курсы) не меняется, поэтому версия не растёт — кэши сбросит следующий прогон фида
+    try:
+        conn = get_connection()
+        c = conn.cursor()
+        c.execute('UPDATE admins SET feed_margins = ? WHERE admin_id = ?',
+                  (json.dumps(margins, ensure_ascii=False) if margins is not None else None, admin_id))
+        conn.commit()
+        logger.info(f"Правила фида админа {admin_id}: {margins}")
+    except sqlite3.Error as e:
+        logger.error(f"Ошибка при сохранении правил фида админа {admin_id}: {e}")
+        raise
+    finally:
+        conn.close()
+
+def get_propagate_optout(admin_id):
+    try:
+        conn = get_connection()
+        c = conn.cursor()
+        c.execute('SELECT propagate_optout FROM admins WHERE admin_id = ?', (admin_id,))
+        result = c.fetchone()
+        return json.loads(result[0]) if result and result[0] else []
+    except sqlite3.Error as e:
+        logger.error(f"Ошибка при получении отказов от дефолтов админа {admin_id}: {e}")
+        raise
+    finally:
+        conn.close()
+
+def save_propagate_optout(admin_id, fields):
+    try:
+        conn = get_connection()
+        c = conn.cursor()
+        c.execute('UPDATE admins SET propagate_optout = ? WHERE admin_id = ?',
+                  (json.dumps(sorted(fields)) if fields else None, admin_id))
+        conn.commit()
+        logger.info(f"Отказы от дефолтов админа {admin_id}: {fields}")
+    except sqlite3.Error as e:
+        logger.error(f"Ошибка при сохранении отказов от дефолтов админа {admin_id}: {e}")
+        raise
+    finally:
+        conn.close()
+
+def insert_order(c, user_id, admin_id, order, latitude=None, longitude=None, created_at=None, reserve=None):
+    """INSERT заявки на переданном курсоре, без commit: вызывающий сам ведёт транзакцию."""
+    from ex_stats import add_order  # Локальный импорт: ex_stats сам зависит от utils
+    reserved_asset, reserved = reserve or (None, None)
+    created_at = int(created_at if created_at is not None else datetime.now().timestamp())
+    c.execute('''
+        INSERT INTO orders (user_id, admin_id, created_at, operation, amount, rate, fee, result, location,
+            fine_location, latitude, longitude, reserved_asset, reserved)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', (
+        user_id, admin_id, created_at,
+        order.get('operation'), order.get('amount'), order.get('rate'), order.get('fee'), order.get('result'),
+        order.get('location'), order.get('fine_location'), latitude, longitude, reserved_asset, reserved
+    ))
+    add_order(c, admin_id, created_at, order)
+    return c.lastrowid
+
+def save_order(user_id, admin_id, order, latitude=None, longitude=None, created_at=None):
+    try:
+        conn = get_connection()
+        c = conn.cursor()
+        order_id = insert_order(c, user_id, admin_id, order, latitude, longitude, created_at)
+        conn.commit()
+        logger.debug(f"Заявка {order_id} клиента {user_id} сохранена для админа {admin_id}")
+        return order_id
+    except sqlite3.Error as e:
+        logger.error(f"Ошибка при сохранении заявки клиента {user_id}: {e}")
+        raise
+    finally:
+        conn.close()
+
+def get_open_orders(admin_id, since=None):
+    try:
+        conn = get_connection()
+        conn.row_factory = sqlite3.Row
+        c = conn.cursor()
+        c.execute('SELECT * FROM orders WHERE admin_id = ? AND status = ? AND created_at >= ? ORDER BY created_at',
+                  (admin_id, 'open', int(since or 0)))
+        return [dict(row) for row in c.fetchall()]
+    except sqlite3.Error as e:
+        logger.error(f"Ошибка при получении открытых заявок админа {admin_id}: {e}")
+        raise
+    finally:
+        conn.close()
+
+def set_order_status(admin_id, order_ids, status, from_status='open'):
+    """Меняет статус заявок админа; возвращает id заявок, которые действительно сменили статус.
+
+    В той же транзакции снимается резерв наличных: при 'done' деньги списываются
+    с остатка локации, при любом другом статусе возвращаются в доступные.
+    """
+    if not order_ids:
+        return []
+    try:
+        conn = get_connection()
+        c = conn.cursor()
+        c.execute('BEGIN IMMEDIATE')
+        placeholders = ','.join('?' * len(order_ids))
+        c.execute(f'UPDATE orders SET status = ? WHERE admin_id = ? AND status = ? AND order_id IN ({placeholders}) '
+                  f'RETURNING order_id, location, reserved_asset, reserved, created_at, operation',
+                  (status, admin_id, from_status, *order_ids))
+        rows = c.fetchall()
+        if from_status == 'open':
+            spent = rows if status == 'done' else []
+            c.executemany('UPDATE inventory SET balance = MAX(balance - ?, 0), reserved = MAX(reserved - ?, 0) '
+                          'WHERE admin_id = ? AND location = ? AND asset = ?',
+                          [(amount, amount, admin_id, location, asset) for _, location, asset, amount, _, _ in spent if asset])
+            released = rows if status != 'done' else []
+            c.executemany('UPDATE inventory SET reserved = MAX(reserved - ?, 0) '
+                          'WHERE admin_id = ? AND location = ? AND asset = ?',
+                          [(amount, admin_id, location, asset) for _, location, asset, amount, _, _ in released if asset])
+            from ex_stats import add_status  # Локальный импорт: ex_stats сам зависит от utils
+            add_status(c, admin_id, status, [(created_at, operation, location) for _, location, _, _, created_at, operation in rows])
+        conn.commit()
+        changed = [row[0] for row in rows]
+        logger.info(f"Заявки {changed} админа {admin_id}: {from_status} → {status}")
+        return changed
+    except sqlite3.Error as e:
+        conn.rollback()
+        logger.error(f"Ошибка при смене статуса заявок {order_ids} админа {admin_id}: {e}")
+        raise
+    finally:
+        conn.close()
+
 def save_otp_data(otp, user_id, expiry, duration):
+    # Таблица создаётся в init_db; совпавший код не перезаписывает чужой, а даёт IntegrityError
     try:
-        conn = sqlite3.connect('database.db')
+        conn = get_connection()
         c = conn.cursor()
-        c.execute('''
-            CREATE TABLE IF NOT EXISTS otps (
-                otp TEXT PRIMARY KEY,
-                user_id INTEGER,
-                expiry TEXT,
-                duration INTEGER
-            )
-        ''')
-        c.execute('INSERT OR REPLACE INTO otps (otp, user_id, expiry, duration) VALUES (?, ?, ?, ?)',
+        c.execute('INSERT INTO otps (otp, user_id, expiry, duration) VALUES (?, ?, ?, ?)',
                   (otp, user_id, expiry, duration))
         conn.commit()
         logger.debug(f"OTP {otp} сохранён для user_id={user_id}")
@@ -274,9 +601,56 @@ def save_otp_data(otp, user_id, expiry, duration):
     finally:
         conn.close()
 
+def insert_otp_batch(count, make_code, expiry, duration, max_attempts=10):
+    """Вставляет count новых кодов одной транзакцией и возвращает их.
+
+    Коды из make_code() проверяются уникальным индексом (PRIMARY KEY): при совпадении
+    с уже выданным кодом берётся новый, пока не кончатся попытки.
+    """
+    try:
+        conn = get_connection()
+        c = conn.cursor()
+        c.execute('BEGIN IMMEDIATE')
+        codes = []
+        for _ in range(count):
+            for _ in range(max_attempts):
+                otp = make_code()
+                c.execute('INSERT OR IGNORE INTO otps (otp, user_id, expiry, duration) VALUES (?, ?, ?, ?)',
+                          (otp, None, expiry, duration))
+                if c.rowcount:
+                    codes.append(otp)
+                    break
+                logger.warning(f"OTP {otp} уже выдан, генерируем другой")
+            else:
+                raise sqlite3.IntegrityError(f"не удалось сгенерировать уникальный OTP за {max_attempts} попыток")
+        conn.commit()
+        logger.info(f"Выдано OTP: {len(codes)}, срок {duration} дн.")
+        return codes
+    except sqlite3.Error as e:
+        conn.rollback()
+        logger.error(f"Ошибка при выдаче пачки OTP: {e}")
+        raise
+    finally:
+        conn.close()
+
+def claim_otp(otp):
+    """Забирает код одним DELETE … RETURNING: из двух одновременных активаций код получит только одна."""
+    try:
+        conn = get_connection()
+        c = conn.cursor()
+        c.execute('DELETE FROM otps WHERE otp = ? RETURNING user_id, expiry, duration', (otp,))
+        result = c.fetchone()
+        conn.commit()
+        return result
+    except sqlite3.Error as e:
+        logger.error(f"Ошибка при активации OTP {otp}: {e}")
+        return None
+    finally:
+        conn.close()
+
 def get_otp_data(otp):
     try:
-        conn = sqlite3.connect('database.db')
+        conn = get_connection()
         c = conn.cursor()
         c.execute('SELECT user_id, expiry, duration FROM otps WHERE otp = ?', (otp,))
         result = c.fetchone()
@@ -289,7 +663,7 @@ def get_otp_data(otp):
 
 def delete_otp(otp):
     try:
-        conn = sqlite3.connect('database.db')
+        conn = get_connection()
         c = conn.cursor()
         c.execute('DELETE FROM otps WHERE otp = ?', (otp,))
         conn.commit()